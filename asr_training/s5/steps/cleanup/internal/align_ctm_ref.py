@@ -17,6 +17,8 @@ import argparse
 import logging
 import sys
 
+import numpy as np
+
 sys.path.insert(0, 'steps')
 import libs.common as common_lib
 
@@ -77,6 +79,15 @@ def get_args():
                         from the normal Smith-Waterman alignment, where the
                         traceback will be from the maximum score.""")
 
+    parser.add_argument("--use-numpy-alignment", type=str,
+                        action=common_lib.StrToBoolAction,
+                        choices=["true", "false"], default=False,
+                        help="""Compute the alignment with numpy along the
+                        anti-diagonals of the score matrix, keeping only
+                        1-byte backpointers. Gives the same alignment as the
+                        pure Python implementation, but much faster and with
+                        much less memory for long references.""")
+
     parser.add_argument("--debug-only", type=str, default="false",
                         choices=["true", "false"],
                         help="Run test functions only")
@@ -228,10 +239,11 @@ def smith_waterman_alignment(ref, hyp, similarity_score_function,
             for hyp_index in range(1, hyp_len+1):
                 H[0][hyp_index] = H[0][hyp_index-1] + ins_score
                 bp[ref_index][hyp_index] = (ref_index, hyp_index-1)
-                logger.debug(
-                    "({0},{1}) -> ({2},{3}): {4}"
-                    "".format(ref_index, hyp_index-1, ref_index, hyp_index,
-                              H[ref_index][hyp_index]))
+                if verbose_level > 2:
+                    logger.debug(
+                        "({0},{1}) -> ({2},{3}): {4}"
+                        "".format(ref_index, hyp_index-1, ref_index, hyp_index,
+                                  H[ref_index][hyp_index]))
 
     max_score = -float("inf")
     max_score_element = (0, 0)
@@ -247,27 +259,30 @@ def smith_waterman_alignment(ref, hyp, similarity_score_function,
                         and sub_or_ok >= H[ref_index][hyp_index])):
                 H[ref_index][hyp_index] = sub_or_ok
                 bp[ref_index][hyp_index] = (ref_index-1, hyp_index-1)
-                logger.debug(
-                    "({0},{1}) -> ({2},{3}): {4} ({5},{6})"
-                    "".format(ref_index-1, hyp_index-1, ref_index, hyp_index,
-                              H[ref_index][hyp_index],
-                              ref[ref_index-1], hyp[hyp_index-1]))
+                if verbose_level > 2:
+                    logger.debug(
+                        "({0},{1}) -> ({2},{3}): {4} ({5},{6})"
+                        "".format(ref_index-1, hyp_index-1, ref_index, hyp_index,
+                                  H[ref_index][hyp_index],
+                                  ref[ref_index-1], hyp[hyp_index-1]))
 
             if H[ref_index-1][hyp_index] + del_score > H[ref_index][hyp_index]:
                 H[ref_index][hyp_index] = H[ref_index-1][hyp_index] + del_score
                 bp[ref_index][hyp_index] = (ref_index-1, hyp_index)
-                logger.debug(
-                    "({0},{1}) -> ({2},{3}): {4}"
-                    "".format(ref_index-1, hyp_index, ref_index, hyp_index,
-                              H[ref_index][hyp_index]))
+                if verbose_level > 2:
+                    logger.debug(
+                        "({0},{1}) -> ({2},{3}): {4}"
+                        "".format(ref_index-1, hyp_index, ref_index, hyp_index,
+                                  H[ref_index][hyp_index]))
 
             if H[ref_index][hyp_index-1] + ins_score > H[ref_index][hyp_index]:
                 H[ref_index][hyp_index] = H[ref_index][hyp_index-1] + ins_score
                 bp[ref_index][hyp_index] = (ref_index, hyp_index-1)
-                logger.debug(
-                    "({0},{1}) -> ({2},{3}): {4}"
-                    "".format(ref_index, hyp_index-1, ref_index, hyp_index,
-                              H[ref_index][hyp_index]))
+                if verbose_level > 2:
+                    logger.debug(
+                        "({0},{1}) -> ({2},{3}): {4}"
+                        "".format(ref_index, hyp_index-1, ref_index, hyp_index,
+                                  H[ref_index][hyp_index]))
 
             #if hyp_index == hyp_len and H[ref_index][hyp_index] >= max_score:
             if ((not align_full_hyp or hyp_index == hyp_len)
@@ -352,6 +367,188 @@ def smith_waterman_alignment(ref, hyp, similarity_score_function,
     return (output, max_score)
 
 
+# Backpointer codes of smith_waterman_alignment_numpy()
+_BP_NONE, _BP_DIAG, _BP_DEL, _BP_INS = 0, 1, 2, 3
+
+
+def smith_waterman_alignment_numpy(ref, hyp, correct_score, substitution_score,
+                                   del_score, ins_score,
+                                   eps_symbol="<eps>", align_full_hyp=True):
+    """Same as smith_waterman_alignment() with
+    similarity_score_function(x, y) = correct_score if x == y else
+    substitution_score, and with the same output.
+
+    The words are mapped to integers and the score matrix is computed one
+    anti-diagonal (ref_index + hyp_index = const) at a time with numpy, since
+    the cells of an anti-diagonal only depend on the previous two.
+    Only the last two anti-diagonals of scores are kept, and the backpointers
+    are stored as 1-byte codes. The scores along the traceback are recovered
+    from the backpointers.
+    """
+    ref_len = len(ref)
+    hyp_len = len(hyp)
+    if ref_len == 0 or hyp_len == 0:
+        return smith_waterman_alignment(
+            ref, hyp, lambda x, y: (correct_score if x == y
+                                    else substitution_score),
+            del_score, ins_score, eps_symbol=eps_symbol,
+            align_full_hyp=align_full_hyp)
+
+    vocab = {}
+    ref_ids = np.array([vocab.setdefault(x, len(vocab)) for x in ref],
+                       dtype=np.int64)
+    hyp_ids = np.array([vocab.setdefault(x, len(vocab)) for x in hyp],
+                       dtype=np.int64)
+    # The hypothesis index decreases along an anti-diagonal
+    hyp_ids_reversed = hyp_ids[::-1].copy()
+
+    init_score = -(hyp_len + 2) if align_full_hyp else 0
+
+    # bp[ref_index, hyp_index]; in the flattened matrix, the cells of
+    # anti-diagonal d are d + ref_index * hyp_len
+    bp = np.zeros((ref_len + 1, hyp_len + 1), dtype=np.uint8)
+    bp_flat = bp.reshape(-1)
+    if align_full_hyp:
+        bp[0, 1:] = _BP_INS
+
+    # Scores of the anti-diagonals d-2 and d-1, indexed by ref_index
+    H_prev2 = np.zeros(ref_len + 1, dtype=np.int64)
+    H_prev = np.zeros(ref_len + 1, dtype=np.int64)
+    # H[0][1] and H[1][0]
+    H_prev[0] = ins_score if align_full_hyp else 0
+
+    # Scores of the last column, for align_full_hyp
+    last_column = np.zeros(ref_len + 1, dtype=np.int64)
+    max_score = -float("inf")
+    max_score_element = (0, 0)
+
+    for d in range(2, ref_len + hyp_len + 1):
+        H_cur = np.empty(ref_len + 1, dtype=np.int64)
+        if d <= hyp_len:
+            H_cur[0] = d * ins_score if align_full_hyp else 0
+        if d <= ref_len:
+            H_cur[d] = 0
+        # Inner cells with 1 <= ref_index <= ref_len and 1 <= hyp_index
+        lo = max(1, d - hyp_len)
+        hi = min(ref_len, d - 1)
+        if lo <= hi:
+            ref_slice = ref_ids[lo - 1:hi]
+            hyp_slice = hyp_ids_reversed[hyp_len - d + lo:hyp_len - d + hi + 1]
+            sub_or_ok = H_prev2[lo - 1:hi] + np.where(
+                ref_slice == hyp_slice, correct_score, substitution_score)
+            if align_full_hyp:
+                take = sub_or_ok >= init_score
+            else:
+                take = sub_or_ok > 0
+            scores = np.where(take, sub_or_ok, init_score)
+            codes = np.where(take, _BP_DIAG, _BP_NONE).astype(np.uint8)
+
+            deletion = H_prev[lo - 1:hi] + del_score
+            take = deletion > scores
+            scores = np.where(take, deletion, scores)
+            codes[take] = _BP_DEL
+
+            insertion = H_prev[lo:hi + 1] + ins_score
+            take = insertion > scores
+            scores = np.where(take, insertion, scores)
+            codes[take] = _BP_INS
+
+            H_cur[lo:hi + 1] = scores
+            bp_flat[d + lo * hyp_len:d + hi * hyp_len + 1:hyp_len] = codes
+
+            if align_full_hyp:
+                if d - hyp_len >= lo:
+                    last_column[d - hyp_len] = scores[d - hyp_len - lo]
+            else:
+                # The last cell in the order of the Python implementation
+                # with the maximum score, i.e. the one with the largest
+                # ref_index (and then hyp_index).
+                diag_max = scores.max()
+                if diag_max >= max_score:
+                    ref_index = lo + len(scores) - 1 - int(
+                        np.argmax(scores[::-1]))
+                    if (diag_max > max_score
+                            or ref_index > max_score_element[0]
+                            or (ref_index == max_score_element[0]
+                                and d - ref_index > max_score_element[1])):
+                        max_score = int(diag_max)
+                        max_score_element = (ref_index, d - ref_index)
+        H_prev2, H_prev = H_prev, H_cur
+
+    if align_full_hyp:
+        column = last_column[1:]
+        ref_index = len(column) - 1 - int(np.argmax(column[::-1]))
+        max_score = int(column[ref_index])
+        max_score_element = (ref_index + 1, hyp_len)
+
+    ref_index, hyp_index = max_score_element
+    score = max_score
+    logger.debug("Alignment score: %s for (%d, %d)",
+                 score, ref_index, hyp_index)
+
+    def previous(ref_index, hyp_index):
+        code = bp[ref_index, hyp_index]
+        if code == _BP_DIAG:
+            return ref_index - 1, hyp_index - 1
+        if code == _BP_DEL:
+            return ref_index - 1, hyp_index
+        if code == _BP_INS:
+            return ref_index, hyp_index - 1
+        return 0, 0
+
+    def step_score(ref_index, hyp_index):
+        code = bp[ref_index, hyp_index]
+        if code == _BP_DIAG:
+            return (correct_score
+                    if ref_ids[ref_index - 1] == hyp_ids[hyp_index - 1]
+                    else substitution_score)
+        if code == _BP_DEL:
+            return del_score
+        return ins_score
+
+    output = []
+    while ((not align_full_hyp and score >= 0)
+           or (align_full_hyp and hyp_index > 0)):
+        prev_ref_index, prev_hyp_index = previous(ref_index, hyp_index)
+        if ((prev_ref_index, prev_hyp_index) == (ref_index, hyp_index)
+                or (prev_ref_index, prev_hyp_index) == (0, 0)):
+            if score != 0:
+                ref_word = ref[ref_index-1] if ref_index > 0 else eps_symbol
+                hyp_word = hyp[hyp_index-1] if hyp_index > 0 else eps_symbol
+                output.append((ref_word, hyp_word, prev_ref_index,
+                               prev_hyp_index, ref_index, hyp_index))
+
+                ref_index, hyp_index = (prev_ref_index, prev_hyp_index)
+                # H[0][0]
+                score = 0
+            break
+
+        if (ref_index == prev_ref_index + 1
+                and hyp_index == prev_hyp_index + 1):
+            # Substitution or correct
+            output.append((ref[ref_index-1], hyp[hyp_index-1],
+                           prev_ref_index, prev_hyp_index,
+                           ref_index, hyp_index))
+        elif prev_hyp_index == hyp_index:
+            # Deletion
+            output.append((ref[ref_index-1], eps_symbol,
+                           prev_ref_index, prev_hyp_index,
+                           ref_index, hyp_index))
+        else:
+            # Insertion
+            output.append((eps_symbol, hyp[hyp_index-1],
+                           prev_ref_index, prev_hyp_index,
+                           ref_index, hyp_index))
+
+        score -= step_score(ref_index, hyp_index)
+        ref_index, hyp_index = (prev_ref_index, prev_hyp_index)
+
+    assert (align_full_hyp or score == 0)
+
+    output.reverse()
+    return (output, max_score)
+
+
 def print_alignment(recording, alignment, out_file_handle):
     out_text = [recording]
     for line in alignment:
@@ -573,11 +770,19 @@ def run(args):
 
             logger.debug("Running Smith-Waterman alignment for %s", reco)
 
-            output, score = smith_waterman_alignment(
-                ref_text, hyp_array, eps_symbol=args.eps_symbol,
-                similarity_score_function=similarity_score_function,
-                del_score=del_score, ins_score=ins_score,
-                align_full_hyp=args.align_full_hyp)
+            if args.use_numpy_alignment:
+                output, score = smith_waterman_alignment_numpy(
+                    ref_text, hyp_array, eps_symbol=args.eps_symbol,
+                    correct_score=args.correct_score,
+                    substitution_score=-args.substitution_penalty,
+                    del_score=del_score, ins_score=ins_score,
+                    align_full_hyp=args.align_full_hyp)
+            else:
+                output, score = smith_waterman_alignment(
+                    ref_text, hyp_array, eps_symbol=args.eps_symbol,
+                    similarity_score_function=similarity_score_function,
+                    del_score=del_score, ins_score=ins_score,
+                    align_full_hyp=args.align_full_hyp)
 
             if args.hyp_format == "CTM":
                 ctm_edits = get_ctm_edits(output, hyp_lines[reco],
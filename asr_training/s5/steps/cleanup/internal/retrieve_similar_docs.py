@@ -124,6 +124,10 @@ def get_args():
                         from the neighboring documents is added to the
                         retrieved document.""")
 
+    parser.add_argument("--query-batch-size", type=int, default=256,
+                        help="""Maximum number of query documents that are
+                        scored together against the source documents.""")
+
     parser.add_argument("--source-text-id2doc-ids",
                         type=argparse.FileType('r'), required=True,
                         help="""A mapping from the source text to a list of
@@ -235,55 +239,63 @@ def get_document_ids(source_docs, indexes):
     return doc_ids
 
 
-def run(args):
-    """The main function that does all the processing.
-    Takes as argument the Namespace object obtained from _get_args().
-    """
-    query_id2source_text_id = read_map(args.query_id2source_text_id,
-                                       num_values_per_key=1)
-    source_text_id2doc_ids = read_map(args.source_text_id2doc_ids,
-                                      min_num_values_per_key=1)
-
-    source_text_id2tfidf = read_map(args.source_text_id2tfidf,
-                                    num_values_per_key=1)
-
-    num_queries = 0
-    prev_source_text_id = ""
-    for query_id, query_tfidf in tf_idf.read_tfidf_ark(args.query_tfidf):
-        num_queries += 1
-
-        # The source text from which a document is to be retrieved for the
-        # input query
-        source_text_id = query_id2source_text_id[query_id]
-
-        if prev_source_text_id != source_text_id:
-            source_tfidf = tf_idf.TFIDF()
-            source_tfidf.read(
-                open(source_text_id2tfidf[source_text_id]))
-            prev_source_text_id = source_text_id
-
-        # The source documents corresponding to the source text.
-        # This is set of documents which will be searched over for the query.
-        source_doc_ids = source_text_id2doc_ids[source_text_id]
-
-        scores = query_tfidf.compute_similarity_scores(
-            source_tfidf, source_docs=source_doc_ids, query_id=query_id)
+_source_tfidf_cache = {}
+
+
+def get_source_tfidf(source_text_id, source_text_id2tfidf):
+    """Reads the TF-IDF of the source documents of a source text. Only the
+    last one is kept in memory."""
+    if source_text_id not in _source_tfidf_cache:
+        _source_tfidf_cache.clear()
+        source_tfidf = tf_idf.TFIDF()
+        source_tfidf.read(
+            open(source_text_id2tfidf[source_text_id]))
+        _source_tfidf_cache[source_text_id] = source_tfidf.get_sparse()
+    return _source_tfidf_cache[source_text_id]
+
+
+def retrieve_batch(args, batch, source_text_id, source_text_id2doc_ids,
+                   source_text_id2tfidf):
+    """Retrieves the documents for a batch of queries with the same source
+    text. The queries are scored against all the source documents with one
+    sparse matrix product."""
+    if len(batch) == 0:
+        return
+    source_tfidf = get_source_tfidf(source_text_id, source_text_id2tfidf)
+
+    # The source documents corresponding to the source text.
+    # This is set of documents which will be searched over for the query.
+    source_doc_ids = source_text_id2doc_ids[source_text_id]
+
+    for query_id, query_tfidf in batch:
+        for term, doc in query_tfidf.tf_idf:
+            if doc != query_id:
+                raise RuntimeError("TF-IDF contains document {0}, which is "
+                                   "not the required query {1}.".format(
+                                       doc, query_id))
+    queries = tf_idf.SparseTFIDF.from_items(
+        [item for _, query_tfidf in batch
+         for item in query_tfidf.tf_idf.items()],
+        vocab=source_tfidf.vocab)
+    batch_scores = source_tfidf.similarity_scores(
+        queries, source_docs=source_doc_ids)
+
+    for query_id, _ in batch:
+        scores = batch_scores[queries.doc_index[query_id]]
 
         assert len(scores) > 0, (
             "Did not get scores for query {0}".format(query_id))
 
         if args.verbose > 2:
-            for tup, score in scores.items():
-                logger.debug("Score, {num}: {0} {1} {2}".format(
-                    tup[0], tup[1], score, num=num_queries))
+            for doc_id, score in zip(source_doc_ids, scores):
+                logger.debug("Score: {0} {1} {2}".format(
+                    query_id, doc_id, score))
 
-        best_index, best_doc_id = max(
-            enumerate(source_doc_ids), key=lambda x: scores[(query_id, x[1])])
-        best_score = scores[(query_id, best_doc_id)]
+        best_index = int(tf_idf.top_k(scores, 1)[0])
+        best_doc_id = source_doc_ids[best_index]
+        best_score = scores[best_index]
 
-        assert source_doc_ids[best_index] == best_doc_id
-        assert best_score == max([scores[(query_id, x)]
-                                  for x in source_doc_ids])
+        assert best_score == scores.max()
 
         best_indexes = {}
 
@@ -299,7 +311,7 @@ def run(args):
                     max(best_index - args.num_neighbors_to_search, 0),
                     min(best_index + args.num_neighbors_to_search + 1,
                         len(source_doc_ids))):
-                if (scores[(query_id, source_doc_ids[index])]
+                if (scores[index]
                         >= args.neighbor_tfidf_threshold * best_score):
                     best_indexes[index] = (1, 1)    # Type 2
                     if index > 0 and index - 1 in excluded_indexes:
@@ -334,6 +346,39 @@ def run(args):
             ["%s,%.2f,%.2f" % x for x in best_docs])),
                file=args.relevant_docs)
 
+
+def run(args):
+    """The main function that does all the processing.
+    Takes as argument the Namespace object obtained from _get_args().
+    """
+    query_id2source_text_id = read_map(args.query_id2source_text_id,
+                                       num_values_per_key=1)
+    source_text_id2doc_ids = read_map(args.source_text_id2doc_ids,
+                                      min_num_values_per_key=1)
+
+    source_text_id2tfidf = read_map(args.source_text_id2tfidf,
+                                    num_values_per_key=1)
+
+    num_queries = 0
+    batch = []
+    batch_source_text_id = None
+    for query_id, query_tfidf in tf_idf.read_tfidf_ark(args.query_tfidf):
+        num_queries += 1
+
+        # The source text from which a document is to be retrieved for the
+        # input query
+        source_text_id = query_id2source_text_id[query_id]
+
+        if (source_text_id != batch_source_text_id
+                or len(batch) >= args.query_batch_size):
+            retrieve_batch(args, batch, batch_source_text_id,
+                           source_text_id2doc_ids, source_text_id2tfidf)
+            batch = []
+            batch_source_text_id = source_text_id
+        batch.append((query_id, query_tfidf))
+    retrieve_batch(args, batch, batch_source_text_id,
+                   source_text_id2doc_ids, source_text_id2tfidf)
+
     if num_queries == 0:
         raise RuntimeError("Failed to retrieve any document.")
 
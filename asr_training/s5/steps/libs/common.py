@@ -12,12 +12,18 @@ commonly used in many kaldi python scripts.
 from __future__ import print_function
 from __future__ import division
 import argparse
+import json
 import logging
 import math
 import os
+import re
+import shutil
+import struct
 import subprocess
 import sys
 import threading
+import time
+import warnings
 
 try:
     import thread as thread_module
@@ -112,7 +118,7 @@ def check_if_cuda_compiled():
         return True
 
 
-def execute_command(command):
+def execute_command(command, num_slots=None):
     """ Runs a kaldi job in the foreground and waits for it to complete; raises an
         exception if its return status is nonzero.  The command is executed in
         'shell' mode so 'command' can involve things like pipes.  Often,
@@ -120,13 +126,27 @@ def execute_command(command):
         are merged with the calling process's stdout and stderr so they will
         appear on the screen.
 
+        If a JobScheduler was set with set_job_scheduler(), the command waits
+        until 'num_slots' CPU slots are free first (by default as many as
+        get_num_slots(command) returns).
+
         See also: get_command_stdout, background_command
     """
-    p = subprocess.Popen(command, shell=True)
-    p.communicate()
-    if p.returncode != 0:
+    if job_scheduler is not None:
+        if num_slots is None:
+            num_slots = get_num_slots(command)
+        returncode = job_scheduler.run(command, num_slots=num_slots,
+                                       require_zero_status=True)
+        if returncode is None:
+            raise Exception("Not running command because an earlier command "
+                            "failed: {0}".format(command))
+    else:
+        p = subprocess.Popen(command, shell=True)
+        p.communicate()
+        returncode = p.returncode
+    if returncode != 0:
         raise Exception("Command exited with status {0}: {1}".format(
-                p.returncode, command))
+                returncode, command))
 
 
 def get_command_stdout(command, require_zero_status = True):
@@ -165,7 +185,7 @@ def wait_for_background_commands():
         if not t == threading.current_thread():
             t.join()
 
-def background_command(command, require_zero_status = False):
+def background_command(command, require_zero_status = False, num_slots = None):
     """Executes a command in a separate thread, like running with '&' in the shell.
        If you want the program to die if the command eventually returns with
        nonzero status, then set require_zero_status to True.  'command' will be
@@ -178,6 +198,10 @@ def background_command(command, require_zero_status = False):
              # do something else while waiting for it to finish
              thread.join()
 
+       If a JobScheduler was set with set_job_scheduler(), the command is
+       only started once 'num_slots' CPU slots are free (by default as many
+       as get_num_slots(command) returns).
+
        See also:
          - wait_for_background_commands(), which can be used
            at the end of the program to wait for all these commands to terminate.
@@ -186,9 +210,15 @@ def background_command(command, require_zero_status = False):
 
     """
 
-    p = subprocess.Popen(command, shell=True)
-    thread = threading.Thread(target=background_command_waiter,
-                              args=(command, p, require_zero_status))
+    if job_scheduler is not None:
+        if num_slots is None:
+            num_slots = get_num_slots(command)
+        thread = threading.Thread(target=scheduled_command_waiter,
+                                  args=(command, require_zero_status, num_slots))
+    else:
+        p = subprocess.Popen(command, shell=True)
+        thread = threading.Thread(target=background_command_waiter,
+                                  args=(command, p, require_zero_status))
     thread.daemon=True  # make sure it exits if main thread is terminated
                         # abnormally.
     thread.start()
@@ -200,9 +230,30 @@ def background_command_waiter(command, popen_object, require_zero_status):
         a separate thread."""
 
     popen_object.communicate()
-    if popen_object.returncode != 0:
-        str = "Command exited with status {0}: {1}".format(
-            popen_object.returncode, command)
+    report_background_status(command, popen_object.returncode,
+                             require_zero_status)
+
+
+def scheduled_command_waiter(command, require_zero_status, num_slots):
+    """ This is the function that is called from background_command, in
+        a separate thread, if a JobScheduler is set."""
+
+    returncode = job_scheduler.run(command, num_slots=num_slots,
+                                   require_zero_status=require_zero_status)
+    report_background_status(command, returncode, require_zero_status)
+
+
+def report_background_status(command, returncode, require_zero_status):
+    """ Reports a nonzero exit status of a background command; 'returncode'
+        is None if the command was not run because an earlier one failed."""
+
+    if returncode != 0:
+        if returncode is None:
+            str = "Not running command because an earlier command failed: " \
+                  "{0}".format(command)
+        else:
+            str = "Command exited with status {0}: {1}".format(
+                returncode, command)
         if require_zero_status:
             logger.error(str)
             # thread.interrupt_main() sends a KeyboardInterrupt to the main
@@ -212,6 +263,179 @@ def background_command_waiter(command, popen_object, require_zero_status):
             logger.warning(str)
 
 
+def get_num_slots(command, num_jobs=1, max_jobs_run=None):
+    """ Returns the number of CPU slots that 'command' takes, i.e. the number
+        of its jobs that may run at the same time: the size of its 'JOB=a:b'
+        job array or the value of its '--nj' option ('num_jobs' if it has
+        neither), limited by the smallest value of its '--max-jobs-run'
+        options ('max_jobs_run' if it has none).  'num_jobs' and
+        'max_jobs_run' are the defaults of scripts like
+        steps/nnet3/get_egs.sh, which run several jobs on their own.
+
+        e.g. get_num_slots('run.pl JOB=1:10 foo.JOB.log bar') == 10
+    """
+    job_arrays = re.findall(r'\bJOB=(\d+):(\d+)\b', command)
+    nj_options = re.findall(r'--nj[= ]+(\d+)\b', command)
+    if job_arrays:
+        num_jobs = max(int(end) - int(start) + 1 for start, end in job_arrays)
+    elif nj_options:
+        num_jobs = max(int(nj) for nj in nj_options)
+    max_jobs_run_options = re.findall(r'--max-jobs-run[= ]+(\d+)\b', command)
+    if max_jobs_run_options:
+        max_jobs_run = min(int(m) for m in max_jobs_run_options)
+    if max_jobs_run is not None:
+        num_jobs = min(num_jobs, max_jobs_run)
+    return max(num_jobs, 1)
+
+
+def get_available_cores():
+    """ Returns the sorted list of CPU cores this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    import multiprocessing
+    return list(range(multiprocessing.cpu_count()))
+
+
+def wait_with_rusage(popen_object):
+    """ Waits for the process of 'popen_object' to finish and returns its
+        exit status (negative for a signal, like Popen.returncode) and the
+        resource usage of the process and its children, or None for the
+        resource usage where os.wait4() is not available."""
+    if not hasattr(os, 'wait4'):
+        popen_object.communicate()
+        return popen_object.returncode, None
+    while True:
+        try:
+            _, status, rusage = os.wait4(popen_object.pid, 0)
+            break
+        except InterruptedError:
+            continue
+    if os.WIFSIGNALED(status):
+        popen_object.returncode = -os.WTERMSIG(status)
+    else:
+        popen_object.returncode = os.WEXITSTATUS(status)
+    return popen_object.returncode, rusage
+
+
+class JobScheduler(object):
+    """ Runs the commands of execute_command() and background_command() on a
+        budget of CPU slots, so that the jobs of e.g. parallel training and
+        egs pipelines do not oversubscribe the cores of the machine.
+
+        A command waits until the number of slots it asks for is free (at
+        most all slots).  If 'pin_cores' is True, slot i is pinned to the
+        i'th available core (modulo the number of cores), and a command is
+        run with 'taskset' on the cores of its slots, which is inherited by
+        run.pl and the programs it runs; a command that gets fewer distinct
+        cores than the slots it asked for (e.g. a job array larger than the
+        budget) is not pinned, so that its jobs are not crowded on too few
+        cores.  Once a command that must succeed has failed, the commands
+        still waiting for slots are not run.  If 'log_file' is
+        given, the wall time, CPU time and maximum resident set size of each
+        command are appended to it, as one JSON object per line.
+
+        Usage:
+            common_lib.set_job_scheduler(common_lib.JobScheduler(
+                num_slots=8, log_file='exp/foo/log/jobs.jsonl'))
+    """
+
+    def __init__(self, num_slots=None, pin_cores=False, log_file=None):
+        self.cores = get_available_cores()
+        if num_slots is None or num_slots <= 0:
+            num_slots = len(self.cores)
+        self.num_slots = num_slots
+        self.pin_cores = pin_cores and shutil.which('taskset') is not None
+        if pin_cores and not self.pin_cores:
+            logger.warning("Not pinning jobs to cores, as 'taskset' was not "
+                           "found.")
+        self.free_slots = list(range(num_slots))
+        self.failed_command = None
+        self.condition = threading.Condition()
+        self.log_file = log_file
+        self.log_lock = threading.Lock()
+
+    def acquire(self, num_slots):
+        """ Waits until 'num_slots' slots are free and returns them, or
+            returns None if a command that must succeed has failed."""
+        num_slots = min(num_slots, self.num_slots)
+        with self.condition:
+            while (len(self.free_slots) < num_slots
+                   and self.failed_command is None):
+                self.condition.wait()
+            if self.failed_command is not None:
+                return None
+            slots = self.free_slots[:num_slots]
+            del self.free_slots[:num_slots]
+            return slots
+
+    def release(self, slots, failed_command=None):
+        with self.condition:
+            self.free_slots = sorted(self.free_slots + slots)
+            if failed_command is not None and self.failed_command is None:
+                self.failed_command = failed_command
+            self.condition.notify_all()
+
+    def run(self, command, num_slots=1, require_zero_status=False):
+        """ Runs 'command' in 'shell' mode once 'num_slots' slots are free
+            and returns its exit status, or None if it was not run because
+            a command that must succeed has failed."""
+        slots = self.acquire(num_slots)
+        if slots is None:
+            return None
+        cores = sorted(set(self.cores[slot % len(self.cores)]
+                           for slot in slots))
+        pin_cores = self.pin_cores and len(cores) >= num_slots
+        start_time = time.time()
+        returncode = None
+        try:
+            if pin_cores:
+                # taskset sets the affinity before the shell starts, which is
+                # not safe to do in the child process of a threaded program
+                # (preexec_fn); /bin/sh -c is what shell=True runs.
+                p = subprocess.Popen(
+                    ['taskset', '-c', ','.join(str(core) for core in cores),
+                     '/bin/sh', '-c', command])
+            else:
+                p = subprocess.Popen(command, shell=True)
+            returncode, rusage = wait_with_rusage(p)
+        finally:
+            self.release(slots, command if (returncode != 0
+                                            and require_zero_status)
+                         else None)
+        self.log_job(command, cores if pin_cores else None, len(slots),
+                     start_time, time.time() - start_time, returncode, rusage)
+        return returncode
+
+    def log_job(self, command, cores, num_slots, start_time, wall_time,
+                returncode, rusage):
+        if self.log_file is None:
+            return
+        record = {'command': ' '.join(command.split()),
+                  'num_slots': num_slots, 'cores': cores,
+                  'start_time': round(start_time, 3),
+                  'wall_time': round(wall_time, 3),
+                  'exit_status': returncode}
+        if rusage is not None:
+            record['user_time'] = round(rusage.ru_utime, 3)
+            record['sys_time'] = round(rusage.ru_stime, 3)
+            # kilobytes on Linux; the maximum of the individual processes
+            record['max_rss'] = rusage.ru_maxrss
+        with self.log_lock:
+            with open(self.log_file, 'a') as f:
+                print(json.dumps(record, sort_keys=True), file=f)
+
+
+# The JobScheduler used by execute_command() and background_command(), if any.
+job_scheduler = None
+
+
+def set_job_scheduler(scheduler):
+    """ Makes execute_command() and background_command() run their commands
+        with the JobScheduler 'scheduler'; None starts them right away."""
+    global job_scheduler
+    job_scheduler = scheduler
+
+
 def get_number_of_leaves_from_tree(alidir):
     stdout = get_command_stdout(
         "tree-info {0}/tree 2>/dev/null | grep num-pdfs".format(alidir))
@@ -445,6 +669,420 @@ def read_mat_ark(file_or_fd):
             fd.close()
 
 
+def read_key_binary(fd):
+    """Reads the key (utterance-id) of the next object in the archive opened
+    in binary mode as 'fd', and returns it as a str, or None at the end of
+    the file.  The space after the key is consumed.
+    """
+    key = bytearray()
+    while True:
+        char = fd.read(1)
+        if char == b'' or char == b' ':
+            break
+        key += char
+    key = key.strip()
+    if len(key) == 0:
+        return None   # end of file,
+    return key.decode('utf-8')
+
+
+def _read_int32_binary(fd):
+    # Kaldi writes the size of the type (4) before the value.
+    size, value = struct.unpack('<bi', fd.read(5))
+    if size != 4:
+        raise RuntimeError("Expected an int32 in Kaldi binary matrix, got "
+                           "a type of size {0}".format(size))
+    return value
+
+
+def _read_exactly(fd, num_bytes):
+    data = fd.read(num_bytes)
+    if len(data) != num_bytes:
+        raise RuntimeError("Kaldi binary matrix is truncated: expected {0} "
+                           "bytes, got {1}".format(num_bytes, len(data)))
+    return data
+
+
+def _read_compressed_matrix(fd, token):
+    """Reads the rest of a Kaldi compressed matrix, whose token ('CM', 'CM2'
+    or 'CM3') was already read, and returns it as a float32 numpy array.
+    This follows CompressedMatrix::CopyToMat() in kaldi's
+    matrix/compressed-matrix.cc.
+    """
+    import numpy as np
+
+    min_value, range_, num_rows, num_cols = struct.unpack(
+        '<ffii', _read_exactly(fd, 16))
+    min_value = np.float32(min_value)
+    range_ = np.float32(range_)
+    if token == 'CM':
+        # one byte per element with per-column headers, column-major.
+        headers = np.frombuffer(_read_exactly(fd, 8 * num_cols),
+                                dtype='<u2').reshape(num_cols, 4)
+        data = np.frombuffer(_read_exactly(fd, num_rows * num_cols),
+                             dtype=np.uint8).reshape(num_cols, num_rows)
+        percentiles = min_value + range_ * np.float32(1.52590218966964e-05) * \
+            headers.astype(np.float32)
+        p0 = percentiles[:, 0:1]
+        p25 = percentiles[:, 1:2]
+        p75 = percentiles[:, 2:3]
+        p100 = percentiles[:, 3:4]
+        data = data.astype(np.float32)
+        mat = np.where(
+            data <= 64, p0 + (p25 - p0) * data * np.float32(1 / 64.0),
+            np.where(data <= 192,
+                     p25 + (p75 - p25) * (data - 64) * np.float32(1 / 128.0),
+                     p75 + (p100 - p75) * (data - 192) * np.float32(1 / 63.0)))
+        return np.ascontiguousarray(mat.T, dtype=np.float32)
+    elif token == 'CM2':
+        # two bytes per element, row-major.
+        data = np.frombuffer(_read_exactly(fd, 2 * num_rows * num_cols),
+                             dtype='<u2').reshape(num_rows, num_cols)
+        increment = range_ * np.float32(1.0 / 65535.0)
+    else:
+        # one byte per element, row-major.
+        data = np.frombuffer(_read_exactly(fd, num_rows * num_cols),
+                             dtype=np.uint8).reshape(num_rows, num_cols)
+        increment = range_ * np.float32(1.0 / 255.0)
+    return (min_value + increment * data.astype(np.float32)).astype(np.float32)
+
+
+def _read_matrix_text_numpy(fd, fname):
+    """Reads the rest of a matrix in Kaldi text format, whose opening '['
+    was already read, from the binary-mode file object 'fd' and returns it
+    as a float64 numpy array.
+    """
+    import numpy as np
+
+    rows = []
+    while True:
+        line = fd.readline()
+        if len(line) == 0:
+            logger.error("Kaldi matrix file %s has incorrect format; "
+                         "got EOF before end of matrix", fname)
+            raise RuntimeError
+        line = line.strip()
+        if len(line) == 0:
+            continue  # skip empty line
+        if line.endswith(b']'):
+            line = line[:-1].strip()
+            if len(line) > 0:
+                rows.append(line)
+            break
+        rows.append(line)
+
+    if len(rows) == 0:
+        return np.zeros((0, 0))
+    num_cols = len(rows[0].split())
+    mat = np.fromstring(b' '.join(rows).decode('utf-8'), dtype=np.float64, sep=' ')
+    if mat.size != len(rows) * num_cols:
+        logger.error("Kaldi matrix file %s has incorrect format; the rows "
+                     "do not all have %d numbers", fname, num_cols)
+        raise RuntimeError
+    return mat.reshape(len(rows), num_cols)
+
+
+def _read_matrix_binary_numpy(fd, fname):
+    """Reads the rest of a matrix in Kaldi binary format, whose binary
+    header was already read, from the file object 'fd'.
+    """
+    import numpy as np
+
+    token = bytearray()
+    while True:
+        char = fd.read(1)
+        if char == b'' or char == b' ':
+            break
+        token += char
+    token = token.decode('utf-8')
+    if token in ('FM', 'DM'):
+        num_rows = _read_int32_binary(fd)
+        num_cols = _read_int32_binary(fd)
+        dtype = np.dtype('<f4' if token == 'FM' else '<f8')
+        data = _read_exactly(fd, num_rows * num_cols * dtype.itemsize)
+        return np.frombuffer(data, dtype=dtype).reshape(num_rows, num_cols).copy()
+    elif token in ('CM', 'CM2', 'CM3'):
+        return _read_compressed_matrix(fd, token)
+    logger.error("Kaldi matrix file %s has incorrect format, unsupported "
+                 "matrix type %s", fname, token)
+    raise RuntimeError
+
+
+def read_matrix_numpy(fd, fname=None):
+    """This function reads a matrix from the file object 'fd', which must be
+    opened in binary mode, at its current position, and returns it as a
+    numpy array.  The matrix can be in Kaldi binary format ('FM' or 'DM',
+    returned as float32 or float64), compressed format ('CM', 'CM2' or 'CM3',
+    returned as float32) or text format (returned as float64).
+    """
+    if fname is None:
+        fname = getattr(fd, 'name', '<stream>')
+
+    # skip the whitespace before the matrix.
+    char = fd.read(1)
+    while char in (b' ', b'\t', b'\n'):
+        char = fd.read(1)
+
+    if char == b'[':
+        return _read_matrix_text_numpy(fd, fname)
+    if char == b'\0' and fd.read(1) == b'B':
+        return _read_matrix_binary_numpy(fd, fname)
+    logger.error("Kaldi matrix file %s has incorrect format, expected "
+                 "a binary or text-format matrix", fname)
+    raise RuntimeError
+
+
+def read_mat_ark_numpy(file_or_fd):
+    """This function reads a kaldi matrix archive in binary, compressed or
+    text format and yields pairs of key (utterance-id) and numpy array
+    (see read_matrix_numpy() for the types of the arrays).
+    The input can be a file or an opened file descriptor; for a file
+    descriptor opened in text mode, e.g. sys.stdin, its binary buffer is
+    read.
+
+    Example usage:
+    mat_dict = { key: mat for key, mat in read_mat_ark_numpy(file) }
+    """
+    try:
+        fd = open(file_or_fd, 'rb')
+        fname = file_or_fd
+    except TypeError:
+        # 'file_or_fd' is opened file descriptor,
+        fd = getattr(file_or_fd, 'buffer', file_or_fd)
+        fname = getattr(file_or_fd, 'name', '<stream>')
+
+    try:
+        key = read_key_binary(fd)
+        while key:
+            mat = read_matrix_numpy(fd, fname)
+            yield key, mat
+            key = read_key_binary(fd)
+    finally:
+        if fd is not file_or_fd and fd is not getattr(file_or_fd, 'buffer', None):
+            fd.close()
+
+
+def _read_vec_int_binary_numpy(fd, fname):
+    """Reads the binary body of a Kaldi integer vector (after the '\\0B'
+    header), in which the length and each of the elements are written as
+    the size of the type (4) followed by the int32 value."""
+    import numpy as np
+
+    num_elements = _read_int32_binary(fd)
+    data = np.frombuffer(_read_exactly(fd, 5 * num_elements),
+                         dtype=[('size', 'i1'), ('value', '<i4')])
+    if np.any(data['size'] != 4):
+        logger.error("Kaldi integer vector in %s has elements that are "
+                     "not int32", fname)
+        raise RuntimeError
+    return data['value'].astype(np.int32)
+
+
+def read_vec_int_ark_numpy(file_or_fd):
+    """This function reads a kaldi integer vector archive (e.g. alignments)
+    in binary or text format and yields pairs of key (utterance-id) and
+    numpy int32 array.  The input can be a file or an opened file
+    descriptor; for a file descriptor opened in text mode, e.g. sys.stdin,
+    its binary buffer is read.
+
+    Example usage:
+    ali_dict = { key: ali for key, ali in read_vec_int_ark_numpy(file) }
+    """
+    import numpy as np
+
+    try:
+        fd = open(file_or_fd, 'rb')
+        fname = file_or_fd
+    except TypeError:
+        # 'file_or_fd' is opened file descriptor,
+        fd = getattr(file_or_fd, 'buffer', file_or_fd)
+        fname = getattr(file_or_fd, 'name', '<stream>')
+
+    try:
+        key = read_key_binary(fd)
+        while key:
+            char = fd.read(1)
+            if char == b'\0':
+                if fd.read(1) != b'B':
+                    logger.error("Kaldi integer vector archive %s has "
+                                 "incorrect format for key %s", fname, key)
+                    raise RuntimeError
+                vec = _read_vec_int_binary_numpy(fd, fname)
+            else:
+                line = (char + fd.readline()).decode('utf-8')
+                with warnings.catch_warnings():
+                    # numpy warns (rather than fails) when it cannot parse
+                    # the whole line.
+                    warnings.simplefilter('error', DeprecationWarning)
+                    try:
+                        vec = np.fromstring(line, dtype=np.int32, sep=' ')
+                    except (ValueError, DeprecationWarning):
+                        logger.error("Unable to parse integer vector for "
+                                     "key %s in %s", key, fname)
+                        raise RuntimeError
+            yield key, vec
+            key = read_key_binary(fd)
+    finally:
+        if fd is not file_or_fd and fd is not getattr(file_or_fd, 'buffer', None):
+            fd.close()
+
+
+def _parse_matrix_range(range_str, rxfilename):
+    """Parses a Kaldi matrix range like '0:9' or '0:9,2:3' (the ends are
+    inclusive, and ':' means all rows or columns) into a tuple of slices."""
+    slices = []
+    for part in range_str.split(','):
+        if part == ':' or part == '':
+            slices.append(slice(None))
+            continue
+        try:
+            first, last = [int(x) for x in part.split(':')]
+        except ValueError:
+            raise ValueError("Invalid range in rxfilename {0}".format(rxfilename))
+        slices.append(slice(first, last + 1))
+    if len(slices) == 1:
+        slices.append(slice(None))
+    if len(slices) != 2:
+        raise ValueError("Invalid range in rxfilename {0}".format(rxfilename))
+    return tuple(slices)
+
+
+def read_mat_numpy(rxfilename, open_files=None):
+    """This function reads the matrix specified by the Kaldi rxfilename
+    'rxfilename', as found in .scp files, and returns it as a numpy array.
+    The rxfilename can be 'file', 'file:offset' (the matrix is read at that
+    byte offset) or 'command |', and can be followed by a range of rows,
+    or of rows and columns, as in 'foo.ark:123[0:9]' or 'foo.ark:123[0:9,2:3]'
+    (the ends are inclusive, like in Kaldi).
+    If 'open_files' is a dict, the files are kept open in it, indexed by
+    file name, so that reading many matrices from the same archive does not
+    re-open it; the caller must close them.
+    """
+    mat_range = None
+    m = re.match(r'^(.*[^|\s])\s*\[([-0-9:,]*)\]$', rxfilename)
+    if m is not None:
+        rxfilename = m.group(1)
+        mat_range = _parse_matrix_range(m.group(2), rxfilename)
+
+    if rxfilename.endswith('|'):
+        p = subprocess.Popen(rxfilename[:-1], shell=True, stdout=subprocess.PIPE)
+        mat = read_matrix_numpy(p.stdout, rxfilename)
+        p.stdout.close()
+        if p.wait() != 0:
+            raise Exception("Command exited with status {0}: {1}".format(
+                p.returncode, rxfilename))
+    else:
+        m = re.match(r'^(.*):([0-9]+)$', rxfilename)
+        if m is not None:
+            filename, offset = m.group(1), int(m.group(2))
+        else:
+            filename, offset = rxfilename, 0
+        if open_files is not None and filename in open_files:
+            fd = open_files[filename]
+        else:
+            fd = open(filename, 'rb')
+            if open_files is not None:
+                open_files[filename] = fd
+        try:
+            fd.seek(offset)
+            mat = read_matrix_numpy(fd, filename)
+        finally:
+            if open_files is None:
+                fd.close()
+
+    if mat_range is not None:
+        row_range, col_range = mat_range
+        if ((row_range.stop is not None and row_range.stop > mat.shape[0]) or
+                (col_range.stop is not None and col_range.stop > mat.shape[1])):
+            raise ValueError("Range in rxfilename {0} is out of bounds for a "
+                             "matrix of size {1}".format(rxfilename, mat.shape))
+        mat = mat[row_range, col_range]
+    return mat
+
+
+def read_mat_scp_numpy(file_or_fd):
+    """This function reads a kaldi .scp file of matrices, e.g. feats.scp,
+    and yields pairs of key (utterance-id) and numpy array.  The matrices
+    are read by seeking to their offsets in the archives, which are only
+    opened once.
+    The input can be a file or an opened file descriptor.
+
+    Example usage:
+    for key, mat in read_mat_scp_numpy('data/train/feats.scp'):
+        ...
+    """
+    try:
+        fd = open(file_or_fd, 'r')
+    except TypeError:
+        # 'file_or_fd' is opened file descriptor,
+        fd = file_or_fd
+
+    open_files = {}
+    try:
+        for line in fd:
+            parts = line.strip().split(None, 1)
+            if len(parts) == 0:
+                continue
+            if len(parts) != 2:
+                raise Exception("Bad line in scp file: {0}".format(line.strip()))
+            key, rxfilename = parts
+            yield key, read_mat_numpy(rxfilename, open_files)
+    finally:
+        for f in open_files.values():
+            f.close()
+        if fd is not file_or_fd:
+            fd.close()
+
+
+def write_matrix_binary(file_or_fd, mat, key=None):
+    """This function writes the matrix 'mat' (a numpy array, or a list of
+    lists) in kaldi binary format: 'DM' if it is a float64 numpy array, and
+    'FM' otherwise.
+    The destination can be a file or an opened file descriptor; for a file
+    descriptor opened in text mode, e.g. sys.stdout, its binary buffer is
+    written to.
+    If key is provided, then matrix is written to an archive with the 'key'
+    as the index field.
+    Returns the byte offset of the matrix in the file, which is what goes
+    after the ':' in .scp files, or None if the file is not seekable.
+    """
+    import numpy as np
+
+    mat = np.asarray(mat)
+    if mat.dtype == np.float64:
+        token = b'DM '
+        mat = mat.astype('<f8', copy=False)
+    else:
+        token = b'FM '
+        mat = mat.astype('<f4', copy=False)
+    if mat.ndim != 2:
+        raise Exception("Expected a matrix, got an array of shape "
+                        "{0}".format(mat.shape))
+
+    try:
+        fd = open(file_or_fd, 'wb')
+    except TypeError:
+        # 'file_or_fd' is opened file descriptor,
+        if hasattr(file_or_fd, 'buffer'):
+            file_or_fd.flush()
+        fd = getattr(file_or_fd, 'buffer', file_or_fd)
+
+    try:
+        if key is not None:
+            fd.write(key.encode('utf-8') + b' ')
+        try:
+            offset = fd.tell()
+        except (IOError, OSError):
+            offset = None
+        fd.write(b'\0B' + token)
+        fd.write(struct.pack('<bibi', 4, mat.shape[0], 4, mat.shape[1]))
+        fd.write(np.ascontiguousarray(mat).tobytes())
+    finally:
+        if fd is not file_or_fd and fd is not getattr(file_or_fd, 'buffer', None):
+            fd.close()
+    return offset
+
+
 def force_symlink(file1, file2):
     import errno
     try:
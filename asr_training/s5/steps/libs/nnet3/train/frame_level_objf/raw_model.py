@@ -47,6 +47,11 @@ def generate_egs_using_targets(data, targets_scp, egs_dir,
             raise Exception("--num-targets is required if "
                             "target-type is sparse")
 
+    # get_egs_targets.sh runs --nj jobs (by default 6) at the same time
+    num_slots = common_lib.get_num_slots(
+        "{0} {1}".format(egs_opts if egs_opts is not None else '',
+                         run_opts.egs_command), num_jobs=6)
+
     common_lib.execute_command(
         """steps/nnet3/get_egs_targets.sh {egs_opts} \
                 --cmd "{command}" \
@@ -78,4 +83,5 @@ def generate_egs_using_targets(data, targets_scp, egs_dir,
                    data=data,
                    targets_scp=targets_scp, target_type=target_type,
                    egs_dir=egs_dir,
-                   egs_opts=egs_opts if egs_opts is not None else ''))
+                   egs_opts=egs_opts if egs_opts is not None else ''),
+        num_slots=num_slots)
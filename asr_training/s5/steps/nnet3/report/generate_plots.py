@@ -7,11 +7,19 @@
 from __future__ import division
 import argparse
 import errno
+import hashlib
+import json
 import logging
+import multiprocessing
 import os
+import pickle
 import re
 import sys
 import warnings
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
 
 sys.path.insert(0, 'steps')
 import libs.nnet3.report.log_parse as log_parse
@@ -25,7 +33,10 @@ try:
     from matplotlib.patches import Rectangle
     # matplotlib issue https://github.com/matplotlib/matplotlib/issues/12513
     # plt.subplot() generates a false-positive warninig, suppress it for now.
-    from matplotlib.cbook import MatplotlibDeprecationWarning
+    try:
+        from matplotlib import MatplotlibDeprecationWarning
+    except ImportError:
+        from matplotlib.cbook import MatplotlibDeprecationWarning
     warnings.filterwarnings('ignore', category=MatplotlibDeprecationWarning,
                             message='Adding an axes using the same arguments')
     g_plot = True
@@ -46,7 +57,8 @@ def get_args():
         description="Parses the training logs and generates a variety of plots.\n"
         "e.g.: %(prog)s \\\n"
         "  exp/nnet3/tdnn exp/nnet3/tdnn1 exp/nnet3/tdnn2 exp/nnet3/tdnn/report.\n"
-        "The report file 'report.pdf' will be generated in the <output_dir> directory.")
+        "The report file 'report.pdf' will be generated in the <output_dir> directory.\n"
+        "Figures whose data did not change since the last run are not rendered again.")
 
     parser.add_argument("--start-iter", type=int, metavar='N', default=1,
                         help="Iteration from which plotting will start.")
@@ -58,6 +70,13 @@ def get_args():
                         action=common_lib.NullstrToNoneAction,
                         help="List of space separated <output-node>:<objective-type> entries, "
                         "one for each output node")
+    parser.add_argument("--format", type=str, dest='figure_format', default='pdf',
+                        choices=['pdf', 'png'],
+                        help="Format of the figures.  With 'pdf' a LaTeX report 'report.pdf' "
+                        "is compiled; with 'png' a lightweight HTML page 'report.html' is "
+                        "written instead.")
+    parser.add_argument("--num-jobs", type=int, metavar='N', default=1,
+                        help="Number of processes that render the figures in parallel.")
     parser.add_argument("--comparison-dir", type=str, metavar='DIR', action='append',
                         help="[DEPRECATED] Experiment directories for comparison. "
                         "These will only be used for plots, not tables.")
@@ -114,16 +133,25 @@ class LatexReport(object):
 """
         self.document.append(fig_latex)
 
-    def close(self):
+    def close(self, figures_changed=True):
         self.document.append(r"\end{document}")
-        return self.compile()
+        return self.compile(figures_changed)
 
-    def compile(self):
+    def compile(self, figures_changed=True):
         root, ext = os.path.splitext(self.pdf_file)
         dir_name = os.path.dirname(self.pdf_file)
         latex_file = root + ".tex"
+        document = "\n".join(self.document)
+        if not figures_changed and os.path.exists(self.pdf_file):
+            try:
+                with open(latex_file) as lat_file:
+                    if lat_file.read() == document:
+                        logger.info("The LaTeX report is up to date.")
+                        return True
+            except IOError:
+                pass
         lat_file = open(latex_file, "w")
-        lat_file.write("\n".join(self.document))
+        lat_file.write(document)
         lat_file.close()
         logger.info("Compiling the LaTeX report.")
         try:
@@ -138,6 +166,96 @@ class LatexReport(object):
         return True
 
 
+class HtmlReport(object):
+    """Class for writing an HTML page with the figures, which is a lightweight
+    alternative to the LaTeX report"""
+
+    def __init__(self, html_file):
+        self.html_file = html_file
+        self.figures = []
+
+    def add_figure(self, figure_file, title):
+        self.figures.append((figure_file, title))
+
+    def close(self, figures_changed=True):
+        dir_name = os.path.dirname(self.html_file)
+        with open(self.html_file, "w") as f:
+            f.write("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n"
+                    "<title>{0}</title>\n</head>\n<body>\n".format(escape(dir_name)))
+            for figure_file, title in self.figures:
+                f.write("<h3>{0}</h3>\n<img src=\"{1}\">\n".format(
+                    escape(title),
+                    escape(os.path.relpath(figure_file, dir_name), quote=True)))
+            f.write("</body>\n</html>\n")
+        return True
+
+
+def render_figure(job):
+    """Calls plot_function(figure_file, *args) for a job of FigureRenderer;
+    this is run in the worker processes."""
+    figure_file, plot_function, args = job
+    plot_function(figure_file, *args)
+    plt.close('all')
+
+
+class FigureRenderer(object):
+    """Renders the figures of the report in a pool of 'num_jobs' processes.
+
+    The figures are added with the module-level function that plots them and
+    its arguments, which contain all the data of the figure.  A figure is not
+    rendered again if its file exists and the hash of the function, its
+    arguments and this script is the same as in the last run; the hashes are
+    stored in <output_dir>/figures.json.
+    """
+
+    def __init__(self, output_dir, figure_format='pdf', num_jobs=1):
+        self.output_dir = output_dir
+        self.figure_format = figure_format
+        self.num_jobs = num_jobs
+        self.hash_file = "{0}/figures.json".format(output_dir)
+        try:
+            with open(self.hash_file) as f:
+                self.old_hashes = json.load(f)
+        except (IOError, ValueError):
+            self.old_hashes = {}
+        with open(__file__, 'rb') as f:
+            self.script_hash = hashlib.sha1(f.read()).digest()
+        self.hashes = {}
+        self.jobs = []
+
+    def figure_file(self, basename):
+        return "{0}/{1}.{2}".format(self.output_dir, basename,
+                                    self.figure_format)
+
+    def add(self, figure_file, plot_function, *args):
+        figure_hash = hashlib.sha1(self.script_hash)
+        figure_hash.update(pickle.dumps((plot_function.__name__, args),
+                                        protocol=2))
+        figure_hash = figure_hash.hexdigest()
+        self.hashes[figure_file] = figure_hash
+        if (self.old_hashes.get(figure_file) != figure_hash
+                or not os.path.exists(figure_file)):
+            self.jobs.append((figure_file, plot_function, args))
+
+    def render(self):
+        """Renders the figures that changed; returns their number."""
+        logger.info("Rendering %d of %d figures (the others are up to date)",
+                    len(self.jobs), len(self.hashes))
+        if self.num_jobs > 1 and len(self.jobs) > 1:
+            pool = multiprocessing.Pool(min(self.num_jobs, len(self.jobs)))
+            try:
+                pool.map(render_figure, self.jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in self.jobs:
+                render_figure(job)
+        with open(self.hash_file, "w") as f:
+            json.dump(self.hashes, f, indent=1, sort_keys=True)
+        return len(self.jobs)
+
+
 def latex_compliant_name(name_string):
     """this function is required as latex does not allow all the component names
     allowed by nnet3.
@@ -149,15 +267,37 @@ def latex_compliant_name(name_string):
     return node_name_string
 
 
+def plot_acc_logprob(figfile_name, key, output_name, num_dirs, plot_data):
+    fig = plt.figure()
+    plots = []
+    for dir, color_val, data in plot_data:
+        plot_handle, = plt.plot(data[:, 0], data[:, 1], color=color_val,
+                                linestyle="--",
+                                label="train {0}".format(dir))
+        plots.append(plot_handle)
+        plot_handle, = plt.plot(data[:, 0], data[:, 2], color=color_val,
+                                label="valid {0}".format(dir))
+        plots.append(plot_handle)
+    plt.xlabel('Iteration')
+    plt.ylabel(key)
+    lgd = plt.legend(handles=plots, loc='lower center',
+                     bbox_to_anchor=(0.5, -0.2 + num_dirs * -0.1),
+                     ncol=1, borderaxespad=0.)
+    plt.grid(True)
+    fig.suptitle("{0} plot for {1}".format(key, output_name))
+    plt.savefig(figfile_name, bbox_extra_artists=(lgd,),
+                bbox_inches='tight')
+
+
 def generate_acc_logprob_plots(exp_dir, output_dir, plot, key='accuracy',
         file_basename='accuracy', comparison_dir=None,
-        start_iter=1, latex_report=None, output_name='output'):
+        start_iter=1, latex_report=None, output_name='output',
+        figures=None):
 
     assert start_iter >= 1
 
     if plot:
-        fig = plt.figure()
-        plots = []
+        plot_data = []
 
     comparison_dir = [] if comparison_dir is None else comparison_dir
     dirs = [exp_dir] + comparison_dir
@@ -179,27 +319,13 @@ def generate_acc_logprob_plots(exp_dir, output_dir, plot, key='accuracy',
                                "accuracy/log-probability plot, not generating it")
                 return
             data = data[data[:, 0] >= start_iter, :]
-            plot_handle, = plt.plot(data[:, 0], data[:, 1], color=color_val,
-                                    linestyle="--",
-                                    label="train {0}".format(dir))
-            plots.append(plot_handle)
-            plot_handle, = plt.plot(data[:, 0], data[:, 2], color=color_val,
-                                    label="valid {0}".format(dir))
-            plots.append(plot_handle)
+            plot_data.append((dir, color_val, data))
         index += 1
     if plot:
-        plt.xlabel('Iteration')
-        plt.ylabel(key)
-        lgd = plt.legend(handles=plots, loc='lower center',
-                         bbox_to_anchor=(0.5, -0.2 + len(dirs) * -0.1),
-                         ncol=1, borderaxespad=0.)
-        plt.grid(True)
-        fig.suptitle("{0} plot for {1}".format(key, output_name))
-        figfile_name = '{0}/{1}_{2}.pdf'.format(
-            output_dir, file_basename,
-            latex_compliant_name(output_name))
-        plt.savefig(figfile_name, bbox_extra_artists=(lgd,),
-                    bbox_inches='tight')
+        figfile_name = figures.figure_file('{0}_{1}'.format(
+            file_basename, latex_compliant_name(output_name)))
+        figures.add(figfile_name, plot_acc_logprob, key, output_name,
+                    len(dirs), plot_data)
         if latex_report is not None:
             latex_report.add_figure(
                 figfile_name,
@@ -339,6 +465,21 @@ def plot_a_nonlin_component(fig, dirs, stat_tables_per_component_per_dir,
     return lgd
 
 
+# This function renders the figure of a normal nonlinearity component or a gate
+# of lstmp into figfile_name.
+def plot_nonlin_component(figfile_name, title, dirs,
+        stat_tables_per_component_per_dir, component_name, common_prefix,
+        prefix_length, component_type, start_iter, gate_index, with_oderiv):
+    fig = plt.figure()
+    lgd = plot_a_nonlin_component(fig, dirs,
+            stat_tables_per_component_per_dir, component_name,
+            common_prefix, prefix_length, component_type, start_iter,
+            gate_index, with_oderiv)
+    fig.suptitle(title)
+    fig.savefig(figfile_name, bbox_extra_artists=(lgd,),
+        bbox_inches='tight')
+
+
 # This function is used to generate the statistic plots of nonlinearity component
 # Mainly divided into the following steps:
 # 1) With log_parse function, we get the statistics from each directory.
@@ -349,7 +490,7 @@ def plot_a_nonlin_component(fig, dirs, stat_tables_per_component_per_dir,
 # 4) Plot the "Per-dimension average-(value, derivative) percentiles" figure
 #    for each nonlinearity component.
 def generate_nonlin_stats_plots(exp_dir, output_dir, plot, comparison_dir=None,
-                                start_iter=1, latex_report=None):
+                                start_iter=1, latex_report=None, figures=None):
     assert start_iter >= 1
 
     comparison_dir = [] if comparison_dir is None else comparison_dir
@@ -424,26 +565,27 @@ def generate_nonlin_stats_plots(exp_dir, output_dir, plot, comparison_dir=None,
                            "provided only for common component names. Make sure that these are "
                            "comparable experiments before analyzing these plots.")
 
-        fig = plt.figure()
-
         common_prefix = os.path.commonprefix(dirs)
         prefix_length = common_prefix.rfind('/')
         common_prefix = common_prefix[0:prefix_length]
 
         for component_name in main_component_names:
+            # only the tables of this component go into the figure (and its hash)
+            component_tables_per_dir = dict(
+                (dir, {component_name: tables[component_name]})
+                for dir, tables in stat_tables_per_component_per_dir.items()
+                if component_name in tables)
             if stats_per_dir[exp_dir][component_name]['type'] == 'LstmNonlinearity':
                 for i in range(0,5):
                     component_type = 'Lstm-' + g_lstm_gate[i]
-                    lgd = plot_a_nonlin_component(fig, dirs,
-                            stat_tables_per_component_per_dir, component_name,
-                            common_prefix, prefix_length, component_type, start_iter, i, with_oderiv)
-                    fig.suptitle("Per-dimension average-(value, derivative) percentiles for "
-                         "{component_name}-{gate}".format(component_name=component_name, gate=g_lstm_gate[i]))
                     comp_name = latex_compliant_name(component_name)
-                    figfile_name = '{dir}/nonlinstats_{comp_name}_{gate}.pdf'.format(
-                        dir=output_dir, comp_name=comp_name, gate=g_lstm_gate[i])
-                    fig.savefig(figfile_name, bbox_extra_artists=(lgd,),
-                        bbox_inches='tight')
+                    figfile_name = figures.figure_file('nonlinstats_{comp_name}_{gate}'.format(
+                        comp_name=comp_name, gate=g_lstm_gate[i]))
+                    figures.add(figfile_name, plot_nonlin_component,
+                            "Per-dimension average-(value, derivative) percentiles for "
+                            "{component_name}-{gate}".format(component_name=component_name, gate=g_lstm_gate[i]),
+                            dirs, component_tables_per_dir, component_name,
+                            common_prefix, prefix_length, component_type, start_iter, i, with_oderiv)
                     if latex_report is not None:
                         latex_report.add_figure(
                         figfile_name,
@@ -451,20 +593,18 @@ def generate_nonlin_stats_plots(exp_dir, output_dir, plot, comparison_dir=None,
                         "{0}-{1}".format(component_name, g_lstm_gate[i]))
             else:
                 component_type = stats_per_dir[exp_dir][component_name]['type']
-                lgd = plot_a_nonlin_component(fig, dirs,
-                        stat_tables_per_component_per_dir,component_name,
-                        common_prefix, prefix_length, component_type, start_iter, 0, with_oderiv)
                 if with_oderiv:
-                    fig.suptitle("Per-dimension average-(value, derivative) and rms-oderivative percentiles for "
+                    title = ("Per-dimension average-(value, derivative) and rms-oderivative percentiles for "
                          "{component_name}".format(component_name=component_name))
                 else:
-                    fig.suptitle("Per-dimension average-(value, derivative) percentiles for "
+                    title = ("Per-dimension average-(value, derivative) percentiles for "
                          "{component_name}".format(component_name=component_name))
                 comp_name = latex_compliant_name(component_name)
-                figfile_name = '{dir}/nonlinstats_{comp_name}.pdf'.format(
-                    dir=output_dir, comp_name=comp_name)
-                fig.savefig(figfile_name, bbox_extra_artists=(lgd,),
-                        bbox_inches='tight')
+                figfile_name = figures.figure_file('nonlinstats_{comp_name}'.format(
+                    comp_name=comp_name))
+                figures.add(figfile_name, plot_nonlin_component, title,
+                        dirs, component_tables_per_dir, component_name,
+                        common_prefix, prefix_length, component_type, start_iter, 0, with_oderiv)
                 if latex_report is not None:
                     if with_oderiv:
                         latex_report.add_figure(
@@ -478,10 +618,31 @@ def generate_nonlin_stats_plots(exp_dir, output_dir, plot, comparison_dir=None,
                         "{0}".format(component_name))
 
 
+def plot_clipped_proportion(figfile_name, component_name, num_dirs,
+                            plot_data):
+    fig = plt.figure()
+    plots = []
+    for dir, color_val, data in plot_data:
+        ax = plt.subplot(111)
+        mp, = ax.plot(data[:, 0], data[:, 1], color=color_val,
+                      label="Clipped Proportion {0}".format(dir))
+        plots.append(mp)
+        ax.set_ylabel('Clipped Proportion')
+        ax.set_ylim([0, 1.2])
+        ax.grid(True)
+    lgd = plt.legend(handles=plots, loc='lower center',
+                     bbox_to_anchor=(0.5, -0.5 + num_dirs * -0.2),
+                     ncol=1, borderaxespad=0.)
+    plt.grid(True)
+    fig.suptitle("Clipped-proportion value at {comp_name}".format(
+                    comp_name=component_name))
+    fig.savefig(figfile_name, bbox_extra_artists=(lgd,),
+                bbox_inches='tight')
+
 
 def generate_clipped_proportion_plots(exp_dir, output_dir, plot,
                                       comparison_dir=None, start_iter=1,
-                                      latex_report=None):
+                                      latex_report=None, figures=None):
     assert(start_iter >= 1)
 
     comparison_dir = [] if comparison_dir is None else comparison_dir
@@ -534,11 +695,9 @@ def generate_clipped_proportion_plots(exp_dir, output_dir, plot,
                 "provided only for common component names. Make sure that these "
                 "are comparable experiments before analyzing these plots.")
 
-        fig = plt.figure()
         for component_name in main_component_names:
-            fig.clf()
             index = 0
-            plots = []
+            plot_data = []
             for dir in dirs:
                 color_val = g_plot_colors[index]
                 index += 1
@@ -552,33 +711,52 @@ def generate_clipped_proportion_plots(exp_dir, output_dir, plot,
 
                 data = np.array(iter_stats)
                 data = data[data[:, 0] >= start_iter, :]
-                ax = plt.subplot(111)
-                mp, = ax.plot(data[:, 0], data[:, 1], color=color_val,
-                              label="Clipped Proportion {0}".format(dir))
-                plots.append(mp)
-                ax.set_ylabel('Clipped Proportion')
-                ax.set_ylim([0, 1.2])
-                ax.grid(True)
-            lgd = plt.legend(handles=plots, loc='lower center',
-                             bbox_to_anchor=(0.5, -0.5 + len(dirs) * -0.2),
-                             ncol=1, borderaxespad=0.)
-            plt.grid(True)
-            fig.suptitle("Clipped-proportion value at {comp_name}".format(
-                            comp_name=component_name))
+                plot_data.append((dir, color_val, data))
             comp_name = latex_compliant_name(component_name)
-            figfile_name = '{dir}/clipped_proportion_{comp_name}.pdf'.format(
-                dir=output_dir, comp_name=comp_name)
-            fig.savefig(figfile_name, bbox_extra_artists=(lgd,),
-                        bbox_inches='tight')
+            figfile_name = figures.figure_file('clipped_proportion_{comp_name}'.format(
+                comp_name=comp_name))
+            figures.add(figfile_name, plot_clipped_proportion, component_name,
+                        len(dirs), plot_data)
             if latex_report is not None:
                 latex_report.add_figure(
                     figfile_name,
                     "Clipped proportion at {0}".format(component_name))
 
 
+def plot_param_diff(figfile_name, component_name, num_dirs, plot_data):
+    fig = plt.figure()
+    plots = []
+    for dir, color_val, iter_stats in plot_data:
+        ax = plt.subplot(211)
+        mp, = ax.plot(iter_stats[0][:, 0], iter_stats[0][:, 1],
+                      color=color_val,
+                      label="Parameter Differences {0}".format(dir))
+        plots.append(mp)
+        ax.set_ylabel('Parameter Differences')
+        ax.grid(True)
+
+        ax = plt.subplot(212)
+        mp, = ax.plot(iter_stats[1][:, 0], iter_stats[1][:, 1],
+                      color=color_val,
+                      label="Relative Parameter "
+                            "Differences {0}".format(dir))
+        ax.set_xlabel('Iteration')
+        ax.set_ylabel('Relative Parameter Differences')
+        ax.grid(True)
+
+    lgd = plt.legend(handles=plots, loc='lower center',
+                     bbox_to_anchor=(0.5, -0.5 + num_dirs * -0.2),
+                     ncol=1, borderaxespad=0.)
+    plt.grid(True)
+    fig.suptitle("Parameter differences at {comp_name}".format(
+        comp_name=component_name))
+    fig.savefig(figfile_name, bbox_extra_artists=(lgd,),
+                bbox_inches='tight')
+
+
 def generate_parameter_diff_plots(exp_dir, output_dir, plot,
                                   comparison_dir=None, start_iter=1,
-                                  latex_report=None):
+                                  latex_report=None, figures=None):
     # Parameter changes
     assert start_iter >= 1
 
@@ -646,14 +824,12 @@ def generate_parameter_diff_plots(exp_dir, output_dir, plot,
 
         assert main_component_names
 
-        fig = plt.figure()
         logger.info("Plotting parameter differences for components: " +
                     ", ".join(main_component_names))
 
         for component_name in main_component_names:
-            fig.clf()
             index = 0
-            plots = []
+            plot_data = []
             for dir in dirs:
                 color_val = g_plot_colors[index]
                 index += 1
@@ -673,34 +849,12 @@ def generate_parameter_diff_plots(exp_dir, output_dir, plot,
                                         "experiment dir for the component {0}. Something went "
                                         "wrong: {1}.".format(component_name, e))
                     continue
-                ax = plt.subplot(211)
-                mp, = ax.plot(iter_stats[0][:, 0], iter_stats[0][:, 1],
-                              color=color_val,
-                              label="Parameter Differences {0}".format(dir))
-                plots.append(mp)
-                ax.set_ylabel('Parameter Differences')
-                ax.grid(True)
-
-                ax = plt.subplot(212)
-                mp, = ax.plot(iter_stats[1][:, 0], iter_stats[1][:, 1],
-                              color=color_val,
-                              label="Relative Parameter "
-                                    "Differences {0}".format(dir))
-                ax.set_xlabel('Iteration')
-                ax.set_ylabel('Relative Parameter Differences')
-                ax.grid(True)
-
-            lgd = plt.legend(handles=plots, loc='lower center',
-                             bbox_to_anchor=(0.5, -0.5 + len(dirs) * -0.2),
-                             ncol=1, borderaxespad=0.)
-            plt.grid(True)
-            fig.suptitle("Parameter differences at {comp_name}".format(
-                comp_name=component_name))
+                plot_data.append((dir, color_val, iter_stats))
             comp_name = latex_compliant_name(component_name)
-            figfile_name = '{dir}/param_diff_{comp_name}.pdf'.format(
-                dir=output_dir, comp_name=comp_name)
-            fig.savefig(figfile_name, bbox_extra_artists=(lgd,),
-                        bbox_inches='tight')
+            figfile_name = figures.figure_file('param_diff_{comp_name}'.format(
+                comp_name=comp_name))
+            figures.add(figfile_name, plot_param_diff, component_name,
+                        len(dirs), plot_data)
             if latex_report is not None:
                 latex_report.add_figure(
                     figfile_name,
@@ -708,7 +862,7 @@ def generate_parameter_diff_plots(exp_dir, output_dir, plot,
 
 
 def generate_plots(exp_dir, output_dir, output_names, comparison_dir=None,
-                   start_iter=1):
+                   start_iter=1, figure_format='pdf', num_jobs=1):
     try:
         os.makedirs(output_dir)
     except OSError as e:
@@ -717,9 +871,14 @@ def generate_plots(exp_dir, output_dir, output_names, comparison_dir=None,
         else:
             raise e
     if g_plot:
-        latex_report = LatexReport("{0}/report.pdf".format(output_dir))
+        if figure_format == 'pdf':
+            latex_report = LatexReport("{0}/report.pdf".format(output_dir))
+        else:
+            latex_report = HtmlReport("{0}/report.html".format(output_dir))
+        figures = FigureRenderer(output_dir, figure_format, num_jobs)
     else:
         latex_report = None
+        figures = None
 
     for (output_name, objective_type) in output_names:
         if objective_type == "linear":
@@ -728,55 +887,65 @@ def generate_plots(exp_dir, output_dir, output_names, comparison_dir=None,
                 exp_dir, output_dir, g_plot, key='accuracy',
                 file_basename='accuracy', comparison_dir=comparison_dir,
                 start_iter=start_iter,
-                latex_report=latex_report, output_name=output_name)
+                latex_report=latex_report, output_name=output_name,
+                figures=figures)
 
             logger.info("Generating log-likelihood plots for '%s'", output_name)
             generate_acc_logprob_plots(
                 exp_dir, output_dir, g_plot, key='log-likelihood',
                 file_basename='loglikelihood', comparison_dir=comparison_dir,
                 start_iter=start_iter,
-                latex_report=latex_report, output_name=output_name)
+                latex_report=latex_report, output_name=output_name,
+                figures=figures)
         elif objective_type == "chain":
             logger.info("Generating log-probability plots for '%s'", output_name)
             generate_acc_logprob_plots(
                 exp_dir, output_dir, g_plot,
                 key='log-probability', file_basename='log_probability',
                 comparison_dir=comparison_dir, start_iter=start_iter,
-                latex_report=latex_report, output_name=output_name)
+                latex_report=latex_report, output_name=output_name,
+                figures=figures)
         elif objective_type == "rnnlm_objective":
             logger.info("Generating RNNLM objective plots for '%s'", output_name)
             generate_acc_logprob_plots(
                 exp_dir, output_dir, g_plot, key='rnnlm_objective',
                 file_basename='objective', comparison_dir=comparison_dir,
                 start_iter=start_iter,
-                latex_report=latex_report, output_name=output_name)
+                latex_report=latex_report, output_name=output_name,
+                figures=figures)
         else:
             logger.info("Generating %s objective plots for '%s'", objective_type, output_name)
             generate_acc_logprob_plots(
                 exp_dir, output_dir, g_plot, key='objective',
                 file_basename='objective', comparison_dir=comparison_dir,
                 start_iter=start_iter,
-                latex_report=latex_report, output_name=output_name)
+                latex_report=latex_report, output_name=output_name,
+                figures=figures)
 
     logger.info("Generating non-linearity stats plots")
     generate_nonlin_stats_plots(
         exp_dir, output_dir, g_plot, comparison_dir=comparison_dir,
-        start_iter=start_iter, latex_report=latex_report)
+        start_iter=start_iter, latex_report=latex_report,
+        figures=figures)
 
     logger.info("Generating clipped-proportion plots")
     generate_clipped_proportion_plots(
         exp_dir, output_dir, g_plot, comparison_dir=comparison_dir,
-        start_iter=start_iter, latex_report=latex_report)
+        start_iter=start_iter, latex_report=latex_report,
+        figures=figures)
 
     logger.info("Generating parameter difference plots")
     generate_parameter_diff_plots(
         exp_dir, output_dir, g_plot, comparison_dir=comparison_dir,
-        start_iter=start_iter, latex_report=latex_report)
+        start_iter=start_iter, latex_report=latex_report,
+        figures=figures)
 
     if g_plot and latex_report is not None:
-        has_compiled = latex_report.close()
+        num_rendered = figures.render()
+        has_compiled = latex_report.close(figures_changed=num_rendered > 0)
         if has_compiled:
-            logger.info("Report file %s/report.pdf has been generated successfully.", output_dir)
+            logger.info("Report file %s/report.%s has been generated successfully.",
+                        output_dir, 'pdf' if figure_format == 'pdf' else 'html')
 
 
 def main():
@@ -808,15 +977,18 @@ def main():
     if args.comparison_dir is not None:
       generate_plots(args.exp_dir[0], args.output_dir, output_nodes,
                      comparison_dir=args.comparison_dir,
-                     start_iter=args.start_iter)
+                     start_iter=args.start_iter,
+                     figure_format=args.figure_format, num_jobs=args.num_jobs)
     else:
       if len(args.exp_dir) == 1:
         generate_plots(args.exp_dir[0], args.output_dir, output_nodes,
-                       start_iter=args.start_iter)
+                       start_iter=args.start_iter,
+                       figure_format=args.figure_format, num_jobs=args.num_jobs)
       if len(args.exp_dir) > 1:
         generate_plots(args.exp_dir[0], args.output_dir, output_nodes,
                        comparison_dir=args.exp_dir[1:],
-                       start_iter=args.start_iter)
+                       start_iter=args.start_iter,
+                       figure_format=args.figure_format, num_jobs=args.num_jobs)
 
 
 if __name__ == "__main__":
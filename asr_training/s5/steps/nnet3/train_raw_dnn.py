@@ -180,6 +180,8 @@ def process_args(args):
                             args.command)
     run_opts.num_jobs_compute_prior = args.num_jobs_compute_prior
 
+    common_train_lib.setup_job_scheduler(args)
+
     return [args, run_opts]
 
 
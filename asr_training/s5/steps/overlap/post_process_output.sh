@@ -55,7 +55,7 @@ utils/data/get_utt2dur.sh $data_dir
 
 if [ $stage -le 0 ]; then
   $cmd JOB=1:$nj $dir/log/segmentation.JOB.log \
-    copy-int-vector "ark:gunzip -c $output_dir/ali.JOB.gz |" ark,t:- \| \
+    copy-int-vector "ark:gunzip -c $output_dir/ali.JOB.gz |" ark:- \| \
     steps/overlap/output_to_rttm.py \
       --region-type=$region_type \
       --frame-shift=$frame_shift --segment-padding=$segment_padding \
@@ -61,6 +61,11 @@ def _get_args():
                         choices=["true", "false"],
                         help="If true, the stats are accumulated over all the "
                         "documents and a single tf-idf-file is written out.")
+    parser.add_argument("--binary", type=str, default="false",
+                        choices=["true", "false"],
+                        help="If true, the tf-idf-file and the output IDF "
+                        "stats are written in binary format, which is "
+                        "faster to read. The readers detect the format.")
     parser.add_argument("docs", type=argparse.FileType('r'),
                         help="Input documents in kaldi text format i.e. "
                         "<document-id> <text>")
@@ -75,6 +80,7 @@ def _get_args():
         raise ValueError("--tf-normalization-factor must be in [0,1)")
 
     args.accumulate_over_docs = bool(args.accumulate_over_docs == "true")
+    args.binary = bool(args.binary == "true")
 
     if not args.accumulate_over_docs and args.input_idf_stats is None:
         raise TypeError(
@@ -99,13 +105,14 @@ def _run(args):
 
         if not args.accumulate_over_docs:
             # Write the document-id and the corresponding tf-idf values.
-            print (doc, file=args.tf_idf_file, end=' ')
+            tf_idf.write_tfidf_ark_key(args.tf_idf_file, doc,
+                                       binary=args.binary)
             tf_idf.write_tfidf_from_stats(
                 tf_stats, idf_stats, args.tf_idf_file,
                 tf_weighting_scheme=args.tf_weighting_scheme,
                 idf_weighting_scheme=args.idf_weighting_scheme,
                 tf_normalization_factor=args.tf_normalization_factor,
-                expected_document_id=doc)
+                expected_document_id=doc, binary=args.binary)
             tf_stats = tf_idf.TFStats()
         num_done += 1
 
@@ -115,14 +122,15 @@ def _run(args):
                                               else None)
 
         if args.output_idf_stats is not None:
-            idf_stats.write(args.output_idf_stats)
+            idf_stats.write(args.output_idf_stats, binary=args.binary)
             args.output_idf_stats.close()
 
         tf_idf.write_tfidf_from_stats(
             tf_stats, idf_stats, args.tf_idf_file,
             tf_weighting_scheme=args.tf_weighting_scheme,
             idf_weighting_scheme=args.idf_weighting_scheme,
-            tf_normalization_factor=args.tf_normalization_factor)
+            tf_normalization_factor=args.tf_normalization_factor,
+            binary=args.binary)
 
     if num_done == 0:
         raise RuntimeError("Could not compute TF-IDF for any query documents")
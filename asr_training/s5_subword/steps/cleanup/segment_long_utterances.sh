@@ -43,6 +43,7 @@ lmwt=10
 max_words=1000
 num_neighbors_to_search=1   # Number of neighboring documents to search around the one retrieved based on maximum tf-idf similarity.
 neighbor_tfidf_threshold=0.5
+binary_tfidf=false  # If true, the TF-IDF stats are written in binary format, which is faster to read.
 
 align_full_hyp=false  # Align full hypothesis i.e. trackback from the end to get the alignment.
 
@@ -263,6 +264,7 @@ if [ $stage -le 7 ]; then
     steps/cleanup/internal/compute_tf_idf.py \
     --tf-weighting-scheme="raw" \
     --idf-weighting-scheme="log" \
+    --binary=$binary_tfidf \
     --output-idf-stats=$dir/docs/idf_stats.txt \
     $dir/docs/docs.txt $dir/docs/src_tf_idf.txt
 
@@ -301,6 +303,7 @@ if [ $stage -le 7 ]; then
     steps/cleanup/internal/compute_tf_idf.py \
       --tf-weighting-scheme="raw" \
       --idf-weighting-scheme="log" \
+      --binary=$binary_tfidf \
       --input-idf-stats=$dir/docs/idf_stats.txt \
       $sdir/docs.JOB.txt $sdir/src_tf_idf.JOB.txt
 
@@ -348,6 +351,7 @@ if [ $stage -le 9 ]; then
     steps/cleanup/internal/compute_tf_idf.py \
       --tf-weighting-scheme="normalized" \
       --idf-weighting-scheme="log" \
+      --binary=$binary_tfidf \
       --input-idf-stats=$dir/docs/idf_stats.txt \
       --accumulate-over-docs=false \
       - $sdir/query_tf_idf.JOB.ark.txt
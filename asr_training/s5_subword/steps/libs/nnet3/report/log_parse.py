@@ -8,7 +8,10 @@ from __future__ import division
 from __future__ import print_function
 import traceback
 import datetime
+import glob
 import logging
+import os
+import pickle
 import re
 
 import libs.common as common_lib
@@ -45,6 +48,75 @@ g_normal_nonlin_regex_pattern_with_oderiv = ''.join([".*progress.([0-9]+).log:co
     "deriv-avg=\[.*=\((.+)\), mean=([0-9\.\-e]+), stddev=([0-9\.e\-]+)\].*",
     "oderiv-rms=\[.*=\((.+)\), mean=([0-9\.\-e]+), stddev=([0-9\.e\-]+)\]"])
 
+# The version of the records cached by parse_logs_incrementally(); increase it
+# when the records returned by the per-log parse functions change.
+g_log_parse_cache_version = 1
+
+
+def grep_log(log_file, pattern):
+    """ Yields the lines of 'log_file' that match the regular expression
+    'pattern', prefixed with the name of the log file like the output of
+    'grep -e <pattern> <log_file> <other-log-files>'.
+    """
+    regex = re.compile(pattern)
+    with open(log_file, 'r', errors='replace') as f:
+        for line in f:
+            if regex.search(line):
+                yield "{0}:{1}".format(log_file, line.rstrip("\n"))
+
+
+def parse_logs_incrementally(exp_dir, log_file_pattern, cache_name, parse_log):
+    """ Returns a list of (log_file, records) pairs, in sorted order, for the
+    log files in <exp_dir>/log matching the glob 'log_file_pattern', where
+    'records' is the result of parse_log(log_file).
+
+    The records are cached in <exp_dir>/log/.log_parse.<cache_name>.cache
+    together with the size and modification time of each log file, so that
+    generating a report again during training only parses the logs of the new
+    iterations.  'cache_name' must identify the parse function and its
+    options.
+    """
+    cache_file = "{0}/log/.log_parse.{1}.cache".format(
+        exp_dir, re.sub("[^a-zA-Z0-9_.-]", "_", cache_name))
+    cached_logs = {}
+    try:
+        with open(cache_file, 'rb') as f:
+            cache = pickle.load(f)
+        if cache['version'] == g_log_parse_cache_version:
+            cached_logs = cache['logs']
+    except (IOError, OSError, EOFError, KeyError, TypeError,
+            pickle.UnpicklingError):
+        pass
+
+    logs = {}
+    results = []
+    num_parsed = 0
+    for log_file in sorted(glob.glob(
+            "{0}/log/{1}".format(exp_dir, log_file_pattern))):
+        stat = os.stat(log_file)
+        cached = cached_logs.get(log_file)
+        if (cached is not None and cached[0] == stat.st_size
+                and cached[1] == stat.st_mtime):
+            records = cached[2]
+        else:
+            records = parse_log(log_file)
+            num_parsed += 1
+        logs[log_file] = (stat.st_size, stat.st_mtime, records)
+        results.append((log_file, records))
+
+    if num_parsed > 0 or len(logs) != len(cached_logs):
+        try:
+            with open(cache_file + ".tmp", 'wb') as f:
+                pickle.dump({'version': g_log_parse_cache_version,
+                             'logs': logs}, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(cache_file + ".tmp", cache_file)
+        except (IOError, OSError) as e:
+            # e.g. the logs of a comparison directory are not writable
+            logger.warning("Could not write the cache of parsed logs "
+                           "{0}: {1}".format(cache_file, e))
+    return results
+
+
 class KaldiLogParseException(Exception):
     """ An Exception class that throws an error when there is an issue in
     parsing the log files. Extend this class if more granularity is needed.
@@ -159,24 +231,48 @@ def parse_progress_logs_for_nonlinearity_stats(exp_dir):
     0.19,0.20,0.20,0.21), mean=0.134, stddev=0.0397]
     """
 
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
     stats_per_component_per_iter = {}
 
-    progress_log_lines = common_lib.get_command_stdout(
-        'grep -e "value-avg.*deriv-avg.*oderiv" {0}'.format(progress_log_files),
-        require_zero_status = False)
+    progress_logs = parse_logs_incrementally(
+        exp_dir, "progress.*.log", "nonlinearity_stats",
+        parse_progress_log_for_nonlinearity_stats)
+    # Only the lines with oderiv-rms are used if there are any in the logs.
+    with_oderiv = any(has_oderiv for _, (has_oderiv, _) in progress_logs)
+
+    for _, (has_oderiv, records) in progress_logs:
+        if has_oderiv != with_oderiv:
+            continue
+        for groups in records:
+            if groups[2] == 'LstmNonlinearity':
+                for i in list(range(0,5)):
+                    fill_nonlin_stats_table_with_regex_result(groups, i,
+                            stats_per_component_per_iter)
+            else:
+                fill_nonlin_stats_table_with_regex_result(groups, 0,
+                        stats_per_component_per_iter)
+    return stats_per_component_per_iter
+
+
+def parse_progress_log_for_nonlinearity_stats(log_file):
+    """ Parses the nonlinearity stats of one progress log for
+    parse_progress_logs_for_nonlinearity_stats(); returns a tuple of whether
+    the log has lines with oderiv-rms and the groups of the regular
+    expression for each line (with oderiv-rms if there are such lines).
+    """
+    progress_log_lines = list(grep_log(log_file, "value-avg.*deriv-avg"))
+    oderiv_log_lines = [line for line in progress_log_lines
+                        if re.search("value-avg.*deriv-avg.*oderiv", line)]
 
-    if progress_log_lines:
+    if oderiv_log_lines:
         # cases with oderiv-rms
+        progress_log_lines = oderiv_log_lines
         parse_regex = re.compile(g_normal_nonlin_regex_pattern_with_oderiv)
     else:
         # cases with only value-avg and deriv-avg
-        progress_log_lines = common_lib.get_command_stdout(
-        'grep -e "value-avg.*deriv-avg" {0}'.format(progress_log_files),
-        require_zero_status = False)
         parse_regex = re.compile(g_normal_nonlin_regex_pattern)
 
-    for line in progress_log_lines.split("\n"):
+    records = []
+    for line in progress_log_lines:
         mat_obj = parse_regex.search(line)
         if mat_obj is None:
             continue
@@ -189,13 +285,8 @@ def parse_progress_logs_for_nonlinearity_stats(exp_dir):
             mat_obj = parse_regex_lstmp.search(line)
             groups = mat_obj.groups()
             assert len(groups) == 33
-            for i in list(range(0,5)):
-                fill_nonlin_stats_table_with_regex_result(groups, i,
-                        stats_per_component_per_iter)
-        else:
-            fill_nonlin_stats_table_with_regex_result(groups, 0,
-                    stats_per_component_per_iter)
-    return stats_per_component_per_iter
+        records.append(groups)
+    return (len(oderiv_log_lines) > 0, records)
 
 
 def parse_difference_string(string):
@@ -225,37 +316,19 @@ def parse_progress_logs_for_clipped_proportion(exp_dir):
     self-repair-scale=1
     """
 
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
-    component_names = set([])
-    progress_log_lines = common_lib.get_command_stdout(
-        'grep -e "{0}" {1}'.format(
-            "clipped-proportion", progress_log_files),
-        require_zero_status=False)
-    parse_regex = re.compile(".*progress\.([0-9]+)\.log:component "
-                             "name=(.*) type=.* "
-                             "clipped-proportion=([0-9\.e\-]+)")
-
     cp_per_component_per_iter = {}
 
     max_iteration = 0
     component_names = set([])
-    for line in progress_log_lines.split("\n"):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is None:
-            if line.strip() == "":
-                continue
-            raise MalformedClippedProportionLineException(line)
-        groups = mat_obj.groups()
-        iteration = int(groups[0])
-        max_iteration = max(max_iteration, iteration)
-        name = groups[1]
-        clipped_proportion = float(groups[2])
-        if clipped_proportion > 1:
-            raise MalformedClippedProportionLineException(line)
-        if iteration not in cp_per_component_per_iter:
-            cp_per_component_per_iter[iteration] = {}
-        cp_per_component_per_iter[iteration][name] = clipped_proportion
-        component_names.add(name)
+    for _, records in parse_logs_incrementally(
+            exp_dir, "progress.*.log", "clipped_proportion",
+            parse_progress_log_for_clipped_proportion):
+        for iteration, name, clipped_proportion in records:
+            max_iteration = max(max_iteration, iteration)
+            if iteration not in cp_per_component_per_iter:
+                cp_per_component_per_iter[iteration] = {}
+            cp_per_component_per_iter[iteration][name] = clipped_proportion
+            component_names.add(name)
     component_names = list(component_names)
     component_names.sort()
 
@@ -289,6 +362,27 @@ def parse_progress_logs_for_clipped_proportion(exp_dir):
             'cp_per_iter_per_component': cp_per_iter_per_component}
 
 
+def parse_progress_log_for_clipped_proportion(log_file):
+    """ Parses one progress log for
+    parse_progress_logs_for_clipped_proportion(); returns a list of
+    (iteration, component-name, clipped-proportion) tuples.
+    """
+    parse_regex = re.compile(".*progress\.([0-9]+)\.log:component "
+                             "name=(.*) type=.* "
+                             "clipped-proportion=([0-9\.e\-]+)")
+    records = []
+    for line in grep_log(log_file, "clipped-proportion"):
+        mat_obj = parse_regex.search(line)
+        if mat_obj is None:
+            raise MalformedClippedProportionLineException(line)
+        groups = mat_obj.groups()
+        clipped_proportion = float(groups[2])
+        if clipped_proportion > 1:
+            raise MalformedClippedProportionLineException(line)
+        records.append((int(groups[0]), groups[1], clipped_proportion))
+    return records
+
+
 def parse_progress_logs_for_param_diff(exp_dir, pattern):
     """ Parse progress logs for per-component parameter differences.
 
@@ -308,22 +402,32 @@ def parse_progress_logs_for_param_diff(exp_dir, pattern):
                            "Parameter differences"]):
         raise Exception("Unknown value for pattern : {0}".format(pattern))
 
-    progress_log_files = "%s/log/progress.*.log" % (exp_dir)
     progress_per_iter = {}
     component_names = set([])
-    progress_log_lines = common_lib.get_command_stdout(
-        'grep -e "{0}" {1}'.format(pattern, progress_log_files))
     parse_regex = re.compile(".*progress\.([0-9]+)\.log:"
                              "LOG.*{0}.*\[(.*)\]".format(pattern))
-    for line in progress_log_lines.split("\n"):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is None:
-            continue
-        groups = mat_obj.groups()
-        iteration = groups[0]
-        differences = parse_difference_string(groups[1])
-        component_names = component_names.union(list(differences.keys()))
-        progress_per_iter[int(iteration)] = differences
+
+    def parse_log(log_file):
+        records = []
+        for line in grep_log(log_file, pattern):
+            mat_obj = parse_regex.search(line)
+            if mat_obj is None:
+                continue
+            groups = mat_obj.groups()
+            records.append((int(groups[0]),
+                            parse_difference_string(groups[1])))
+        return records
+
+    progress_logs = parse_logs_incrementally(
+        exp_dir, "progress.*.log", "param_diff." + pattern, parse_log)
+    if not any(records for _, records in progress_logs):
+        raise KaldiLogParseException("Could not find any lines with '{0}' "
+                                     "in {1}/log/progress.*.log".format(
+                                         pattern, exp_dir))
+    for _, records in progress_logs:
+        for iteration, differences in records:
+            component_names = component_names.union(list(differences.keys()))
+            progress_per_iter[iteration] = differences
 
     component_names = list(component_names)
     component_names.sort()
@@ -364,36 +468,70 @@ def parse_progress_logs_for_param_diff(exp_dir, pattern):
 
 
 def get_train_times(exp_dir):
-    train_log_files = "%s/log/" % (exp_dir)
-    train_log_names = "train.*.log"
-    train_log_lines = common_lib.get_command_stdout(
-        'find {0} -name "{1}" | xargs grep -H -e Accounting'.format(train_log_files,train_log_names))
     parse_regex = re.compile(".*train\.([0-9]+)\.([0-9]+)\.log:# "
                              "Accounting: time=([0-9]+) thread.*")
 
+    def parse_log(log_file):
+        records = []
+        for line in grep_log(log_file, "Accounting"):
+            mat_obj = parse_regex.search(line)
+            if mat_obj is not None:
+                groups = mat_obj.groups()
+                records.append((int(groups[0]), int(groups[1]),
+                                float(groups[2])))
+        return records
+
+    train_logs = parse_logs_incrementally(exp_dir, "train.*.log",
+                                          "train_times", parse_log)
+    if not any(records for _, records in train_logs):
+        raise KaldiLogParseException("Could not find any lines with "
+                                     "Accounting in {0}/log/train.*.log"
+                                     "".format(exp_dir))
+
     train_times = {}
-    for line in train_log_lines.split('\n'):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
+    for _, records in train_logs:
+        for iteration, job, train_time in records:
             try:
-                train_times[int(groups[0])][int(groups[1])] = float(groups[2])
+                train_times[iteration][job] = train_time
             except KeyError:
-                train_times[int(groups[0])] = {}
-                train_times[int(groups[0])][int(groups[1])] = float(groups[2])
+                train_times[iteration] = {}
+                train_times[iteration][job] = train_time
     iters = train_times.keys()
     for iter in iters:
         values = train_times[iter].values()
         train_times[iter] = max(values)
     return train_times
 
+def parse_objf_logs_incrementally(exp_dir, log_file_pattern, cache_name,
+                                  key, parse_regex):
+    """ Returns a dict from iteration to the objective string for 'key' in
+    the logs in <exp_dir>/log matching 'log_file_pattern', whose lines are
+    parsed with 'parse_regex' (the groups are the iteration, the name of the
+    objective and its value).  'cache_name' must identify 'parse_regex'.
+    """
+    def parse_log(log_file):
+        records = []
+        for line in grep_log(log_file, key):
+            mat_obj = parse_regex.search(line)
+            if mat_obj is not None:
+                groups = mat_obj.groups()
+                if groups[1] == key:
+                    records.append((int(groups[0]), groups[2]))
+        return records
+
+    objf = {}
+    for _, records in parse_logs_incrementally(
+            exp_dir, log_file_pattern,
+            "{0}.{1}".format(cache_name, key),
+            parse_log):
+        for iteration, value in records:
+            objf[iteration] = value
+    return objf
+
+
 def parse_prob_logs(exp_dir, key='accuracy', output="output"):
     train_prob_files = "%s/log/compute_prob_train.*.log" % (exp_dir)
     valid_prob_files = "%s/log/compute_prob_valid.*.log" % (exp_dir)
-    train_prob_strings = common_lib.get_command_stdout(
-        'grep -e {0} {1}'.format(key, train_prob_files))
-    valid_prob_strings = common_lib.get_command_stdout(
-        'grep -e {0} {1}'.format(key, valid_prob_files))
 
     # LOG
     # (nnet3-chain-compute-prob:PrintTotalStats():nnet-chain-diagnostics.cc:149)
@@ -411,26 +549,18 @@ def parse_prob_logs(exp_dir, key='accuracy', output="output"):
         "nnet.*diagnostics.cc:[0-9]+. Overall ([a-zA-Z\-]+) for "
         "'{output}'.*is ([0-9.\-e]+) .*per frame".format(output=output))
 
-    train_objf = {}
-    valid_objf = {}
-
-    for line in train_prob_strings.split('\n'):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            if groups[1] == key:
-                train_objf[int(groups[0])] = groups[2]
+    train_objf = parse_objf_logs_incrementally(
+        exp_dir, "compute_prob_train.*.log",
+        "compute_prob_train." + output, key,
+        parse_regex)
     if not train_objf:
         raise KaldiLogParseException("Could not find any lines with {k} in "
                 " {l}".format(k=key, l=train_prob_files))
 
-    for line in valid_prob_strings.split('\n'):
-        mat_obj = parse_regex.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            if groups[1] == key:
-                valid_objf[int(groups[0])] = groups[2]
-
+    valid_objf = parse_objf_logs_incrementally(
+        exp_dir, "compute_prob_valid.*.log",
+        "compute_prob_valid." + output, key,
+        parse_regex)
     if not valid_objf:
         raise KaldiLogParseException("Could not find any lines with {k} in "
                 " {l}".format(k=key, l=valid_prob_files))
@@ -447,10 +577,6 @@ def parse_prob_logs(exp_dir, key='accuracy', output="output"):
 def parse_rnnlm_prob_logs(exp_dir, key='objf'):
     train_prob_files = "%s/log/train.*.*.log" % (exp_dir)
     valid_prob_files = "%s/log/compute_prob.*.log" % (exp_dir)
-    train_prob_strings = common_lib.get_command_stdout(
-        'grep -e {0} {1}'.format(key, train_prob_files))
-    valid_prob_strings = common_lib.get_command_stdout(
-        'grep -e {0} {1}'.format(key, valid_prob_files))
 
     # LOG
     # (rnnlm-train[5.3.36~8-2ec51]:PrintStatsOverall():rnnlm-core-training.cc:118)
@@ -474,25 +600,15 @@ def parse_rnnlm_prob_logs(exp_dir, key='objf'):
         "rnnlm.*training.cc:[0-9]+. Overall ([a-zA-Z\-]+) is "
         ".*exact = \(.+\) = ([0-9.\-\+e]+)")
 
-    train_objf = {}
-    valid_objf = {}
-
-    for line in train_prob_strings.split('\n'):
-        mat_obj = parse_regex_train.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            if groups[1] == key:
-                train_objf[int(groups[0])] = groups[2]
+    train_objf = parse_objf_logs_incrementally(
+        exp_dir, "train.*.*.log", "rnnlm_train", key, parse_regex_train)
     if not train_objf:
         raise KaldiLogParseException("Could not find any lines with {k} in "
                 " {l}".format(k=key, l=train_prob_files))
 
-    for line in valid_prob_strings.split('\n'):
-        mat_obj = parse_regex_valid.search(line)
-        if mat_obj is not None:
-            groups = mat_obj.groups()
-            if groups[1] == key:
-                valid_objf[int(groups[0])] = groups[2]
+    valid_objf = parse_objf_logs_incrementally(
+        exp_dir, "compute_prob.*.log", "rnnlm_compute_prob", key,
+        parse_regex_valid)
 
     if not valid_objf:
         raise KaldiLogParseException("Could not find any lines with {k} in "
@@ -41,6 +41,29 @@ class RunOpts(object):
         self.prior_queue_opt = None
         self.parallel_train_opts = None
 
+def setup_job_scheduler(args):
+    """ Sets up the local job scheduler of libs.common from the
+    --scheduler.* options, if --scheduler.num-slots is nonzero.
+    """
+    if args.scheduler_num_slots == 0:
+        return
+    log_file = args.scheduler_log
+    if log_file is None:
+        log_file = "{0}/log/jobs.jsonl".format(args.dir)
+        if not os.path.exists(os.path.dirname(log_file)):
+            os.makedirs(os.path.dirname(log_file))
+    scheduler = common_lib.JobScheduler(
+        num_slots=(None if args.scheduler_num_slots < 0
+                   else args.scheduler_num_slots),
+        pin_cores=args.scheduler_pin_cores, log_file=log_file)
+    logger.info("Running at most {0} jobs at a time{1}; the resource usage "
+                "of the jobs is logged in {2}".format(
+                    scheduler.num_slots,
+                    " pinned to cores" if scheduler.pin_cores else "",
+                    log_file))
+    common_lib.set_job_scheduler(scheduler)
+
+
 def get_outputs_list(model_file, get_raw_nnet_from_am=True):
     """ Generates list of output-node-names used in nnet3 model configuration.
         It will normally return 'output'.
@@ -958,6 +981,27 @@ class CommonParser(object):
                                  help="Use GPU for training. "
                                  "Note 'true' and 'false' are deprecated.",
                                  default="yes")
+        self.parser.add_argument("--scheduler.num-slots", type=int,
+                                 dest="scheduler_num_slots", default=0,
+                                 help="""If nonzero, the jobs of the script
+                                 (e.g. the parallel training jobs) are run by
+                                 a local job scheduler that runs at most this
+                                 many jobs at a time; -1 means the number of
+                                 CPU cores.  Only useful with run.pl.""")
+        self.parser.add_argument("--scheduler.pin-cores", type=str,
+                                 dest="scheduler_pin_cores", default=False,
+                                 action=common_lib.StrToBoolAction,
+                                 choices=["true", "false"],
+                                 help="""If true, the job scheduler pins each
+                                 job to the CPU cores of its slots (with
+                                 taskset)""")
+        self.parser.add_argument("--scheduler.log", type=str,
+                                 dest="scheduler_log", default=None,
+                                 action=common_lib.NullstrToNoneAction,
+                                 help="""File to which the job scheduler
+                                 appends the wall time, CPU time and memory
+                                 use of each job, as JSON lines; the default
+                                 is <dir>/log/jobs.jsonl""")
         self.parser.add_argument("--cleanup", type=str,
                                  action=common_lib.StrToBoolAction,
                                  choices=["true", "false"], default=True,
@@ -238,6 +238,8 @@ def process_args(args):
                             if args.egs_command is not None else
                             args.command)
 
+    common_train_lib.setup_job_scheduler(args)
+
     return [args, run_opts]
 
 
@@ -327,6 +329,10 @@ def train(args, run_opts):
     default_egs_dir = '{0}/egs'.format(args.dir)
     if (args.stage <= -3) and args.egs_dir is None:
         logger.info("Generating end-to-end egs...")
+        # get_egs_e2e.sh runs --nj jobs (by default 15) at the same time
+        num_slots = common_lib.get_num_slots(
+            "{0} {1}".format(args.egs_opts if args.egs_opts is not None else '',
+                             run_opts.egs_command), num_jobs=15)
         common_lib.execute_command(
             """steps/nnet3/chain/e2e/get_egs_e2e.sh {egs_opts} \
                     --cmd "{command}" \
@@ -355,7 +361,8 @@ def train(args, run_opts):
                         srand=args.srand,
                         data=args.feat_dir, dir=args.dir, fst_dir=args.tree_dir,
                         egs_dir=default_egs_dir,
-                        egs_opts=args.egs_opts if args.egs_opts is not None else ''))
+                        egs_opts=args.egs_opts if args.egs_opts is not None else ''),
+            num_slots=num_slots)
 
     if args.egs_dir is None:
         egs_dir = default_egs_dir
@@ -10,7 +10,9 @@ from __future__ import print_function
 
 import os
 import argparse
-from collections import defaultdict
+from itertools import zip_longest
+
+import numpy as np
 
 
 def get_arc_scores(arc_path, score_path):
@@ -43,39 +45,74 @@ def get_arc_scores(arc_path, score_path):
     end, the lines of scores for each utterance in score_path have been sorted
     from the best to the worst.
     
+    The lines of each utterance are expected to be consecutive in both files,
+    as they are written by latbin/lattice-path-cover, so the utterances are
+    processed one at a time and only the arcs of the current utterance are
+    kept in memory.
+
     Args:
         arc_path (str):     A input file of state sequences to represent arcs.
         score_path (str):   A input file of neural LM scores in the above format.
 
     Returns:
-        The estimated scores of all arcs represented by a dictionary of dictionary.
+        A generator of the estimated scores of the arcs of each lattice, as
+        tuples of the utterance-id and three arrays (start states, end states
+        and scores of the arcs), in the order in which the arcs first occur.
     """
-    arc_scores = defaultdict(lambda: defaultdict(float))
     with open(arc_path, 'r', encoding='utf-8') as f1,\
          open(score_path, 'r', encoding='utf-8') as f2:
-        all_arcs = f1.readlines()
-        all_scores = f2.readlines()
-        assert len(all_arcs) == len(all_scores)
-        for arcs_per_line, scores_per_line in zip(all_arcs, all_scores):
+        done_keys = set()
+        key = None
+        starts, ends, scores = [], [], []
+        for arcs_per_line, scores_per_line in zip_longest(f1, f2):
+            assert arcs_per_line is not None and scores_per_line is not None, \
+                "The files of state sequences and scores have different numbers of lines."
             arcs_with_key = arcs_per_line.split()
-            key = arcs_with_key[0]
-            key = key.rsplit('-', 1)[0]
-            arcs = arcs_with_key[1:]
-            scores = scores_per_line.split()[1:]
-            for i in range(len(arcs) - 1):
-                arc = (int(arcs[i]), int(arcs[i + 1]))
-                score = float(scores[i])
-                if arc not in arc_scores[key]:
-                    arc_scores[key][arc] = score
-                else:
-                    continue
-            arc_final = (int(arcs[-1]), int(arcs[-1]))
-            score_final = float(scores[-1])
-            if arc_final not in arc_scores[key]:
-                arc_scores[key][arc_final] = score_final
-            else:
-                continue
-    return arc_scores
+            line_key = arcs_with_key[0].rsplit('-', 1)[0]
+            if line_key != key:
+                if key is not None:
+                    yield (key,) + get_first_arc_scores(starts, ends, scores)
+                    done_keys.add(key)
+                assert line_key not in done_keys, \
+                    "The lines of utterance {} are not consecutive.".format(line_key)
+                key = line_key
+                starts, ends, scores = [], [], []
+            arcs = np.array(arcs_with_key[1:], dtype=np.int64)
+            assert len(arcs) > 0, "Empty state sequence: {}".format(arcs_per_line)
+            line_scores = np.array(scores_per_line.split()[1:], dtype=np.float64)
+            # The arcs (arcs[i], arcs[i + 1]) have the scores line_scores[i];
+            # the last score is for the final arc (arcs[-1], arcs[-1]).
+            starts.append(arcs[:-1])
+            starts.append(arcs[-1:])
+            ends.append(arcs[1:])
+            ends.append(arcs[-1:])
+            scores.append(line_scores[:len(arcs) - 1])
+            scores.append(line_scores[-1:])
+        if key is not None:
+            yield (key,) + get_first_arc_scores(starts, ends, scores)
+
+
+def get_first_arc_scores(starts, ends, scores):
+    r"""Keep the score of the first occurrence of each arc (which is on the
+    best path that contains it).
+
+    Args:
+        starts, ends, scores: Lists of arrays of the start states, end states
+                              and scores of the arcs of the paths of a lattice.
+
+    Returns:
+        A tuple of three arrays with the start states, end states and scores
+        of the distinct arcs, in the order in which they first occur.
+    """
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    scores = np.concatenate(scores)
+    assert len(scores) == len(starts), "Fewer scores than arcs."
+    # An arc is identified by a single integer.
+    arc_ids = starts * (int(ends.max()) + 1) + ends
+    _, first_index = np.unique(arc_ids, return_index=True)
+    first_index.sort()
+    return starts[first_index], ends[first_index], scores[first_index]
 
 
 def write_scores(arc_scores, path):
@@ -91,13 +128,16 @@ def write_scores(arc_scores, path):
         ...
 
     Args:
-        arc_scores: Nueral LM scores of arcs of each lattice.
+        arc_scores: Nueral LM scores of arcs of each lattice, as generated by
+                    get_arc_scores(); they are written as they are generated.
         path (str): Output file of arc scores in the above format.
     """
     with open(path, 'w', encoding='utf-8') as f:
-        for key in arc_scores.keys():
-            for arc, score in arc_scores[key].items():
-                f.write('{0} {1} {2} {3}\n'.format(key, arc[0], arc[1], score))
+        for key, starts, ends, scores in arc_scores:
+            f.writelines(['{0} {1} {2} {3}\n'.format(key, start, end, score)
+                          for start, end, score in zip(starts.tolist(),
+                                                       ends.tolist(),
+                                                       scores.tolist())])
     print("Write estimated neural LM scores to file {}.".format(path))
 
 
@@ -116,9 +156,9 @@ def main():
     assert os.path.exists(args.arc_ids), "Path for input state sequences does not exist."
     assert os.path.exists(args.scores), "Path for neural language model scores does not exist."
     
-    print("Load state sequences and neural LM scores.")
+    print("Estimate scores for each arc from state sequences and neural LM "
+          "scores, and write them out.")
     arc_scores = get_arc_scores(args.arc_ids, args.scores)
-    print("Write out estimated scores for each arc.")
     write_scores(arc_scores, args.outfile)
 
 if __name__ == '__main__':
@@ -10,6 +10,10 @@ embedding_dim=768
 hidden_dim=768
 nlayers=6
 nhead=8
+batch_size=0   # if >0, Transformer models score hypotheses of all utterances
+               # in batches of this many hypotheses of similar lengths.
+num_workers=1  # number of processes per job scoring those batches.
+num_threads=0  # number of PyTorch threads per process (0: PyTorch default).
 
 inv_acwt=10
 weight=0.8 # interpolation weight of a neural network LM with a N-gram LM
@@ -197,7 +201,10 @@ if [ $stage -le 6 ]; then
         --nhid $hidden_dim \
         --nlayers $nlayers \
         --nhead $nhead \
-        --oov "$oov_symbol"
+        --oov "$oov_symbol" \
+        --batch-size $batch_size \
+        --num-workers $num_workers \
+        --num-threads $num_threads
 fi
 
 if [ $stage -le 7 ]; then
@@ -162,7 +162,7 @@ def run(args):
 
     with common_lib.smart_open(args.pasted_targets) as targets_reader, \
             common_lib.smart_open(args.out_targets, 'w') as targets_writer:
-        for key, mat in common_lib.read_mat_ark(targets_reader):
+        for key, mat in common_lib.read_mat_ark_numpy(targets_reader):
             mat = np.matrix(mat)
             if mat.shape[1] % args.dim != 0:
                 raise RuntimeError(
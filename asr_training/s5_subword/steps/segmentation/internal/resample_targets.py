@@ -4,7 +4,7 @@
 # Apache 2.0
 
 """
-This script reads a Kaldi text archive of matrices from 'targets_in_ark' (e.g.
+This script reads a Kaldi archive of matrices from 'targets_in_ark' (e.g.
 '-' for standard input), modifies them by subsampling them, and writes the
 modified archive to 'targets_out_ark'.
 This form of 'subsampling' is similar to taking every n'th frame (specifically:
@@ -35,7 +35,7 @@ logger.addHandler(handler)
 def get_args():
     parser = argparse.ArgumentParser(
         description="""
-This script reads a Kaldi text archive of matrices from 'targets_in_ark' (e.g.
+This script reads a Kaldi archive of matrices from 'targets_in_ark' (e.g.
 '-' for standard input), modifies them by subsampling them, and writes the
 modified archive to 'targets_out_ark'.
 This form of 'subsampling' is similar to taking every n'th frame (specifically:
@@ -69,11 +69,11 @@ it subsamples by averaging.""")
 
 def run(args):
     num_utts = 0
-    for key, mat in common_lib.read_mat_ark(args.targets_in_ark):
+    for key, mat in common_lib.read_mat_ark_numpy(args.targets_in_ark):
         mat = np.matrix(mat)
         if args.subsampling_factor > 0:
             num_indexes = ((mat.shape[0] + args.subsampling_factor - 1)
-                            / args.subsampling_factor)
+                            // args.subsampling_factor)
 
         out_mat = np.zeros([num_indexes, mat.shape[1]])
         i = 0
@@ -93,7 +93,7 @@ def run(args):
                 logger.error("mat.shape = {0}, st = {1}, end = {2}"
                              "".format(mat.shape, st, end))
                 raise
-            assert i == k / args.subsampling_factor
+            assert i == k // args.subsampling_factor
             i += 1
 
         common_lib.write_matrix_ascii(args.targets_out_ark, out_mat, key=key)
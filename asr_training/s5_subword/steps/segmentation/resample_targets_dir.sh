@@ -73,7 +73,7 @@ if [ $subsampling_factor -eq 1 ]; then
   cp $targets_dir/frame_subsampling_factor $dir || true
 elif [ $subsampling_factor -gt 1 ]; then
   $cmd JOB=1:$nj $dir/log/resample_targets.JOB.log \
-    copy-feats scp:$targets_dir/split${nj}/targets.JOB.scp ark,t:- \| \
+    copy-feats scp:$targets_dir/split${nj}/targets.JOB.scp ark:- \| \
     steps/segmentation/internal/resample_targets.py \
       --subsampling-factor=$subsampling_factor \
       - - \| \
@@ -13,8 +13,15 @@ Proceedings of the 54th Annual Meeting of the Association for Computational Ling
 """
 
 import sys
+import os
 import argparse
 import re
+import heapq
+import hashlib
+import pickle
+import itertools
+import multiprocessing
+from collections import deque
 
 class BPE(object):
 
@@ -51,6 +58,37 @@ class BPE(object):
 
         self.cache = {}
 
+    def _cache_key(self):
+        # the segmentation of a word only depends on these, so a cache file is
+        # only used if it was written with the same ones.
+        return hashlib.sha1(repr((sorted(self.bpe_codes.items(), key=lambda x: x[1]),
+                                  self.separator,
+                                  sorted(self.vocab) if self.vocab else None,
+                                  self.glossaries,
+                                  self.version)).encode('utf-8')).hexdigest()
+
+    def load_cache(self, cache_file):
+        """read the segmentations of words stored by save_cache(), unless the file
+        was written with different codes, vocabulary, separator or glossaries"""
+
+        with open(cache_file, 'rb') as f:
+            cache_key, cache = pickle.load(f)
+        if cache_key != self._cache_key():
+            sys.stderr.write('Warning: ignoring cache file {0}, which was written with different '
+                             'BPE codes or options\n'.format(cache_file))
+            return
+        self.cache.update(cache)
+
+    def save_cache(self, cache_file):
+        """write the segmentations of all words seen so far to a cache file"""
+
+        # write to a temporary file first, so that an interrupted run or
+        # another run using the same cache file never sees a partial file.
+        tmp_file = '{0}.tmp.{1}'.format(cache_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((self._cache_key(), self.cache), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
     def process_line(self, line):
         """segment line, dealing with leading and trailing whitespace"""
 
@@ -75,15 +113,19 @@ class BPE(object):
             # eliminate double spaces
             if not word:
                 continue
-            new_word = [out for segment in self._isolate_glossaries(word)
-                        for out in encode(segment,
-                                          self.bpe_codes,
-                                          self.bpe_codes_reverse,
-                                          self.vocab,
-                                          self.separator,
-                                          self.version,
-                                          self.cache,
-                                          self.glossaries)]
+            # a word that is in the cache was encoded as a whole before, so
+            # it does not contain any glossaries.
+            new_word = self.cache.get(word)
+            if new_word is None:
+                new_word = [out for segment in self._isolate_glossaries(word)
+                            for out in encode(segment,
+                                              self.bpe_codes,
+                                              self.bpe_codes_reverse,
+                                              self.vocab,
+                                              self.separator,
+                                              self.version,
+                                              self.cache,
+                                              self.glossaries)]
 
             for item in new_word[:-1]:
                 output.append(item + self.separator)
@@ -136,6 +178,20 @@ def create_parser():
         metavar="STR",
         help="Glossaries. The strings provided in glossaries will not be affected"+
              "by the BPE (i.e. they will neither be broken into subwords, nor concatenated with other subwords")
+    parser.add_argument(
+        '--cache-file', type=str, default=None,
+        metavar="PATH",
+        help="File with the segmentations of the words seen in previous runs with the same codes "+
+             "and options. It is read if it exists, and written with the words seen in this run added "+
+             "(default: no cache file).")
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=1,
+        metavar="INT",
+        help="Number of processes used to segment the input (default: %(default)s)")
+    parser.add_argument(
+        '--lines-per-job', type=int, default=10000,
+        metavar="INT",
+        help="With --jobs > 1, the input is segmented in blocks of this many lines (default: %(default)s)")
 
     return parser
 
@@ -169,39 +225,10 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache,
     else:
         raise NotImplementedError
 
-    pairs = get_pairs(word)
-
-    if not pairs:
+    if len(word) < 2:
         return orig
 
-    while True:
-        bigram = min(pairs, key = lambda pair: bpe_codes.get(pair, float('inf')))
-        if bigram not in bpe_codes:
-            break
-        first, second = bigram
-        new_word = []
-        i = 0
-        while i < len(word):
-            try:
-                j = word.index(first, i)
-                new_word.extend(word[i:j])
-                i = j
-            except:
-                new_word.extend(word[i:])
-                break
-
-            if word[i] == first and i < len(word)-1 and word[i+1] == second:
-                new_word.append(first+second)
-                i += 2
-            else:
-                new_word.append(word[i])
-                i += 1
-        new_word = tuple(new_word)
-        word = new_word
-        if len(word) == 1:
-            break
-        else:
-            pairs = get_pairs(word)
+    word = merge_symbols(list(word), bpe_codes)
 
     # don't print end-of-word symbols
     if word[-1] == '</w>':
@@ -215,6 +242,65 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache,
     cache[orig] = word
     return word
 
+def merge_symbols(symbols, bpe_codes):
+    """Apply the merge operations to the list of symbols 'symbols' and
+    return the resulting tuple of symbols.  'bpe_codes' is a dict from
+    pair of symbols to merge rank.  The result is the same as repeatedly
+    merging all occurrences of the pair with the lowest rank from left to
+    right, but the symbols are kept in a linked list and the candidate
+    merges in a heap of (rank, position), so each merge only looks at its
+    neighbours instead of at the whole word.
+    """
+    next_pos = list(range(1, len(symbols) + 1))
+    next_pos[-1] = -1
+    prev_pos = list(range(-1, len(symbols) - 1))
+
+    heap = []
+    for i in range(len(symbols) - 1):
+        rank = bpe_codes.get((symbols[i], symbols[i+1]))
+        if rank is not None:
+            heap.append((rank, i))
+    heapq.heapify(heap)
+
+    while heap:
+        # all occurrences of this pair are merged, from left to right, before
+        # any pair created by these merges.
+        rank, i = heapq.heappop(heap)
+        positions = [i]
+        while heap and heap[0][0] == rank:
+            positions.append(heapq.heappop(heap)[1])
+        positions.sort()
+        new_positions = []
+        for i in positions:
+            # skip entries that are no longer valid because of earlier merges.
+            if symbols[i] is None:
+                continue
+            j = next_pos[i]
+            if j == -1 or bpe_codes.get((symbols[i], symbols[j])) != rank:
+                continue
+            symbols[i] += symbols[j]
+            symbols[j] = None
+            k = next_pos[j]
+            next_pos[i] = k
+            if k != -1:
+                prev_pos[k] = i
+            new_positions.append(i)
+        for i in new_positions:
+            if symbols[i] is None:
+                continue
+            h = prev_pos[i]
+            if h != -1:
+                new_rank = bpe_codes.get((symbols[h], symbols[i]))
+                if new_rank is not None:
+                    heapq.heappush(heap, (new_rank, h))
+            k = next_pos[i]
+            if k != -1:
+                new_rank = bpe_codes.get((symbols[i], symbols[k]))
+                if new_rank is not None:
+                    heapq.heappush(heap, (new_rank, i))
+
+    return tuple([symbol for symbol in symbols if symbol is not None])
+
 def recursive_split(segment, bpe_codes, vocab, separator, final=False):
     """Recursively split segment into smaller units (by reversing BPE merges)
     until all units are either in-vocabulary, or cannot be split futher."""
@@ -297,6 +383,41 @@ def isolate_glossary(word, glossary):
         segments = [segment.strip() for split in splits[:-1] for segment in [split, glossary] if segment != '']
         return segments + [splits[-1].strip()] if splits[-1] != '' else segments
 
+# the BPE object of a worker process with --jobs > 1, created by _init_worker()
+worker_bpe = None
+
+def _init_worker(codes, merges, separator, vocab, glossaries, cache):
+    """create the BPE object of a worker process from the codes file 'codes',
+    starting with the segmentations in 'cache'.  This does not rely on the
+    worker being forked from the main process."""
+
+    global worker_bpe
+    with open(codes, 'r', encoding='utf-8') as codes_file:
+        worker_bpe = BPE(codes_file, merges, separator, vocab, glossaries)
+    worker_bpe.cache.update(cache)
+
+def process_lines(lines):
+    """segment a list of lines with the BPE object of the worker process (this
+    is run by the worker processes with --jobs > 1).  Returns the output text
+    and the list of (word, segmentation) pairs added to the cache."""
+
+    cache_size = len(worker_bpe.cache)
+    out = ''.join([worker_bpe.process_line(line) for line in lines])
+    # dicts preserve insertion order, so the new cache entries come last.
+    new_cache_items = list(reversed(list(
+        itertools.islice(reversed(worker_bpe.cache.items()), len(worker_bpe.cache) - cache_size))))
+    return out, new_cache_items
+
+def read_blocks(fobj, lines_per_block):
+    block = []
+    for line in fobj:
+        block.append(line)
+        if len(block) == lines_per_block:
+            yield block
+            block = []
+    if block:
+        yield block
+
 if __name__ == '__main__':
     parser = create_parser()
     args = parser.parse_args()
@@ -317,5 +438,31 @@ if __name__ == '__main__':
 
     bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries)
 
-    for line in args.input:
-        args.output.write(bpe.process_line(line))
+    if args.cache_file and os.path.exists(args.cache_file):
+        bpe.load_cache(args.cache_file)
+
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs, initializer=_init_worker,
+                                    initargs=(args.codes.name, args.merges, args.separator,
+                                              vocabulary, args.glossaries, bpe.cache))
+        # at most two blocks per process are read ahead.
+        results = deque()
+        def write_result(result):
+            out, new_cache_items = result.get()
+            args.output.write(out)
+            if args.cache_file:
+                bpe.cache.update(new_cache_items)
+        for block in read_blocks(args.input, args.lines_per_job):
+            results.append(pool.apply_async(process_lines, (block,)))
+            if len(results) >= 2 * args.jobs:
+                write_result(results.popleft())
+        while results:
+            write_result(results.popleft())
+        pool.close()
+        pool.join()
+    else:
+        for line in args.input:
+            args.output.write(bpe.process_line(line))
+
+    if args.cache_file:
+        bpe.save_cache(args.cache_file)
@@ -6,8 +6,12 @@
 
 from __future__ import print_function
 import argparse
+import os
 import sys
 import math
+from array import array
+
+import numpy as np
 
 parser = argparse.ArgumentParser(description="This script evaluates the log probabilty (default log base is e) of each sentence "
                                              "from data (in text form), given a language model in arpa form "
@@ -24,6 +28,11 @@ parser.add_argument("prob_file", type=str,
                     help="Filename of output probability file.")
 parser.add_argument("--log-base", type=float, default=math.exp(1),
                     help="Log base for log porbability")
+parser.add_argument("--binary-cache", type=str, default="false", choices=["true", "false"],
+                    help="If true, the loaded model is cached in binary form in ARPA_LM.cache.npz "
+                         "(rebuilt when the arpa file is newer), which is much faster to load.")
+parser.add_argument("--batch-size", type=int, default=10000,
+                    help="Number of sentences that are scored together.")
 args = parser.parse_args()
 
 def check_args(args):
@@ -31,6 +40,8 @@ def check_args(args):
     args.prob_file_handle = sys.stdout if args.prob_file == "-" else open(args.prob_file, "w")
     if args.log_base <= 0:
         sys.exit("compute_sentence_probs_arpa.py: Invalid log base (must be greater than 0)")
+    if args.batch_size <= 0:
+        sys.exit("compute_sentence_probs_arpa.py: Invalid batch size (must be greater than 0)")
 
 def is_logprob(input):
     if input[0] == "-":
@@ -42,114 +53,314 @@ def is_logprob(input):
     else:
         return False
 
-def check_number(model_file, tot_num):
-    cur_num = 0
+
+# The language model is stored as a trie of sorted arrays. The words are
+# represented by integers (their index in 'words'). For each order k, the nodes
+# of order k are the ngrams of the arpa file with k words, plus the prefixes of
+# longer ngrams that are not in the arpa file themselves (so that every node has
+# a parent). Node i of order k has the key
+#   keys[k][i] = parent * vocab_size + word,
+# where parent is the node of its first k-1 words (0 for order 1); the keys are
+# sorted, so that a node is found by binary search. is_ngram[k][i] tells whether
+# the node is an ngram of the arpa file, and logprobs[k][i] and backoffs[k][i]
+# hold its log10 probability and backoff weight (0.0 if it has none).
+class ArpaModel(object):
+    def __init__(self, words, keys, logprobs, backoffs, is_ngram, num_ngrams, header_num_ngrams,
+                 max_ngram_order):
+        self.words = words
+        self.word_to_index = dict((word, i) for i, word in enumerate(words))
+        self.vocab_size = len(words)
+        # Lists indexed by order (element 0 is unused).
+        self.keys = keys
+        self.logprobs = logprobs
+        self.backoffs = backoffs
+        self.is_ngram = is_ngram
+        # Number of ngrams in the arpa file and in its header.
+        self.num_ngrams = num_ngrams
+        self.header_num_ngrams = header_num_ngrams
+        self.max_ngram_order = max_ngram_order
+        self.unigram_to_index = None
+
+    def order(self):
+        return len(self.keys) - 1
+
+    def find(self, order, parents, words):
+        """Returns the nodes of the given order with the given parent nodes (of
+        order - 1) and last words, or -1 where there is no such node."""
+        if order > self.order():
+            return np.full(len(words), -1, dtype=np.int64)
+        query = words.astype(np.int64)
+        if order > 1:
+            query += parents * self.vocab_size
+        keys = self.keys[order]
+        if len(keys) == 0:
+            return np.full(len(words), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+        found = (keys[pos] == query) & (words >= 0)
+        if order > 1:
+            found &= parents >= 0
+        return np.where(found, pos, -1)
+
+    def find_ngrams(self, rows):
+        """Returns the nodes of the ngrams in 'rows' (an integer array of shape
+        (num_ngrams, order)), or -1 where there is no such node."""
+        nodes = np.zeros(len(rows), dtype=np.int64)
+        for k in range(1, rows.shape[1] + 1):
+            nodes = self.find(k, nodes, rows[:, k - 1])
+        return nodes
+
+    def get_sentence_logprobs(self, sentences, ngram_order):
+        """Returns the log10 probabilities of the sentences (lists of words)."""
+        if self.unigram_to_index is None:
+            nodes = self.find(1, None, np.arange(self.vocab_size))
+            is_unigram = (nodes >= 0) & self.is_ngram[1][np.maximum(nodes, 0)]
+            self.unigram_to_index = dict((self.words[i], i) for i in np.flatnonzero(is_unigram).tolist())
+        # words that are not unigrams are mapped to <unk>
+        unk = self.word_to_index.get("<unk>", -1)
+        word_ids = []
+        lengths = []
+        for sentence in sentences:
+            word_ids += [self.unigram_to_index.get(word, unk) for word in sentence]
+            lengths.append(len(sentence))
+        word_ids = np.array(word_ids, dtype=np.int64)
+        lengths = np.array(lengths, dtype=np.int64)
+        starts = np.cumsum(lengths) - lengths
+        # position of each word in its sentence
+        positions = np.arange(len(word_ids)) - np.repeat(starts, lengths)
+
+        # nodes[k][t] is the node of the k-gram ending at word t (or -1).
+        nodes = [None, self.find(1, None, word_ids)]
+        for k in range(2, ngram_order + 1):
+            parents = np.full(len(word_ids), -1, dtype=np.int64)
+            parents[1:] = nodes[k - 1][:-1]
+            parents[positions < k - 1] = -1
+            nodes.append(self.find(k, parents, word_ids))
+
+        # The word at position t is predicted from the (at most ngram_order - 1)
+        # preceding words, using the longest ngram that is in the arpa file,
+        # plus the backoff weights of the histories of the longer ngrams.
+        orders = np.minimum(positions + 1, ngram_order)
+        found_orders = np.zeros(len(word_ids), dtype=np.int64)
+        logprobs = np.zeros(len(word_ids))
+        for k in range(1, ngram_order + 1):
+            node = nodes[k]
+            found = (k <= orders) & (node >= 0)
+            found[found] = self.is_ngram[k][node[found]]
+            found_orders[found] = k
+            logprobs[found] = self.logprobs[k][node[found]]
+
+        # The word at position 0 (<s>) is not predicted, and in sentences
+        # shorter than ngram_order neither is the last word.
+        targets = (positions > 0) if ngram_order > 1 else (positions >= 0)
+        targets[(starts + lengths - 1)[(lengths < ngram_order) & (lengths > 0)]] = False
+        if np.any(targets & (found_orders == 0)):
+            sys.exit("compute_sentence_probs_arpa.py: Ngram substring not found in arpa language model, please check.")
+
+        for k in range(2, ngram_order + 1):
+            backoff = (k > found_orders) & (k <= orders) & targets
+            history = np.full(len(word_ids), -1, dtype=np.int64)
+            history[1:] = nodes[k - 1][:-1]
+            history = history[backoff]
+            logprobs[backoff] += np.where(history >= 0,
+                                          self.backoffs[k - 1][np.maximum(history, 0)], 0.0)
+
+        # Sum up in the order of the words, like a loop over the words would.
+        sentence_logprobs = []
+        logprobs = logprobs[targets].tolist()
+        num_targets = np.bincount(np.repeat(np.arange(len(lengths)), lengths)[targets],
+                                  minlength=len(lengths)).tolist()
+        start = 0
+        for n in num_targets:
+            sentence_logprobs.append(sum(logprobs[start:start + n]))
+            start += n
+        return sentence_logprobs
+
+    def write_cache(self, cache_file):
+        arrays = {"words": np.frombuffer("\n".join(self.words).encode("utf-8"), dtype=np.uint8),
+                  "counts": np.array([self.num_ngrams, self.header_num_ngrams,
+                                      self.max_ngram_order], dtype=np.int64)}
+        for k in range(1, self.order() + 1):
+            arrays["keys_{}".format(k)] = self.keys[k]
+            arrays["logprobs_{}".format(k)] = self.logprobs[k]
+            arrays["backoffs_{}".format(k)] = self.backoffs[k]
+            arrays["is_ngram_{}".format(k)] = self.is_ngram[k]
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "wb") as f:
+            np.savez(f, **arrays)
+        os.rename(tmp_file, cache_file)
+
+    @staticmethod
+    def read_cache(cache_file):
+        with np.load(cache_file) as arrays:
+            words = arrays["words"].tobytes().decode("utf-8")
+            words = words.split("\n") if len(words) > 0 else []
+            num_ngrams, header_num_ngrams, max_ngram_order = arrays["counts"].tolist()
+            keys, logprobs, backoffs, is_ngram = [None], [None], [None], [None]
+            k = 1
+            while "keys_{}".format(k) in arrays:
+                keys.append(arrays["keys_{}".format(k)])
+                logprobs.append(arrays["logprobs_{}".format(k)])
+                backoffs.append(arrays["backoffs_{}".format(k)])
+                is_ngram.append(arrays["is_ngram_{}".format(k)])
+                k += 1
+        return ArpaModel(words, keys, logprobs, backoffs, is_ngram, num_ngrams,
+                         header_num_ngrams, max_ngram_order)
+
+
+# This function reads the header of the arpa file (the lines after "\data\"
+# up to the first line without "=") and returns the total number of ngrams
+# and the maximum ngram order given there.
+def read_header(model):
+    tot_num = 0
     max_ngram_order = 0
-    with open(model_file) as model:
-        lines = model.readlines()
-        for line in lines[1:]:
-            if "=" not in line:
-                return (cur_num == tot_num), max_ngram_order
-            cur_num += int(line.split("=")[-1])
-            max_ngram_order = int(line.split("=")[0].split()[-1])
-
-# This function load language model in arpa form and save in a dictionary for
-# computing sentence probabilty of input text file.
+    for line in model:
+        if "=" not in line:
+            return tot_num, max_ngram_order
+        tot_num += int(line.split("=")[-1])
+        max_ngram_order = int(line.split("=")[0].split()[-1])
+    sys.exit("compute_sentence_probs_arpa.py: Wrong loading model.")
+
+# This function load language model in arpa form and save in a trie of sorted arrays
+# (see ArpaModel) for computing sentence probabilty of input text file.
 def load_model(model_file):
     with open(model_file) as model:
-        ngram_dict = {}
-        lines = model.readlines()
-
         # check arpa form
-        if lines[0][:-1] != "\\data\\":
+        if model.readline()[:-1] != "\\data\\":
             sys.exit("compute_sentence_probs_arpa.py: Please make sure that language model is in arpa form.")
+        header_num_ngrams, max_ngram_order = read_header(model)
+
+        word_to_index = {}
+        # the words, log-probs and backoff weights of the ngrams, by order
+        ngram_words = [None]
+        ngram_logprobs = [None]
+        ngram_backoffs = [None]
+        num_empty = 0
 
         # read line
-        for line in lines:
+        for line in model:
             if line[0] == "-":
                 line_split = line.split()
                 if is_logprob(line_split[-1]):
-                    ngram_key = " ".join(line_split[1:-1])
-                    if ngram_key in ngram_dict:
-                        sys.exit("compute_sentence_probs_arpa.py: Duplicated ngram in arpa language model: {}.".format(ngram_key))
-                    ngram_dict[ngram_key] = (line_split[0], line_split[-1])
+                    ngram = line_split[1:-1]
+                    backoff = -float(line_split[-1][1:])
                 else:
-                    ngram_key = " ".join(line_split[1:])
-                    if ngram_key in ngram_dict:
-                        sys.exit("compute_sentence_probs_arpa.py: Duplicated ngram in arpa language model: {}.".format(ngram_key))
-                    ngram_dict[ngram_key] = (line_split[0],)
+                    ngram = line_split[1:]
+                    backoff = 0.0
+                n = len(ngram)
+                if n == 0:
+                    num_empty += 1
+                    if num_empty > 1:
+                        sys.exit("compute_sentence_probs_arpa.py: Duplicated ngram in arpa language model: .")
+                    continue
+                while len(ngram_words) <= n:
+                    ngram_words.append(array('i'))
+                    ngram_logprobs.append(array('d'))
+                    ngram_backoffs.append(array('d'))
+                # most words are already known, so only add new words if needed
+                start = len(ngram_words[n])
+                try:
+                    ngram_words[n].extend(map(word_to_index.__getitem__, ngram))
+                except KeyError:
+                    del ngram_words[n][start:]
+                    ngram_words[n].extend([word_to_index.setdefault(word, len(word_to_index))
+                                           for word in ngram])
+                ngram_logprobs[n].append(-float(line_split[0][1:]))
+                ngram_backoffs[n].append(backoff)
 
-    return ngram_dict, len(ngram_dict)
+    words = list(word_to_index)
+    order = len(ngram_words) - 1
+    rows = [None] + [np.frombuffer(ngram_words[k], dtype=np.int32).reshape(-1, k)
+                     for k in range(1, order + 1)]
+    num_ngrams = num_empty + sum(len(rows[k]) for k in range(1, order + 1))
 
-def compute_sublist_prob(sub_list):
-    if len(sub_list) == 0:
-        sys.exit("compute_sentence_probs_arpa.py: Ngram substring not found in arpa language model, please check.")
+    # Prefixes of ngrams that are not ngrams themselves are added as extra
+    # nodes, so that every node has a parent. Their own prefixes may be missing
+    # as well, so we build the trie again until no prefixes are missing (for
+    # a well-formed arpa file, the first trie is complete).
+    extra_rows = [np.zeros((0, k), dtype=np.int32) for k in range(order + 1)]
+    while True:
+        model = ArpaModel(words, [None], [None], [None], [None], num_ngrams,
+                          header_num_ngrams, max_ngram_order)
+        missing = False
+        for k in range(1, order + 1):
+            all_rows = np.concatenate([rows[k], extra_rows[k]])
+            if k > 1:
+                parents = model.find_ngrams(all_rows[:, :-1])
+            else:
+                parents = np.zeros(len(all_rows), dtype=np.int64)
+            has_parent = parents >= 0
+            if not np.all(has_parent):
+                extra_rows[k - 1] = np.concatenate([extra_rows[k - 1],
+                                                    all_rows[~has_parent, :-1]])
+                missing = True
+            keys = parents * len(words) + all_rows[:, -1]
+            # the rows of the ngrams themselves (not the extra rows) that have a parent
+            is_ngram = has_parent[:len(rows[k])]
+            ngram_keys = keys[:len(rows[k])][is_ngram]
+            if len(np.unique(ngram_keys)) < len(ngram_keys):
+                _, first = np.unique(keys[:len(rows[k])], return_index=True)
+                duplicate = np.setdiff1d(np.flatnonzero(is_ngram), first)[0]
+                sys.exit("compute_sentence_probs_arpa.py: Duplicated ngram in arpa language model: {}.".format(
+                    " ".join(words[i] for i in rows[k][duplicate])))
+            node_keys, inverse = np.unique(keys[has_parent], return_inverse=True)
+            ngram_node = inverse.reshape(-1)[:len(ngram_keys)]
+            model.keys.append(node_keys)
+            model.logprobs.append(np.zeros(len(node_keys)))
+            model.logprobs[k][ngram_node] = np.frombuffer(ngram_logprobs[k], dtype=np.float64)[is_ngram]
+            model.backoffs.append(np.zeros(len(node_keys)))
+            model.backoffs[k][ngram_node] = np.frombuffer(ngram_backoffs[k], dtype=np.float64)[is_ngram]
+            model.is_ngram.append(np.zeros(len(node_keys), dtype=bool))
+            model.is_ngram[k][ngram_node] = True
+        if not missing:
+            return model
 
-    sub_string = " ".join(sub_list)
-    if sub_string in ngram_dict:
-        return -float(ngram_dict[sub_string][0][1:])
-    else:
-        backoff_substring = " ".join(sub_list[:-1])
-        backoff_weight = 0.0 if (backoff_substring not in ngram_dict or len(ngram_dict[backoff_substring]) < 2) \
-                         else -float(ngram_dict[backoff_substring][1][1:])
-        return compute_sublist_prob(sub_list[1:]) + backoff_weight
-
-def compute_begin_prob(sub_list):
-    logprob = 0
-    for i in range(1, len(sub_list) - 1):
-        logprob += compute_sublist_prob(sub_list[:i + 1])
-    return logprob
+# This function loads the model from the binary cache next to the arpa file if
+# it is up to date, and otherwise from the arpa file (writing the cache if
+# use_cache is true).
+def load_model_cached(model_file, use_cache):
+    cache_file = model_file + ".cache.npz"
+    if use_cache and os.path.exists(cache_file) and \
+       os.path.getmtime(cache_file) >= os.path.getmtime(model_file):
+        return ArpaModel.read_cache(cache_file)
+    model = load_model(model_file)
+    if use_cache:
+        model.write_cache(cache_file)
+    return model
 
 # The probability is computed in this way:
-# p(word_N | word_N-1 ... word_1) = ngram_dict[word_1 ... word_N][0].
-# Here gram_dict is a dictionary stores a tuple corresponding to ngrams.
-# The first element of tuple is probablity and the second is backoff probability (if exists).
-# If the particular ngram (word_1 ... word_N) is not in the dictionary, then
+# p(word_N | word_N-1 ... word_1) = logprob of ngram (word_1 ... word_N).
+# If the particular ngram (word_1 ... word_N) is not in the model, then
 # p(word_N | word_N-1 ... word_1) = p(word_N | word_(N-1) ... word_2) * backoff_weight(word_(N-1) | word_(N-2) ... word_1)
-# If the sequence (word_(N-1) ... word_1) is not in the dictionary, then the backoff_weight gets replaced with 0.0 (log1)
+# If the sequence (word_(N-1) ... word_1) is not in the model, then the backoff_weight gets replaced with 0.0 (log1)
 # More details can be found in https://cmusphinx.github.io/wiki/arpaformat/
-def compute_sentence_prob(sentence, ngram_order):
-    sentence_split = sentence.split()
-    for i in range(len(sentence_split)):
-        if sentence_split[i] not in ngram_dict:
-            sentence_split[i] = "<unk>"
-    sen_length = len(sentence_split)
-
-    if sen_length < ngram_order:
-        return compute_begin_prob(sentence_split)
-    else:
-        logprob = 0
-        begin_sublist = sentence_split[:ngram_order]
-        logprob += compute_begin_prob(begin_sublist)
-
-        for i in range(sen_length - ngram_order + 1):
-            cur_sublist = sentence_split[i : i + ngram_order]
-            logprob += compute_sublist_prob(cur_sublist)
-
-    return logprob
-
-
-def output_result(text_in_handle, output_file_handle, ngram_order):
-    lines = text_in_handle.readlines()
+# Words that are not in the model are replaced by <unk>. The sentences are
+# scored in batches of batch_size.
+def output_result(model, text_in_handle, output_file_handle, ngram_order, batch_size):
     logbase_modifier = math.log(10, args.log_base)
-    for line in lines:
-        new_line = "<s> " + line[:-1] + " </s>"
-        logprob = compute_sentence_prob(new_line, ngram_order)
-        new_logprob = logprob * logbase_modifier
-        output_file_handle.write("{}\n".format(new_logprob))
+    batch = []
+    for line in text_in_handle:
+        batch.append(("<s> " + line[:-1] + " </s>").split())
+        if len(batch) == batch_size:
+            for logprob in model.get_sentence_logprobs(batch, ngram_order):
+                output_file_handle.write("{}\n".format(logprob * logbase_modifier))
+            batch = []
+    if len(batch) > 0:
+        for logprob in model.get_sentence_logprobs(batch, ngram_order):
+            output_file_handle.write("{}\n".format(logprob * logbase_modifier))
     text_in_handle.close()
     output_file_handle.close()
 
 
 if __name__ == "__main__":
     check_args(args)
-    ngram_dict, tot_num = load_model(args.arpa_lm)
+    model = load_model_cached(args.arpa_lm, args.binary_cache == "true")
 
-    num_valid, max_ngram_order = check_number(args.arpa_lm, tot_num)
-    if not num_valid:
+    if model.num_ngrams != model.header_num_ngrams:
         sys.exit("compute_sentence_probs_arpa.py: Wrong loading model.")
+    max_ngram_order = model.max_ngram_order
     if args.ngram_order <= 0 or args.ngram_order > max_ngram_order:
         sys.exit("compute_sentence_probs_arpa.py: " +
             "Invalid ngram_order (either negative or greater than maximum ngram number ({}) allowed)".format(max_ngram_order))
 
-    output_result(args.text_in_handle, args.prob_file_handle, args.ngram_order)
+    output_result(model, args.text_in_handle, args.prob_file_handle, args.ngram_order,
+                  args.batch_size)
@@ -21,7 +21,11 @@ import re
 import io
 import math
 import argparse
-from collections import Counter, defaultdict
+import multiprocessing
+from array import array
+from collections import deque
+
+import numpy as np
 
 
 parser = argparse.ArgumentParser(description="""
@@ -31,6 +35,10 @@ parser = argparse.ArgumentParser(description="""
 parser.add_argument("-ngram-order", type=int, default=4, choices=[2, 3, 4, 5, 6, 7], help="Order of n-gram")
 parser.add_argument("-text", type=str, default=None, help="Path to the corpus file")
 parser.add_argument("-lm", type=str, default=None, help="Path to output arpa file for language models")
+parser.add_argument("-num-jobs", type=int, default=1,
+                    help="Number of processes that count the n-grams of the shards of the corpus")
+parser.add_argument("-lines-per-shard", type=int, default=50000,
+                    help="Number of lines of the corpus in each shard")
 parser.add_argument("-verbose", type=int, default=0, choices=[0, 1, 2, 3, 4, 5], help="Verbose level")
 args = parser.parse_args()
 
@@ -43,48 +51,113 @@ strip_chars = " \t\r\n"
 whitespace = re.compile("[ \t]+")
 
 
-class CountsForHistory:
-    # This class (which is more like a struct) stores the counts seen in a
-    # particular history-state.  It is used inside class NgramCounts.
-    # It really does the job of a dict from int to float, but it also
-    # keeps track of the total count.
-    def __init__(self):
-        # The 'lambda: defaultdict(float)' is an anonymous function taking no
-        # arguments that returns a new defaultdict(float).
-        self.word_to_count = defaultdict(int)
-        self.word_to_context = defaultdict(set)  # using a set to count the number of unique contexts
-        self.word_to_f = dict()  # discounted probability
-        self.word_to_bow = dict()  # back-off weight
-        self.total_count = 0
-
-    def words(self):
-        return self.word_to_count.keys()
-
-    def __str__(self):
-        # e.g. returns ' total=12: 3->4, 4->6, -1->2'
-        return ' total={0}: {1}'.format(
-            str(self.total_count),
-            ', '.join(['{0} -> {1}'.format(word, count)
-                      for word, count in self.word_to_count.items()]))
-
-    def add_count(self, predicted_word, context_word, count):
-        assert count >= 0
-
-        self.total_count += count
-        self.word_to_count[predicted_word] += count
-        if context_word is not None:
-            self.word_to_context[predicted_word].add(context_word)
+def row_keys(*arrays):
+    # Returns, for each of the integer arrays of shape (num-rows, width) that
+    # are passed in, an array of non-negative integer keys such that two rows
+    # (of any of the arrays) have the same key if and only if they are equal.
+    # The columns are packed into the keys; if the keys would overflow, they
+    # are first replaced by their rank among the distinct keys.
+    num_rows = sum(len(a) for a in arrays)
+    keys = np.zeros(num_rows, dtype=np.int64)
+    max_key = 0
+    for j in range(arrays[0].shape[1] if num_rows > 0 else 0):
+        column = np.concatenate([a[:, j] for a in arrays]).astype(np.int64)
+        radix = int(column.max()) + 1
+        if (max_key + 1) * radix >= 2 ** 62:
+            _, keys = np.unique(keys, return_inverse=True)
+            max_key = int(keys.max())
+        keys = keys * radix + column
+        max_key = (max_key + 1) * radix - 1
+    return np.split(keys, np.cumsum([len(a) for a in arrays])[:-1])
+
+
+def ids_by_first_occurrence(keys):
+    # Numbers the distinct keys in the order of their first occurrence.
+    # Returns the id of each key and the index of the first occurrence of
+    # each id.
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[inverse.reshape(-1)], first[order]
+
+
+def lookup(rows, query_rows):
+    # Returns the index of each of the query rows in 'rows' (which must be
+    # distinct), or -1 if it is not there.
+    keys, query_keys = row_keys(rows, query_rows)
+    if len(keys) == 0:
+        return np.full(len(query_keys), -1, dtype=np.int64)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    pos = np.minimum(np.searchsorted(sorted_keys, query_keys), len(keys) - 1)
+    return np.where(sorted_keys[pos] == query_keys, order[pos], -1)
+
+
+def sequential_sums(segment_ids, values, num_segments, max_short_length=32):
+    # Returns the sums of the values of each segment, where 'segment_ids' is
+    # sorted.  The values of each segment are added up one after the other,
+    # like a python loop would, so that the results are exactly the same.
+    boundaries = np.searchsorted(segment_ids, np.arange(num_segments + 1))
+    lengths = np.diff(boundaries)
+    sums = np.zeros(num_segments)
+    # np.cumsum adds up sequentially; it is used for the long segments.
+    for s in np.flatnonzero(lengths > max_short_length).tolist():
+        sums[s] = np.cumsum(values[boundaries[s]:boundaries[s + 1]])[-1]
+    short = lengths <= max_short_length
+    for i in range(min(max_short_length, int(lengths.max(initial=0)))):
+        segments = np.flatnonzero(short & (lengths > i))
+        sums[segments] += values[boundaries[segments] + i]
+    return sums
+
+
+def count_ngrams_of_lines(lines, ngram_order, bos_symbol='<s>', eos_symbol='</s>'):
+    # Counts the n-grams of a list of lines (a shard of the corpus).
+    # Returns the list of words of the shard, whose indexes are used as
+    # word-ids, and for each history-length n the n-grams of order n+1 as an
+    # integer array of shape (num-ngrams, n+1) and their counts; the n-grams
+    # are in the order in which they were first seen.
+    word_to_index = {}
+    ids = array('i')
+    lengths = []
+    for line in lines:
+        words = [bos_symbol] + whitespace.split(line) + [eos_symbol]
+        ids.extend([word_to_index.setdefault(word, len(word_to_index)) for word in words])
+        lengths.append(len(words))
+    ids = np.frombuffer(ids, dtype=np.int32)
+    lengths = np.array(lengths, dtype=np.int64)
+    # the number of words from each word to the end of its line.
+    remaining = np.repeat(lengths, lengths) - (np.arange(len(ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+
+    ngrams = []
+    for n in range(ngram_order):
+        starts = np.flatnonzero(remaining > n)
+        rows = np.stack([ids[starts + j] for j in range(n + 1)], axis=1)
+        ngram_ids, first = ids_by_first_occurrence(row_keys(rows)[0])
+        ngrams.append((rows[first], np.bincount(ngram_ids, minlength=len(first))))
+    return list(word_to_index), ngrams
+
+
+def count_ngrams_of_shard(shard):
+    return count_ngrams_of_lines(shard, args.ngram_order)
 
 
 class NgramCounts:
     # A note on data-structure.  Firstly, all words are represented as
-    # integers.  We store n-gram counts as an array, indexed by (history-length
-    # == n-gram order minus one) (note: python calls arrays "lists") of dicts
-    # from histories to counts, where histories are arrays of integers and
-    # "counts" are dicts from integer to float.  For instance, when
-    # accumulating the 4-gram count for the '8' in the sequence '5 6 7 8', we'd
-    # do as follows: self.counts[3][[5,6,7]][8] += 1.0 where the [3] indexes an
-    # array, the [[5,6,7]] indexes a dict, and the [8] indexes a dict.
+    # integers (their index in self.words).  We store the n-grams as numpy
+    # arrays, separately for each history-length n (== n-gram order minus
+    # one): self.ngrams[n] is an integer array of shape (num-ngrams, n+1)
+    # whose rows are the n-grams, and self.counts[n] holds their counts.
+    # For instance, the 4-gram count for the '8' in the sequence '5 6 7 8' is
+    # self.counts[3][i] where self.ngrams[3][i] == [5,6,7,8].
+    # While counting, the n-grams are kept in the order in which they were
+    # first seen; finalize_counts() sorts them by history, where the
+    # histories are in the order in which they were first seen
+    # (self.hist_index[n][i] is the number of the history of
+    # self.ngrams[n][i]).  This is the order in which the n-grams are printed.
+    # The discounted probabilities and back-off weights of the n-grams are
+    # stored in self.f[n] and self.bow[n] (nan if the n-gram has no back-off
+    # weight).
     def __init__(self, ngram_order, bos_symbol='<s>', eos_symbol='</s>'):
         assert ngram_order >= 2
 
@@ -92,61 +165,133 @@ class NgramCounts:
         self.bos_symbol = bos_symbol
         self.eos_symbol = eos_symbol
 
-        self.counts = []
-        for n in range(ngram_order):
-            self.counts.append(defaultdict(lambda: CountsForHistory()))
+        self.words = []
+        self.word_to_index = {}
+        self.ngrams = [np.zeros((0, n + 1), dtype=np.int32) for n in range(ngram_order)]
+        self.counts = [np.zeros(0, dtype=np.int64) for n in range(ngram_order)]
+        # counts of shards that have not been merged into self.ngrams and
+        # self.counts yet.
+        self.pending_ngrams = [[] for n in range(ngram_order)]
+        self.pending_counts = [[] for n in range(ngram_order)]
+        self.hist_index = [None] * ngram_order
+        self.n_star = [None] * ngram_order  # number of unique contexts of each n-gram
+        # suffix_index[n][i] is the index in self.ngrams[n] of the n-gram
+        # self.ngrams[n + 1][i][1:].
+        self.suffix_index = [None] * (ngram_order - 1)
 
         self.d = []  # list of discounting factor for each order of ngram
-
-    # adds a raw count (called while processing input data).
-    # Suppose we see the sequence '6 7 8 9' and ngram_order=4, 'history'
-    # would be (6,7,8) and 'predicted_word' would be 9; 'count' would be
-    # 1.
-    def add_count(self, history, predicted_word, context_word, count):
-        self.counts[len(history)][history].add_count(predicted_word, context_word, count)
-
-    # 'line' is a string containing a sequence of integer word-ids.
-    # This function adds the un-smoothed counts from this line of text.
-    def add_raw_counts_from_line(self, line):
-        words = [self.bos_symbol] + whitespace.split(line) + [self.eos_symbol]
-
-        for i in range(len(words)):
-            for n in range(1, self.ngram_order+1):
-                if i + n > len(words):
-                    break
-
-                ngram = words[i: i + n]
-                predicted_word = ngram[-1]
-                history = tuple(ngram[: -1])
-                if i == 0 or n == self.ngram_order:
-                    context_word = None
-                else:
-                    context_word = words[i-1]
-
-                self.add_count(history, predicted_word, context_word, 1)
-
-    def add_raw_counts_from_standard_input(self):
+        self.f = [None] * ngram_order  # discounted probability
+        self.bow = [None] * ngram_order  # back-off weight
+
+    # adds the counts of a shard, as returned by count_ngrams_of_lines().
+    # The shards must be added in the order of the corpus.
+    def add_shard_counts(self, shard_words, shard_ngrams):
+        word_ids = np.array([self.word_to_index.setdefault(word, len(self.word_to_index))
+                             for word in shard_words], dtype=np.int32)
+        self.words = list(self.word_to_index)
+        for n in range(self.ngram_order):
+            rows, counts = shard_ngrams[n]
+            self.pending_ngrams[n].append(word_ids[rows])
+            self.pending_counts[n].append(counts)
+            # merging each shard right away would take time quadratic in the
+            # number of shards, so we wait until there are as many pending
+            # n-grams as merged ones.
+            if sum(len(c) for c in self.pending_counts[n]) > len(self.counts[n]):
+                self.merge_pending_counts(n)
+
+    def merge_pending_counts(self, n):
+        rows = np.concatenate([self.ngrams[n]] + self.pending_ngrams[n])
+        counts = np.concatenate([self.counts[n]] + self.pending_counts[n])
+        ngram_ids, first = ids_by_first_occurrence(row_keys(rows)[0])
+        self.ngrams[n] = rows[first]
+        self.counts[n] = np.bincount(ngram_ids, weights=counts, minlength=len(first)).astype(np.int64)
+        self.pending_ngrams[n] = []
+        self.pending_counts[n] = []
+
+    # 'lines' is a list of strings containing sequences of words.
+    # This function adds the un-smoothed counts from these lines of text.
+    def add_raw_counts_from_lines(self, lines):
+        self.add_shard_counts(*count_ngrams_of_lines(lines, self.ngram_order,
+                                                     self.bos_symbol, self.eos_symbol))
+
+    # Counts the n-grams of the lines of 'infile' in shards of
+    # 'lines_per_shard' lines, using 'num_jobs' processes.  If
+    # 'stop_at_empty_line' is true, the lines after the first empty line are
+    # ignored.
+    def add_raw_counts_from_stream(self, infile, num_jobs=1, lines_per_shard=50000,
+                                   stop_at_empty_line=False):
         lines_processed = 0
-        infile = io.TextIOWrapper(sys.stdin.buffer, encoding=default_encoding)  # byte stream as input
-        for line in infile:
-            line = line.strip(strip_chars)
-            self.add_raw_counts_from_line(line)
-            lines_processed += 1
-        if lines_processed == 0 or args.verbose > 0:
-            print("make_phone_lm.py: processed {0} lines of input".format(lines_processed), file=sys.stderr)
 
-    def add_raw_counts_from_file(self, filename):
-        lines_processed = 0
-        with open(filename, encoding=default_encoding) as fp:
-            for line in fp:
+        def shards():
+            shard = []
+            for line in infile:
                 line = line.strip(strip_chars)
-                if line == '':
+                if line == '' and stop_at_empty_line:
                     break
-                self.add_raw_counts_from_line(line)
-                lines_processed += 1
+                shard.append(line)
+                if len(shard) == lines_per_shard:
+                    yield shard
+                    shard = []
+            if len(shard) > 0:
+                yield shard
+
+        if num_jobs > 1:
+            pool = multiprocessing.Pool(num_jobs)
+            # at most two shards per process are read ahead.
+            results = deque()
+            for shard in shards():
+                lines_processed += len(shard)
+                results.append(pool.apply_async(count_ngrams_of_shard, (shard,)))
+                if len(results) >= 2 * num_jobs:
+                    self.add_shard_counts(*results.popleft().get())
+            while len(results) > 0:
+                self.add_shard_counts(*results.popleft().get())
+            pool.close()
+            pool.join()
+        else:
+            for shard in shards():
+                lines_processed += len(shard)
+                self.add_raw_counts_from_lines(shard)
         if lines_processed == 0 or args.verbose > 0:
             print("make_phone_lm.py: processed {0} lines of input".format(lines_processed), file=sys.stderr)
 
+    def add_raw_counts_from_standard_input(self, num_jobs=1, lines_per_shard=50000):
+        infile = io.TextIOWrapper(sys.stdin.buffer, encoding=default_encoding)  # byte stream as input
+        self.add_raw_counts_from_stream(infile, num_jobs, lines_per_shard)
+
+    def add_raw_counts_from_file(self, filename, num_jobs=1, lines_per_shard=50000):
+        with open(filename, encoding=default_encoding) as fp:
+            self.add_raw_counts_from_stream(fp, num_jobs, lines_per_shard, stop_at_empty_line=True)
+
+    # Merges the counts of all shards, sorts the n-grams by history and
+    # computes the numbers of unique contexts.
+    def finalize_counts(self):
+        for n in range(self.ngram_order):
+            if len(self.pending_counts[n]) > 0:
+                self.merge_pending_counts(n)
+            hist_index, _ = ids_by_first_occurrence(row_keys(self.ngrams[n][:, :-1])[0])
+            order = np.argsort(hist_index, kind='stable')
+            self.hist_index[n] = hist_index[order]
+            self.ngrams[n] = self.ngrams[n][order]
+            self.counts[n] = self.counts[n][order]
+        # The unique contexts of an n-gram (the words seen before it, not
+        # counting the n-grams at the beginning of the line) correspond to the
+        # distinct (n+1)-grams that end with it.
+        self.n_star[self.ngram_order - 1] = np.zeros(len(self.counts[self.ngram_order - 1]), dtype=np.int64)
+        for n in range(self.ngram_order - 1):
+            self.suffix_index[n] = lookup(self.ngrams[n], self.ngrams[n + 1][:, 1:])
+            assert np.all(self.suffix_index[n] >= 0)
+            self.n_star[n] = np.bincount(self.suffix_index[n], minlength=len(self.counts[n]))
+
+    def num_hists(self, n):
+        return int(self.hist_index[n][-1]) + 1 if len(self.hist_index[n]) > 0 else 0
+
+    # returns the total count of the history of each n-gram of history-length n.
+    def get_total_counts(self, n):
+        total_counts = np.bincount(self.hist_index[n], weights=self.counts[n],
+                                   minlength=self.num_hists(n)).astype(np.int64)
+        return total_counts[self.hist_index[n]]
+
     def cal_discounting_constants(self):
         # For each order N of N-grams, we calculate discounting constant D_N = n1_N / (n1_N + 2 * n2_N),
         # where n1_N is the number of unique N-grams with count = 1 (counts-of-counts).
@@ -157,13 +302,8 @@ class NgramCounts:
                       # This is a special case: as we currently assumed having seen all vocabularies in the dictionary,
                       # but perhaps this is not the case for some other scenarios.
         for n in range(1, self.ngram_order):
-            this_order_counts = self.counts[n]
-            n1 = 0
-            n2 = 0
-            for hist, counts_for_hist in this_order_counts.items():
-                stat = Counter(counts_for_hist.word_to_count.values())
-                n1 += stat[1]
-                n2 += stat[2]
+            n1 = int(np.count_nonzero(self.counts[n] == 1))
+            n2 = int(np.count_nonzero(self.counts[n] == 2))
             assert n1 + 2 * n2 > 0
             self.d.append(n1 * 1.0 / (n1 + 2 * n2))
 
@@ -177,28 +317,16 @@ class NgramCounts:
 
         # highest order N-grams
         n = self.ngram_order - 1
-        this_order_counts = self.counts[n]
-        for hist, counts_for_hist in this_order_counts.items():
-            for w, c in counts_for_hist.word_to_count.items():
-                counts_for_hist.word_to_f[w] = max((c - self.d[n]), 0) * 1.0 / counts_for_hist.total_count
+        self.f[n] = np.maximum(self.counts[n] - self.d[n], 0) / self.get_total_counts(n)
 
         # lower order N-grams
         for n in range(0, self.ngram_order - 1):
-            this_order_counts = self.counts[n]
-            for hist, counts_for_hist in this_order_counts.items():
-
-                n_star_star = 0
-                for w in counts_for_hist.word_to_count.keys():
-                    n_star_star += len(counts_for_hist.word_to_context[w])
-
-                if n_star_star != 0:
-                    for w in counts_for_hist.word_to_count.keys():
-                        n_star_z = len(counts_for_hist.word_to_context[w])
-                        counts_for_hist.word_to_f[w] = max((n_star_z - self.d[n]), 0) * 1.0 / n_star_star
-                else:  # patterns begin with <s>, they do not have "modified count", so use raw count instead
-                    for w in counts_for_hist.word_to_count.keys():
-                        n_star_z = counts_for_hist.word_to_count[w]
-                        counts_for_hist.word_to_f[w] = max((n_star_z - self.d[n]), 0) * 1.0 / counts_for_hist.total_count
+            n_star_star = np.bincount(self.hist_index[n], weights=self.n_star[n],
+                                      minlength=self.num_hists(n)).astype(np.int64)[self.hist_index[n]]
+            # patterns begin with <s>, they do not have "modified count", so use raw count instead
+            use_raw_count = n_star_star == 0
+            self.f[n] = np.where(use_raw_count, self.counts[n], self.n_star[n]) - self.d[n]
+            self.f[n] = np.maximum(self.f[n], 0) / np.where(use_raw_count, self.get_total_counts(n), n_star_star)
 
     def cal_bow(self):
         # Backoff weights are only necessary for ngrams which form a prefix of a longer ngram.
@@ -211,49 +339,48 @@ class NgramCounts:
 
         # highest order N-grams
         n = self.ngram_order - 1
-        this_order_counts = self.counts[n]
-        for hist, counts_for_hist in this_order_counts.items():
-            for w in counts_for_hist.word_to_count.keys():
-                counts_for_hist.word_to_bow[w] = None
+        self.bow[n] = np.full(len(self.counts[n]), np.nan)
 
         # lower order N-grams
+        eos = self.word_to_index.get(self.eos_symbol, -1)
         for n in range(0, self.ngram_order - 1):
-            this_order_counts = self.counts[n]
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    if w == self.eos_symbol:
-                        counts_for_hist.word_to_bow[w] = None
-                    else:
-                        a_ = hist + (w,)
-
-                        assert len(a_) < self.ngram_order
-                        assert a_ in self.counts[len(a_)].keys()
-
-                        a_counts_for_hist = self.counts[len(a_)][a_]
-
-                        sum_z1_f_a_z = 0
-                        for u in a_counts_for_hist.word_to_count.keys():
-                            sum_z1_f_a_z += a_counts_for_hist.word_to_f[u]
-
-                        sum_z1_f_z = 0
-                        _ = a_[1:]
-                        _counts_for_hist = self.counts[len(_)][_]
-                        for u in a_counts_for_hist.word_to_count.keys():  # Should be careful here: what is Z1
-                            sum_z1_f_z += _counts_for_hist.word_to_f[u]
-
-                        counts_for_hist.word_to_bow[w] = (1.0 - sum_z1_f_a_z) / (1.0 - sum_z1_f_z)
+            # the n-grams a_ are the histories of the (n+1)-grams a_z.
+            num_hists = self.num_hists(n + 1)
+            starts = np.searchsorted(self.hist_index[n + 1], np.arange(num_hists))
+            hist_to_ngram = lookup(self.ngrams[n], self.ngrams[n + 1][starts, :-1])
+            assert np.all(hist_to_ngram >= 0)
+            has_bow = self.ngrams[n][:, -1] != eos
+            assert np.count_nonzero(has_bow[hist_to_ngram]) == np.count_nonzero(has_bow)
+
+            sum_z1_f_a_z = sequential_sums(self.hist_index[n + 1], self.f[n + 1], num_hists)
+            # Should be careful here: what is Z1
+            sum_z1_f_z = sequential_sums(self.hist_index[n + 1], self.f[n][self.suffix_index[n]], num_hists)
+
+            self.bow[n] = np.full(len(self.counts[n]), np.nan)
+            self.bow[n][hist_to_ngram] = (1.0 - sum_z1_f_a_z) / (1.0 - sum_z1_f_z)
+            self.bow[n][~has_bow] = np.nan
+
+    # yields the words, the raw count, the modified count (0 for the highest
+    # order), f and the back-off weight (None if it has none) of each n-gram;
+    # f and the back-off weight are None before they are computed.
+    def ngram_info(self):
+        for n in range(self.ngram_order):
+            f = self.f[n] if self.f[n] is not None else [None] * len(self.counts[n])
+            bow = self.bow[n] if self.bow[n] is not None else np.full(len(self.counts[n]), np.nan)
+            for ngram, count, n_star, f_, bow_ in zip(self.ngrams[n].tolist(), self.counts[n].tolist(),
+                                                     self.n_star[n].tolist(), list(f), bow.tolist()):
+                yield ([self.words[i] for i in ngram], count, n_star,
+                       f_, None if math.isnan(bow_) else bow_)
 
     def print_raw_counts(self, info_string):
         # these are useful for debug.
         print(info_string)
         res = []
-        for this_order_counts in self.counts:
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    ngram = " ".join(hist) + " " + w
-                    ngram = ngram.strip(strip_chars)
+        for words, count, n_star, f, bow in self.ngram_info():
+            ngram = " ".join(words[:-1]) + " " + words[-1]
+            ngram = ngram.strip(strip_chars)
 
-                    res.append("{0}\t{1}".format(ngram, counts_for_hist.word_to_count[w]))
+            res.append("{0}\t{1}".format(ngram, count))
         res.sort(reverse=True)
         for r in res:
             print(r)
@@ -262,19 +389,14 @@ class NgramCounts:
         # these are useful for debug.
         print(info_string)
         res = []
-        for this_order_counts in self.counts:
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    ngram = " ".join(hist) + " " + w
-                    ngram = ngram.strip(strip_chars)
-
-                    modified_count = len(counts_for_hist.word_to_context[w])
-                    raw_count = counts_for_hist.word_to_count[w]
-
-                    if modified_count == 0:
-                        res.append("{0}\t{1}".format(ngram, raw_count))
-                    else:
-                        res.append("{0}\t{1}".format(ngram, modified_count))
+        for words, raw_count, modified_count, f, bow in self.ngram_info():
+            ngram = " ".join(words[:-1]) + " " + words[-1]
+            ngram = ngram.strip(strip_chars)
+
+            if modified_count == 0:
+                res.append("{0}\t{1}".format(ngram, raw_count))
+            else:
+                res.append("{0}\t{1}".format(ngram, modified_count))
         res.sort(reverse=True)
         for r in res:
             print(r)
@@ -283,17 +405,14 @@ class NgramCounts:
         # these are useful for debug.
         print(info_string)
         res = []
-        for this_order_counts in self.counts:
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    ngram = " ".join(hist) + " " + w
-                    ngram = ngram.strip(strip_chars)
+        for words, count, n_star, f, bow in self.ngram_info():
+            ngram = " ".join(words[:-1]) + " " + words[-1]
+            ngram = ngram.strip(strip_chars)
 
-                    f = counts_for_hist.word_to_f[w]
-                    if f == 0:  # f(<s>) is always 0
-                        f = 1e-99
+            if f == 0:  # f(<s>) is always 0
+                f = 1e-99
 
-                    res.append("{0}\t{1}".format(ngram, math.log(f, 10)))
+            res.append("{0}\t{1}".format(ngram, math.log(f, 10)))
         res.sort(reverse=True)
         for r in res:
             print(r)
@@ -302,21 +421,17 @@ class NgramCounts:
         # these are useful for debug.
         print(info_string)
         res = []
-        for this_order_counts in self.counts:
-            for hist, counts_for_hist in this_order_counts.items():
-                for w in counts_for_hist.word_to_count.keys():
-                    ngram = " ".join(hist) + " " + w
-                    ngram = ngram.strip(strip_chars)
-
-                    f = counts_for_hist.word_to_f[w]
-                    if f == 0:  # f(<s>) is always 0
-                        f = 1e-99
-
-                    bow = counts_for_hist.word_to_bow[w]
-                    if bow is None:
-                        res.append("{1}\t{0}".format(ngram, math.log(f, 10)))
-                    else:
-                        res.append("{1}\t{0}\t{2}".format(ngram, math.log(f, 10), math.log(bow, 10)))
+        for words, count, n_star, f, bow in self.ngram_info():
+            ngram = " ".join(words[:-1]) + " " + words[-1]
+            ngram = ngram.strip(strip_chars)
+
+            if f == 0:  # f(<s>) is always 0
+                f = 1e-99
+
+            if bow is None:
+                res.append("{1}\t{0}".format(ngram, math.log(f, 10)))
+            else:
+                res.append("{1}\t{0}\t{2}".format(ngram, math.log(f, 10), math.log(bow, 10)))
         res.sort(reverse=True)
         for r in res:
             print(r)
@@ -327,31 +442,27 @@ class NgramCounts:
         print('\\data\\', file=fout)
         for hist_len in range(self.ngram_order):
             # print the number of n-grams.
-            print('ngram {0}={1}'.format(
-                hist_len + 1,
-                sum([len(counts_for_hist.word_to_f) for counts_for_hist in self.counts[hist_len].values()])),
-                file=fout
-            )
+            print('ngram {0}={1}'.format(hist_len + 1, len(self.counts[hist_len])), file=fout)
 
         print('', file=fout)
 
+        words = np.array(self.words, dtype=object)
         for hist_len in range(self.ngram_order):
             print('\\{0}-grams:'.format(hist_len + 1), file=fout)
 
-            this_order_counts = self.counts[hist_len]
-            for hist, counts_for_hist in this_order_counts.items():
-                for word in counts_for_hist.word_to_count.keys():
-                    ngram = hist + (word,)
-                    prob = counts_for_hist.word_to_f[word]
-                    bow = counts_for_hist.word_to_bow[word]
-
-                    if prob == 0:  # f(<s>) is always 0
-                        prob = 1e-99
-
-                    line = '{0}\t{1}'.format('%.7f' % math.log10(prob), ' '.join(ngram))
-                    if bow is not None:
-                        line += '\t{0}'.format('%.7f' % math.log10(bow))
-                    print(line, file=fout)
+            # the lines are formatted in batches, which is much faster than
+            # one at a time.
+            for start in range(0, len(self.counts[hist_len]), 100000):
+                end = start + 100000
+                prob = self.f[hist_len][start:end]
+                prob = np.where(prob == 0, 1e-99, prob)  # f(<s>) is always 0
+                bow = self.bow[hist_len][start:end].tolist()
+                lines = ['{0}\t{1}'.format('%.7f' % math.log10(p), ' '.join(ngram))
+                         for p, ngram in zip(prob.tolist(), words[self.ngrams[hist_len][start:end]].tolist())]
+                for i in np.flatnonzero(~np.isnan(self.bow[hist_len][start:end])).tolist():
+                    lines[i] += '\t{0}'.format('%.7f' % math.log10(bow[i]))
+                lines.append('')
+                fout.write('\n'.join(lines))
             print('', file=fout)
         print('\\end\\', file=fout)
 
@@ -361,11 +472,12 @@ if __name__ == "__main__":
     ngram_counts = NgramCounts(args.ngram_order)
 
     if args.text is None:
-        ngram_counts.add_raw_counts_from_standard_input()
+        ngram_counts.add_raw_counts_from_standard_input(args.num_jobs, args.lines_per_shard)
     else:
         assert os.path.isfile(args.text)
-        ngram_counts.add_raw_counts_from_file(args.text)
+        ngram_counts.add_raw_counts_from_file(args.text, args.num_jobs, args.lines_per_shard)
 
+    ngram_counts.finalize_counts()
     ngram_counts.cal_discounting_constants()
     ngram_counts.cal_f()
     ngram_counts.cal_bow()
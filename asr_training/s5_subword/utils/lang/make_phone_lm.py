@@ -8,6 +8,8 @@ from __future__ import division
 import sys
 import argparse
 import math
+import heapq
+import time
 from collections import defaultdict
 
 # note, this was originally based
@@ -280,7 +282,7 @@ class NgramCounts(object):
         for n in reversed(list(range(args.no_backoff_ngram_order,
                                 args.ngram_order))):
             num_states_removed = 0
-            for hist, counts_for_hist in self.counts[n].items():
+            for hist, counts_for_hist in list(self.counts[n].items()):
                 l = len(counts_for_hist.word_to_count)
                 assert l > 0 and self.backoff_symbol in counts_for_hist.word_to_count
                 if l == 1 and not hist in protected_histories:  # only the backoff symbol has a count.
@@ -565,7 +567,18 @@ class NgramCounts(object):
                                          backoff_count, float(backoff_total))
 
     # note: returns loglike change per word.
-    def PruneToIntermediateTarget(self, num_extra_ngrams):
+    # 'like_changes' is a dict from history to a dict from word to the
+    # likelihood change from pruning that n-gram, and 'changed_hists' is the set of history-states whose counts
+    # changed since the likelihood changes were computed.  They are used to
+    # only re-score the n-grams for which their history-state, or one of the
+    # states it backs off to, changed; this function updates them.  If they are
+    # None, all candidate n-grams are scored.
+    def PruneToIntermediateTarget(self, num_extra_ngrams, like_changes = None,
+                                  changed_hists = None):
+        start_time = time.time()
+        if like_changes is None:
+            like_changes = dict()
+            changed_hists = set()
         protected_ngrams = self.GetProtectedNgrams()
         initial_num_extra_ngrams = self.GetNumExtraNgrams()
         num_ngrams_to_prune = initial_num_extra_ngrams - num_extra_ngrams
@@ -574,26 +587,36 @@ class NgramCounts(object):
         num_candidates_per_order = [ 0 ] * args.ngram_order
         num_pruned_per_order = [ 0 ] * args.ngram_order
 
-
         # like_change_and_ngrams this will be a list of tuples consisting
         # of the likelihood change as a float and then the words of the n-gram
         # that we're considering pruning,
         # e.g. (-0.164, 7, 8, 9)
         # meaning that pruning the n-gram (7, 8) -> 9 leads to
-        # a likelihood change of -0.164.  We'll later sort this list
-        # so we can prune the n-grams that made the least-negative
-        # likelihood change.
+        # a likelihood change of -0.164.  We'll later select from this list
+        # the n-grams that made the least-negative likelihood change.
         like_change_and_ngrams = []
+        num_scored = 0
+        score_start_time = time.time()
         for n in range(args.no_backoff_ngram_order, args.ngram_order):
             for hist, counts_for_hist in self.counts[n].items():
+                # the lower orders come first, so if a state that this state
+                # backs off to has changed, hist[1:] is in changed_hists.
+                if hist in changed_hists or hist[1:] in changed_hists:
+                    changed_hists.add(hist)
+                    like_changes[hist] = dict()
+                hist_like_changes = like_changes.setdefault(hist, dict())
                 for word, count in counts_for_hist.word_to_count.items():
                     if word != self.backoff_symbol:
                         if not hist + (word,) in protected_ngrams:
-                            like_change = self.GetLikeChangeFromPruningNgram(hist, word)
+                            like_change = hist_like_changes.get(word)
+                            if like_change is None:
+                                like_change = self.GetLikeChangeFromPruningNgram(hist, word)
+                                hist_like_changes[word] = like_change
+                                num_scored += 1
                             like_change_and_ngrams.append((like_change,) + hist + (word,))
                             num_candidates_per_order[len(hist)] += 1
-
-        like_change_and_ngrams.sort(reverse = True)
+        changed_hists.clear()
+        score_time = time.time() - score_start_time
 
         if num_ngrams_to_prune > len(like_change_and_ngrams):
             print('make_phone_lm.py: aimed to prune {0} n-grams but could only '
@@ -601,20 +624,34 @@ class NgramCounts(object):
                   file = sys.stderr)
             num_ngrams_to_prune = len(like_change_and_ngrams)
 
+        # heapq.nlargest() gives the same result as sorting in reverse order
+        # and taking the first num_ngrams_to_prune elements, but it only keeps
+        # a priority queue of those elements; this is faster if they are a
+        # small fraction of the candidates.
+        if num_ngrams_to_prune * 10 < len(like_change_and_ngrams) and args.verbose < 3:
+            ngrams_to_prune = heapq.nlargest(num_ngrams_to_prune, like_change_and_ngrams)
+        else:
+            like_change_and_ngrams.sort(reverse = True)
+            ngrams_to_prune = like_change_and_ngrams[:num_ngrams_to_prune]
+
         total_loglike_change = 0.0
 
         for i in range(num_ngrams_to_prune):
-            total_loglike_change += like_change_and_ngrams[i][0]
-            hist = like_change_and_ngrams[i][1:-1]  # all but 1st and last elements
-            word = like_change_and_ngrams[i][-1]  # last element
+            total_loglike_change += ngrams_to_prune[i][0]
+            hist = ngrams_to_prune[i][1:-1]  # all but 1st and last elements
+            word = ngrams_to_prune[i][-1]  # last element
             num_pruned_per_order[len(hist)] += 1
             self.PruneNgram(hist, word)
+            # PruneNgram() changes the counts of this history-state and of
+            # the state it backs off to.
+            changed_hists.add(hist)
+            changed_hists.add(hist[1:])
 
         like_change_per_word = total_loglike_change / self.total_num_words
 
         if args.verbose >= 1:
-            effective_threshold = (like_change_and_ngrams[num_ngrams_to_prune - 1][0]
-                                   if num_ngrams_to_prune >= 0 else 0.0)
+            effective_threshold = (ngrams_to_prune[num_ngrams_to_prune - 1][0]
+                                   if num_ngrams_to_prune > 0 else 0.0)
             print("Pruned from {0} ngrams to {1}, with threshold {2}.  Candidates per order were {3}, "
                   "num-ngrams pruned per order were {4}.  Like-change per word was {5}".format(
                     initial_num_extra_ngrams,
@@ -636,6 +673,11 @@ class NgramCounts(object):
         self.PruneEmptyStates()
         if args.verbose >= 3:
             ngram_counts.Print("Counts after removing empty states [inside pruning algorithm]:")
+        if args.verbose >= 1:
+            print("make_phone_lm.py: pruning round took {0:.2f} seconds, of which {1:.2f} "
+                  "seconds to score {2} of the {3} candidate n-grams".format(
+                    time.time() - start_time, score_time, num_scored,
+                    len(like_change_and_ngrams)), file = sys.stderr)
         return like_change_per_word
 
 
@@ -680,13 +722,21 @@ class NgramCounts(object):
               'following sequence of targets: {1}'.format(current_num_extra_ngrams,
                                                           target_sequence),
               file = sys.stderr)
+        start_time = time.time()
+        # the likelihood changes are kept across the calls, so that only the
+        # n-grams affected by the previous pruning need to be re-scored.
+        like_changes = dict()
+        changed_hists = set()
         total_like_change_per_word = 0.0
         for target in target_sequence:
-            total_like_change_per_word += self.PruneToIntermediateTarget(target)
+            total_like_change_per_word += self.PruneToIntermediateTarget(
+                target, like_changes, changed_hists)
 
         if args.verbose >= 1:
             print('make_phone_lm.py: K-L divergence from pruning (upper bound) is '
                   '%.4f' % total_like_change_per_word, file = sys.stderr)
+            print('make_phone_lm.py: pruning took {0:.2f} seconds'.format(
+                    time.time() - start_time), file = sys.stderr)
 
 
     # returns the number of n-grams on top of those that can't be pruned away
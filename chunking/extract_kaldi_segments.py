@@ -2,101 +2,222 @@
 
 # Script to extract audio chunks to separate files after chunking using Kaldi's chunking scripts
 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import io
 from pathlib import Path
-import struct
 import audioop
 import struct
+import tarfile
+import tempfile
 import wave
 import logging
+import numpy as np
+
+# Number of frames that are resampled at once
+BLOCK_SIZE = 1 << 20
+
+
+def find_data_chunk(wav_file):
+    """Returns the offset and size of the PCM data in the RIFF file."""
+    riff, _, wave_id = struct.unpack('<4sI4s', wav_file.read(12))
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise ValueError("not a WAVE file")
+    while True:
+        header = wav_file.read(8)
+        if len(header) < 8:
+            raise ValueError("no data chunk")
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'data':
+            return wav_file.tell(), chunk_size
+        wav_file.seek(chunk_size + (chunk_size & 1), 1)
 
 
 def read_wav(filepath, requested_sampling_rate):
+    """Memory-maps the 16 bit samples of the WAV file. Stereo files are downmixed and, if need be,
+    the signal is resampled; both happen block by block into a temporary file, which is then
+    memory-mapped, so the memory use does not depend on the length of the recording."""
     try:
         with wave.open(filepath, 'rb') as wav_file:
-            num_channels, sampwidth, sampling_rate, num_samples, _, _ = wav_file.getparams()
-            try:
-                raw = wav_file.readframes(num_samples * num_channels)
+            num_channels, sampwidth, sampling_rate, _, _, _ = wav_file.getparams()
+        if sampwidth != 2:
+            raise ValueError(f"unsupported sample width {sampwidth}")
+        with open(filepath, 'rb') as wav_file:
+            data_offset, data_size = find_data_chunk(wav_file)
+            # Certain programs do not set correct values in the WAVE RIFF
+            # header. Therefore, we use at most the bytes that are in the file.
+            wav_file.seek(0, 2)
+            data_size = min(data_size, wav_file.tell() - data_offset)
+        num_samples = data_size // sampwidth // num_channels
+        if num_samples == 0:
+            return np.zeros(0, dtype='<i2'), sampling_rate, 0, 1
+        raw = np.memmap(filepath, dtype='<i2', mode='r', offset=data_offset, shape=(num_samples, num_channels))
+        resample = requested_sampling_rate is not None and requested_sampling_rate != sampling_rate
+        if not resample and num_channels == 1:
+            return raw[:, 0], sampling_rate, num_samples, num_channels
+        with tempfile.TemporaryFile() as tmp_file:
+            state = None
+            for block_start in range(0, num_samples, BLOCK_SIZE):
+                block = raw[block_start:block_start + BLOCK_SIZE]
                 # Resample signal if need be
-                if requested_sampling_rate is not None and requested_sampling_rate != sampling_rate:
-                    raw, _ = audioop.ratecv(raw, sampwidth, num_channels, sampling_rate, requested_sampling_rate, None)
-                    sampling_rate = requested_sampling_rate
-                    num_samples = len(raw) // sampwidth // num_channels
+                if resample:
+                    block, state = audioop.ratecv(block, sampwidth, num_channels, sampling_rate,
+                                                  requested_sampling_rate, state)
+                    block = np.frombuffer(block, dtype='<i2').reshape(-1, num_channels)
                 if num_channels == 2:
-                    raw = audioop.tomono(raw, 2, 0.5, 0.5)
-                    num_channels = 1
-                raw = struct.unpack_from("%dh" % num_samples * num_channels, raw)
-            except struct.error:
-                # Certain programs do not set correct values in the WAVE RIFF
-                # header. Therefore, we have to read all bytes in the chunk and
-                # set the other fields to default values.
-                raw = wav_file.readframes(-1)
-                sampwidth = 2
-                # Resample signal if need be
-                if requested_sampling_rate is not None and requested_sampling_rate != sampling_rate:
-                    raw, _ = audioop.ratecv(raw, sampwidth, num_channels, sampling_rate, requested_sampling_rate, None)
-                    sampling_rate = requested_sampling_rate
-                if num_channels == 2:
-                    raw = audioop.tomono(raw, 2, 0.5, 0.5)
-                    num_channels = 1
-                num_samples = len(raw) // sampwidth // num_channels
-                raw = struct.unpack_from("%dh" % num_samples * num_channels, raw)
-
-            return (
-                raw,
-                sampling_rate,
-                num_samples,
-                num_channels
-            )
+                    # Same as audioop.tomono(block, 2, 0.5, 0.5)
+                    block = ((block[:, 0].astype(np.int32) + block[:, 1]) >> 1).astype('<i2')
+                tmp_file.write(np.ascontiguousarray(block).tobytes())
+            if resample:
+                sampling_rate = requested_sampling_rate
+            if num_channels == 2:
+                num_channels = 1
+            num_samples = tmp_file.tell() // sampwidth // num_channels
+            if num_samples == 0:
+                return np.zeros(0, dtype='<i2'), sampling_rate, 0, num_channels
+            # The mapping stays valid after the (unlinked) file is closed
+            raw = np.memmap(tmp_file, dtype='<i2', mode='r', shape=(num_samples * num_channels,))
+        return (
+            raw,
+            sampling_rate,
+            num_samples,
+            num_channels
+        )
     except:
         logging.warning(f"Unable to read WAV file '{filepath}'.")
-        return (), 0, 0, 0
+        return np.zeros(0, dtype='<i2'), 0, 0, 0
 
 
+class ShardWriter:
+    """Writes files into tar shards <prefix>-000000.tar, ... of at most `shard_size` bytes (unless a
+    single file is larger) and keeps an index with the shard, offset and size of each file, so
+    that a file can be read directly from its shard."""
 
-if __name__ == "__main__":
-    source_dir = '/data/nationalrat27_cleaned'
-    dest_dir = '/data/nationalrat27_segments'
-    requested_sampling_rate = 16000
+    def __init__(self, shard_dir, prefix, shard_size):
+        self.shard_dir = shard_dir
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.num_shards = 0
+        self.tar = None
+        self.shard_name = None
+        self.index = []
+
+    def add(self, name, data):
+        # 512 bytes header and data padded to 512 bytes; the archive ends with 1024 zero bytes and
+        # is padded to a multiple of the record size
+        member_size = 512 + (len(data) + 511) // 512 * 512
+        tar_size = self.tar.offset + member_size + 1024 if self.tar is not None else 0
+        tar_size = (tar_size + tarfile.RECORDSIZE - 1) // tarfile.RECORDSIZE * tarfile.RECORDSIZE
+        if self.tar is not None and self.tar.offset > 0 and tar_size > self.shard_size:
+            self.close()
+        if self.tar is None:
+            self.shard_name = f"{self.prefix}-{self.num_shards:06d}.tar"
+            self.tar = tarfile.open(self.shard_dir / self.shard_name, 'w', format=tarfile.GNU_FORMAT)
+            self.num_shards += 1
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = len(data)
+        self.tar.addfile(tarinfo, io.BytesIO(data))
+        # The data ends where the padding before the current offset starts
+        offset = self.tar.offset - (len(data) + 511) // 512 * 512
+        self.index.append((name, self.shard_name, offset, len(data)))
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+
+
+def export_recording(wav_path, segments, dest_dir, requested_sampling_rate, shard_size=None):
+    """Writes the segments (start time, end time, text) of a recording to <dest_dir>/<stem>/, or
+    into tar shards <dest_dir>/shards/<stem>-*.tar if `shard_size` is given. Returns the rows for
+    metadata.csv and the shard index."""
+    raw, sampling_rate, num_samples, num_channels = read_wav(str(wav_path.absolute()), requested_sampling_rate)
+    rows = []
+    if len(raw) == 0:
+        return rows, []
+    if shard_size is not None:
+        shard_writer = ShardWriter(dest_dir / "shards", wav_path.stem, shard_size)
+    else:
+        dest_dir.joinpath(wav_path.stem).mkdir(parents=True, exist_ok=True)
+    for start_time, end_time, text in segments:
+        index_start = int(start_time * sampling_rate)
+        index_end = int(end_time * sampling_rate)
+        section_audio = raw[index_start:index_end]
+        file_name = f"{int(start_time*100.0):08d}-{int(end_time*100.0):08d}.wav"
+        rows.append((f"{wav_path.stem}/{file_name}", file_name, text))
+        if shard_size is not None:
+            wav_file = io.BytesIO()
+        else:
+            wav_file = str(dest_dir / wav_path.stem / file_name)
+        with wave.open(wav_file, 'w') as wav_writer:
+            wav_writer.setparams((1, 2, sampling_rate, len(section_audio), 'NONE', 'not compressed')) # pylint:no-member
+            # Written straight from the memory-mapped samples, without a copy
+            wav_writer.writeframes(section_audio)
+        if shard_size is not None:
+            shard_writer.add(f"{wav_path.stem}/{file_name}", wav_file.getvalue())
+    if shard_size is not None:
+        shard_writer.close()
+        return rows, shard_writer.index
+    return rows, []
+
+
+def main(args):
+    source_dir = Path(args.source_dir)
+    dest_dir = Path(args.dest_dir)
+    shard_size = int(args.shard_size * 1024 * 1024) if args.shard_size is not None else None
 
     recid_to_wav = {}
-    with open(Path(source_dir).joinpath("wav.scp"), 'r', encoding="utf-8") as scp_file:
+    with open(source_dir.joinpath("wav.scp"), 'r', encoding="utf-8") as scp_file:
         for line in scp_file:
             line = line.rstrip("\n")
             recid, wav = line.split(maxsplit=1)
             recid_to_wav[recid] = wav
 
     segid_to_text = {}
-    with open(Path(source_dir).joinpath("text"), 'r', encoding="utf-8") as txt_file:
+    with open(source_dir.joinpath("text"), 'r', encoding="utf-8") as txt_file:
         for line in txt_file:
             line = line.rstrip("\n")
             segid, text = line.split(maxsplit=1)
             segid_to_text[segid] = text
 
-    last_recid = None
-    txt_file = None
-    with open(Path(source_dir).joinpath("segments"), 'r', encoding="utf-8") as seg_file, \
-        open(Path(dest_dir).joinpath('metadata.csv'), 'w', encoding="utf-8") as metadata_file:
+    # Segments per recording, in the order of the segments file
+    recid_to_segments = {}
+    with open(source_dir.joinpath("segments"), 'r', encoding="utf-8") as seg_file:
         for line in seg_file:
             line = line.rstrip("\n")
             segid, recid, start_time, end_time = line.split()
-            start_time = float(start_time)
-            end_time = float(end_time)
             if len(segid_to_text[segid].replace("<unk>", "").split()) < 3:
                 continue
-            if not last_recid == recid:
-                wav_path = Path(recid_to_wav[recid])
-                raw, sampling_rate, num_samples, num_channels = read_wav(str(wav_path.absolute()), requested_sampling_rate)
-                last_recid = recid
-            if len(raw) > 0:
-                index_start = int(start_time * sampling_rate)
-                index_end = int(end_time * sampling_rate)
-                section_audio = raw[index_start:index_end]
-                file_name = f"{int(start_time*100.0):08d}-{int(end_time*100.0):08d}.wav"
-                print(f"{wav_path.stem}/{file_name}\t{segid_to_text[segid]}", file=metadata_file)
-                print(f"{file_name}\t{segid_to_text[segid]}")
-                Path(dest_dir).joinpath(wav_path.stem).mkdir(parents=True, exist_ok=True)
-                file_path = str(Path(dest_dir) / wav_path.stem / file_name)
-                with wave.open(file_path, 'w') as wav_file:
-                    wav_file.setparams((1, 2, sampling_rate, num_samples, 'NONE', 'not compressed')) # pylint:no-member
-                    bytes_audio = struct.pack('<%dh' % len(section_audio), *section_audio)
-                    wav_file.writeframes(bytes_audio)
+            recid_to_segments.setdefault(recid, []).append((float(start_time), float(end_time), segid_to_text[segid]))
+
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    if shard_size is not None:
+        dest_dir.joinpath("shards").mkdir(exist_ok=True)
+    jobs = [(Path(recid_to_wav[recid]), segments, dest_dir, args.sampling_rate, shard_size)
+            for recid, segments in recid_to_segments.items()]
+    with open(dest_dir.joinpath('metadata.csv'), 'w', encoding="utf-8") as metadata_file, \
+        ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        shard_index = []
+        # Results come in the order of the recordings, so metadata.csv does not depend on the number of jobs
+        for rows, index in executor.map(export_recording, *zip(*jobs)):
+            for path, file_name, text in rows:
+                print(f"{path}\t{text}", file=metadata_file)
+                print(f"{file_name}\t{text}")
+            shard_index += index
+    if shard_size is not None:
+        with open(dest_dir.joinpath('shards.csv'), 'w', encoding="utf-8") as index_file:
+            for path, shard_name, offset, size in shard_index:
+                print(f"{path}\tshards/{shard_name}\t{offset}\t{size}", file=index_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extracts the audio of the segments of a Kaldi data directory.")
+    parser.add_argument("source_dir", type=str, nargs='?', default='/data/nationalrat27_cleaned')
+    parser.add_argument("dest_dir", type=str, nargs='?', default='/data/nationalrat27_segments')
+    parser.add_argument("--sampling-rate", type=int, default=16000)
+    parser.add_argument("--jobs", type=int, default=1, help="Number of recordings exported in parallel")
+    parser.add_argument("--shard-size", type=float, default=None,
+                        help="Write the segments into tar shards of this size in MB, indexed in shards.csv, "
+                             "instead of one WAV file per segment")
+    args = parser.parse_args()
+    main(args)
@@ -8,18 +8,21 @@ from __future__ import division
 import sys
 import argparse
 import math
-from collections import defaultdict
+import multiprocessing
+
+import numpy as np
 
 import io
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
-sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
 
 parser = argparse.ArgumentParser(description="""
 This script creates a biased language model suitable for alignment and
 data-cleanup purposes.   It reads (possibly multiple) lines of integerized text
 from the input and writes a text-form FST of a backoff language model to
-the standard output, to be piped into fstcompile.""")
+the standard output, to be piped into fstcompile.
+With --batch=true, it reads a Kaldi archive of integerized text (lines
+'<key> <integerized-text>') and writes a Kaldi archive of text-form FSTs,
+one language model per key, where consecutive lines with the same key are
+used for the same language model.""")
 
 parser.add_argument("--word-disambig-symbol", type = int, required = True,
                     help = "Integer corresponding to the disambiguation "
@@ -42,28 +45,100 @@ parser.add_argument("--discounting-constant", type = float, default = 0.3,
                     help = "Discounting constant D for standard (unmodified) Kneser-Ney; "
                     "must be strictly between 0 and 1.  A value closer to 0 will give "
                     "you a more-strongly-biased LM.")
+parser.add_argument("--batch", type = str, default = "false",
+                    choices = ["true", "false"],
+                    help = "If true, read an archive of integerized text and "
+                    "write an archive of FSTs, see above.  This avoids "
+                    "starting one process per language model.")
+parser.add_argument("--num-jobs", type = int, default = 1,
+                    help = "Number of worker processes that build the language "
+                    "models in batch mode; the output is in the order of the "
+                    "input.")
 parser.add_argument("--verbose", type = int, default = 0,
                     choices=[0,1,2,3,4,5], help = "Verbose level")
 
-args = parser.parse_args()
 
-if args.verbose >= 1:
-    print(' '.join(sys.argv), file = sys.stderr)
 
 
+def RowKeys(*arrays):
+    # Returns, for each of the integer arrays of shape (num-rows, width) that
+    # are passed in, an array of non-negative integer keys such that two rows
+    # (of any of the arrays) have the same key if and only if they are equal.
+    # The columns are packed into the keys; if the keys would overflow, they
+    # are first replaced by their rank among the distinct keys.
+    num_rows = sum(len(a) for a in arrays)
+    keys = np.zeros(num_rows, dtype=np.int64)
+    max_key = 0
+    for j in range(arrays[0].shape[1] if num_rows > 0 else 0):
+        column = np.concatenate([a[:, j] for a in arrays]).astype(np.int64)
+        column -= column.min()
+        radix = int(column.max()) + 1
+        if (max_key + 1) * radix >= 2 ** 62:
+            _, keys = np.unique(keys, return_inverse=True)
+            max_key = int(keys.max())
+        if (max_key + 1) * radix >= 2 ** 62:
+            _, column = np.unique(column, return_inverse=True)
+            radix = int(column.max()) + 1
+        keys = keys * radix + column
+        max_key = (max_key + 1) * radix - 1
+    return np.split(keys, np.cumsum([len(a) for a in arrays])[:-1])
+
+
+def IdsByFirstOccurrence(keys):
+    # Numbers the distinct keys in the order of their first occurrence.
+    # Returns the id of each key and the index of the first occurrence of
+    # each id.
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[inverse], first[order]
+
+
+def Lookup(keys, query_keys):
+    # Returns the index of each of the query keys in 'keys' (which must be
+    # distinct), or -1 if it is not there.
+    if len(keys) == 0:
+        return np.full(len(query_keys), -1, dtype=np.int64)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    pos = np.minimum(np.searchsorted(sorted_keys, query_keys), len(keys) - 1)
+    return np.where(sorted_keys[pos] == query_keys, order[pos], -1)
+
+
+def SequentialSums(segment_ids, values, num_segments):
+    # Returns the sums of the values of each segment, where 'segment_ids' is
+    # sorted.  The values of each segment are added up one after the other,
+    # like sum() would, so that the results are exactly the same.
+    positions = (np.arange(len(segment_ids)) -
+                 np.searchsorted(segment_ids, segment_ids))
+    order = np.argsort(positions, kind='stable')
+    boundaries = np.concatenate([[0], np.cumsum(np.bincount(positions))])
+    sums = np.zeros(num_segments)
+    for start, end in zip(boundaries[:-1], boundaries[1:]):
+        indexes = order[start:end]
+        sums[segment_ids[indexes]] += values[indexes]
+    return sums
 
 
 class NgramCounts(object):
     ## A note on data-structure.
     ## Firstly, all words are represented as integers.
-    ## We store n-gram counts as an array, indexed by (history-length == n-gram order minus one)
-    ## (note: python calls arrays "lists")  of dicts from histories to counts, where
-    ## histories are arrays of integers and "counts" are dicts from integer to float.
-    ## For instance, when accumulating the 4-gram count for the '8' in the sequence '5 6 7 8',
-    ## we'd do as follows:
-    ##  self.counts[3][[5,6,7]][8] += 1.0
-    ## where the [3] indexes an array, the [[5,6,7]] indexes a dict, and
-    ## the [8] indexes a dict.
+    ## We store n-gram counts separately for each history-length (== n-gram
+    ## order minus one) n, as numpy arrays.  self.hists[n] is an array of shape
+    ## (num-histories, n) whose rows are the histories, and the counts are
+    ## stored as three parallel arrays self.hist_index[n], self.words[n] and
+    ## self.counts[n], with one element per (history, predicted-word) pair;
+    ## hist_index[n] indexes the rows of hists[n].
+    ## For instance, the 4-gram count for the '8' in the sequence '5 6 7 8' is
+    ##  self.counts[3][i]
+    ## where self.hists[3][self.hist_index[3][i]] == [5,6,7] and
+    ## self.words[3][i] == 8.
+    ## The histories are kept in the order in which they were first seen, and
+    ## the counts are sorted by history and then by the order in which they
+    ## were first seen (i.e. the order in which dicts of histories and of
+    ## words would iterate).  This order determines the numbering of the
+    ## FST-states and the order of the arcs.
     def __init__(self, ngram_order):
         self.ngram_order = ngram_order
         # Integerized counts will never contain negative numbers, so
@@ -78,65 +153,122 @@ class NgramCounts(object):
         # backoff_symbol is kind of a pseudo-word, it's used in keeping track of
         # the backoff counts in each state.
         self.backoff_symbol = -1
-        self.counts = []
-        for n in range(ngram_order):
-            # The 'lambda: defaultdict(float)' is an anonymous function taking
-            # no arguments that returns a new defaultdict(float).
-            # If we index self.counts[n][history] for a history-length n < ngram_order
-            # and a previously unseen history, it will create a new defaultdict
-            # that defaults to 0.0 [since the function float() will return 0.0].
-            # This means that we can index self.counts without worrying about
-            # undefined values.
-            self.counts.append(defaultdict(lambda: defaultdict(float)))
-
-    # adds a raw count (called while processing input data).
-    # Suppose we see the sequence '6 7 8 9' and ngram_order=4, 'history'
-    # would be (6,7,8) and 'predicted_word' would be 9; 'count' would be
-    # 1.0.
-    def AddCount(self, history, predicted_word, count):
-        self.counts[len(history)][history][predicted_word] += count
+        self.hists = [np.zeros((0, n), dtype=np.int32)
+                      for n in range(ngram_order)]
+        self.hist_index = [np.zeros(0, dtype=np.int64)
+                           for n in range(ngram_order)]
+        self.words = [np.zeros(0, dtype=np.int32) for n in range(ngram_order)]
+        self.counts = [np.zeros(0) for n in range(ngram_order)]
+
+    # adds raw counts, in the order in which they are given.  'hists' is an
+    # integer array of shape (k, n) of histories of length n, and
+    # 'predicted_words' and 'counts' are arrays of length k.
+    # Suppose we see the sequence '6 7 8 9' and ngram_order=4, 'hists'
+    # would be [[6,7,8]] and 'predicted_words' would be [9]; 'counts' would be
+    # [1.0].
+    def AddCounts(self, n, hists, predicted_words, counts):
+        num_old_hists = len(self.hists[n])
+        hist_keys = np.concatenate(RowKeys(self.hists[n], hists))
+        hist_ids, first = IdsByFirstOccurrence(hist_keys)
+        self.hists[n] = np.concatenate([self.hists[n], hists])[first]
+
+        hist_index = np.concatenate([self.hist_index[n],
+                                     hist_ids[num_old_hists:]])
+        words = np.concatenate([self.words[n], predicted_words])
+        entry_keys, = RowKeys(np.stack([hist_index, words], axis=1))
+        entry_ids, first = IdsByFirstOccurrence(entry_keys)
+        # bincount adds up the counts of each entry in order.
+        counts = np.bincount(entry_ids,
+                             weights=np.concatenate([self.counts[n], counts]),
+                             minlength=len(first)).astype(float)
+        order = np.argsort(hist_index[first], kind='stable')
+        self.hist_index[n] = hist_index[first][order]
+        self.words[n] = words[first][order]
+        self.counts[n] = counts[order]
+
+    # Returns the histories of all counts of history-length n, as an array
+    # of shape (num-counts, n).
+    def GetEntryHists(self, n):
+        return self.hists[n][self.hist_index[n]]
+
+    # Removes the histories of history-length n for which 'keep' is False,
+    # together with their counts.
+    def RemoveHists(self, n, keep):
+        new_index = np.cumsum(keep) - 1
+        keep_entries = keep[self.hist_index[n]]
+        self.hists[n] = self.hists[n][keep]
+        self.hist_index[n] = new_index[self.hist_index[n][keep_entries]]
+        self.words[n] = self.words[n][keep_entries]
+        self.counts[n] = self.counts[n][keep_entries]
 
     # 'line' is a string containing a sequence of integer word-ids.
     # This function adds the un-smoothed counts from this line of text.
     def AddRawCountsFromLine(self, line):
-        try:
-            words = [self.bos_symbol] + [ int(x) for x in line.split() ] + [self.eos_symbol]
-        except:
-            sys.exit("make_one_biased_lm.py: bad input line {0} (expected a sequence "
-                     "of integers)".format(line))
-
-        for n in range(1, len(words)):
-            predicted_word = words[n]
-            history_start = max(0, n + 1 - self.ngram_order)
-            history = tuple(words[history_start:n])
-            self.AddCount(history, predicted_word, 1.0)
-
-    def AddRawCountsFromStandardInput(self):
-        lines_processed = 0
-        while True:
-            line = sys.stdin.readline()
-            if line == '':
-                break
-            self.AddRawCountsFromLine(line)
-            lines_processed += 1
-        if lines_processed == 0 or args.verbose > 0:
+        self.AddRawCountsFromLines([line])
+
+    # 'lines' is a list of strings containing sequences of integer word-ids.
+    # This function adds the un-smoothed counts from these lines of text.
+    def AddRawCountsFromLines(self, lines):
+        sequence = []
+        for line in lines:
+            try:
+                words = [ int(x) for x in line.split() ]
+            except:
+                sys.exit("make_one_biased_lm.py: bad input line {0} (expected a sequence "
+                         "of integers)".format(line))
+            sequence += [self.bos_symbol] + words + [self.eos_symbol]
+        sequence = np.array(sequence, dtype=np.int32)
+
+        # the position of each word in its line (0 for the BOS symbol).
+        line_starts = np.flatnonzero(sequence == self.bos_symbol)
+        positions = (np.arange(len(sequence)) -
+                     line_starts[np.cumsum(sequence == self.bos_symbol) - 1])
+        history_lengths = np.minimum(positions, self.ngram_order - 1)
+        for n in range(1, self.ngram_order):
+            predicted = np.flatnonzero((history_lengths == n) & (positions > 0))
+            hists = np.stack([sequence[predicted - n + j] for j in range(n)],
+                             axis=-1).reshape(len(predicted), n)
+            self.AddCounts(n, hists, sequence[predicted],
+                           np.ones(len(predicted)))
+
+    def AddRawCountsFromStandardInput(self, verbose=0):
+        lines = sys.stdin.readlines()
+        self.AddRawCountsFromLines(lines)
+        lines_processed = len(lines)
+        if lines_processed == 0 or verbose > 0:
             print("make_one_biased_lm.py: processed {0} lines of input".format(
                     lines_processed), file = sys.stderr)
 
 
-    # This function returns a dict from history (as a tuple of integers of
-    # length > 1, ignoring lower-order histories), to the total count of this
-    # history state plus all history-states which back off to this history state.
+    # This function returns a function that maps an array of histories (of
+    # length n > 1, ignoring lower-order histories) to the total count of each
+    # history state plus all history-states which back off to this history
+    # state.  The totals are those of the counts at the time this function is
+    # called; histories without counts at that time get a total of zero.
     # It's used inside CompletelyDiscountLowCountStates().
     def GetHistToTotalCount(self):
-        ans = defaultdict(float)
+        suffixes = [[] for n in range(self.ngram_order)]
+        totals = [[] for n in range(self.ngram_order)]
         for n in range(2, self.ngram_order):
-            for hist, word_to_count in self.counts[n].items():
-                total_count = sum(word_to_count.values())
-                while len(hist) >= 2:
-                    ans[hist] += total_count
-                    hist = hist[1:]
-        return ans
+            total_count = np.bincount(self.hist_index[n],
+                                      weights=self.counts[n],
+                                      minlength=len(self.hists[n]))
+            for m in range(2, n + 1):
+                suffixes[m].append(self.hists[n][:, n - m:])
+                totals[m].append(total_count)
+
+        def get_total_count(hists):
+            m = hists.shape[1]
+            if len(suffixes[m]) == 0:
+                return np.zeros(len(hists))
+            suffix_keys, hist_keys = RowKeys(np.concatenate(suffixes[m]), hists)
+            _, keys = np.unique(np.concatenate([suffix_keys, hist_keys]),
+                                return_inverse=True)
+            ans = np.bincount(keys[:len(suffix_keys)],
+                              weights=np.concatenate(totals[m]),
+                              minlength=len(keys))
+            return ans[keys[len(suffix_keys):]]
+        return get_total_count
 
 
     # This function will completely discount the counts in any LM-states of
@@ -144,40 +276,42 @@ class NgramCounts(object):
     # 'min_count'; when computing the total counts, we include higher-order
     # LM-states that would back off to 'this' lm-state, in the total.
     def CompletelyDiscountLowCountStates(self, min_count):
-        hist_to_total_count = self.GetHistToTotalCount()
+        get_hist_to_total_count = self.GetHistToTotalCount()
         for n in reversed(list(range(2, self.ngram_order))):
-            this_order_counts = self.counts[n]
-            to_delete = []
-            for hist in this_order_counts.keys():
-                if hist_to_total_count[hist] < min_count:
-                    # we need to completely back off this count.
-                    word_to_count = this_order_counts[hist]
-                    # mark this key for deleting
-                    to_delete.append(hist)
-                    backoff_hist = hist[1:]  # this will be a tuple not a list.
-                    for word, count in word_to_count.items():
-                        self.AddCount(backoff_hist, word, count)
-            for hist in to_delete:
-                del this_order_counts[hist]
+            keep = get_hist_to_total_count(self.hists[n]) >= min_count
+            # we need to completely back off the counts of the other states.
+            backoff = ~keep[self.hist_index[n]]
+            self.AddCounts(n - 1, self.GetEntryHists(n)[backoff, 1:],
+                           self.words[n][backoff], self.counts[n][backoff])
+            self.RemoveHists(n, keep)
 
     # This backs off the counts according to Kneser-Ney (unmodified,
     # with interpolation).
     def ApplyBackoff(self, D):
         assert D > 0.0 and D < 1.0
+        max_words_per_hist = max([1] + [len(words) for words in self.words])
+        # discount_totals[k] is D added up k times.
+        discount_totals = np.concatenate(
+            [[0.0], np.cumsum(np.full(max_words_per_hist, D))])
         for n in reversed(list(range(1, self.ngram_order))):
-            this_order_counts = self.counts[n]
-            for hist, word_to_count in this_order_counts.items():
-                backoff_hist = hist[1:]
-                backoff_word_to_count = self.counts[n-1][backoff_hist]
-                this_discount_total = 0.0
-                for word in word_to_count:
-                    assert word_to_count[word] >= 1.0
-                    word_to_count[word] -= D
-                    this_discount_total += D
-                    # Interpret the following line as incrementing the
-                    # count-of-counts for the next-lower order.
-                    backoff_word_to_count[word] += 1.0
-                word_to_count[self.backoff_symbol] += this_discount_total
+            assert np.all(self.counts[n] >= 1.0)
+            self.counts[n] -= D
+            # Interpret the following as incrementing the count-of-counts for
+            # the next-lower order.
+            self.AddCounts(n - 1, self.GetEntryHists(n)[:, 1:], self.words[n],
+                           np.ones(len(self.words[n])))
+            # add the backoff counts after the other counts of each history.
+            num_hists = len(self.hists[n])
+            num_words = np.bincount(self.hist_index[n], minlength=num_hists)
+            hist_index = np.concatenate([self.hist_index[n],
+                                         np.arange(num_hists)])
+            order = np.argsort(hist_index, kind='stable')
+            self.hist_index[n] = hist_index[order]
+            self.words[n] = np.concatenate(
+                [self.words[n], np.full(num_hists, self.backoff_symbol,
+                                        dtype=np.int32)])[order]
+            self.counts[n] = np.concatenate(
+                [self.counts[n], discount_totals[num_words]])[order]
 
 
     # This function prints out to stderr the n-gram counts stored in this
@@ -187,135 +321,308 @@ class NgramCounts(object):
         # these are useful for debug.
         total = 0.0
         total_excluding_backoff = 0.0
-        for this_order_counts in self.counts:
-            for hist, word_to_count in this_order_counts.items():
-                this_total_count = sum(word_to_count.values())
-                print('{0}: total={1} '.format(hist, this_total_count),
+        for n in range(self.ngram_order):
+            hist_index = self.hist_index[n].tolist()
+            words = self.words[n].tolist()
+            counts = self.counts[n].tolist()
+            starts = np.searchsorted(hist_index, np.arange(len(self.hists[n]) + 1))
+            for h, hist in enumerate(self.hists[n].tolist()):
+                word_to_count = list(zip(words[starts[h]:starts[h + 1]],
+                                         counts[starts[h]:starts[h + 1]]))
+                this_total_count = sum(count for word, count in word_to_count)
+                print('{0}: total={1} '.format(tuple(hist), this_total_count),
                       end='', file=sys.stderr)
                 print(' '.join(['{0} -> {1} '.format(word, count)
-                                for word, count in word_to_count.items() ]),
+                                for word, count in word_to_count ]),
                       file = sys.stderr)
                 total += this_total_count
                 total_excluding_backoff += this_total_count
-                if self.backoff_symbol in word_to_count:
-                    total_excluding_backoff -= word_to_count[self.backoff_symbol]
+                for word, count in word_to_count:
+                    if word == self.backoff_symbol:
+                        total_excluding_backoff -= count
         print('total count = {0}, excluding discount = {1}'.format(
                 total, total_excluding_backoff), file = sys.stderr)
 
-    def AddTopWords(self, top_words_file):
-        empty_history = ()
-        word_to_count = self.counts[0][empty_history]
-        total = sum(word_to_count.values())
-        try:
-            f = open(top_words_file, mode='r', encoding='utf-8')
-        except:
-            sys.exit("make_one_biased_lm.py: error opening top-words file: "
-                     "--top-words=" + top_words_file)
-        while True:
-            line = f.readline()
-            if line == '':
-                break
-            try:
-                [ word_index, prob ] = line.split()
-                word_index = int(word_index)
-                prob = float(prob)
-                assert word_index > 0 and prob > 0.0
-                word_to_count[word_index] += prob * total
-            except Exception as e:
-                sys.exit("make_one_biased_lm.py: could not make sense of the "
-                         "line '{0}' in op-words file: {1} ".format(line, str(e)))
-        f.close()
-
-
-    def GetTotalCountMap(self):
-        # This function, called from PrintAsFst, returns a map from
-        # history to the total-count for that state.
-        total_count_map = dict()
-        for n in range(0, self.ngram_order):
-            for hist, word_to_count in self.counts[n].items():
-                total_count_map[hist] = sum(word_to_count.values())
-        return total_count_map
-
-    def GetHistToStateMap(self):
-        # This function, called from PrintAsFst, returns a map from
-        # history to integer FST-state.
-        hist_to_state = dict()
-        fst_state_counter = 0
-        for n in range(0, self.ngram_order):
-            for hist in self.counts[n].keys():
-                hist_to_state[hist] = fst_state_counter
-                fst_state_counter += 1
-        return hist_to_state
-
-    def GetProb(self, hist, word, total_count_map):
-        total_count = total_count_map[hist]
-        word_to_count = self.counts[len(hist)][hist]
-        prob = float(word_to_count[word]) / total_count
-        if len(hist) > 0 and word != self.backoff_symbol:
-            prob_in_backoff = self.GetProb(hist[1:], word, total_count_map)
-            backoff_prob = float(word_to_count[self.backoff_symbol]) / total_count
-            prob += backoff_prob * prob_in_backoff
-        return prob
+    # 'top_words' is a list of (word, prob) pairs, see ReadTopWords().
+    def AddTopWords(self, top_words):
+        if len(self.hists[0]) == 0:
+            self.hists[0] = np.zeros((1, 0), dtype=np.int32)
+        words = self.words[0].tolist()
+        counts = self.counts[0].tolist()
+        word_to_index = dict((word, i) for i, word in enumerate(words))
+        total = sum(counts)
+        for word_index, prob in top_words:
+            if word_index not in word_to_index:
+                word_to_index[word_index] = len(words)
+                words.append(word_index)
+                counts.append(0.0)
+            counts[word_to_index[word_index]] += prob * total
+        self.hist_index[0] = np.zeros(len(words), dtype=np.int64)
+        self.words[0] = np.array(words, dtype=np.int32)
+        self.counts[0] = np.array(counts)
+
+
+    def GetTotalCounts(self):
+        # This function, called from PrintAsFst, returns a list, indexed by
+        # history-length, of arrays with the total-count of each state.
+        return [SequentialSums(self.hist_index[n], self.counts[n],
+                               len(self.hists[n]))
+                for n in range(self.ngram_order)]
+
+    def GetStateOffsets(self):
+        # This function, called from PrintAsFst, returns the integer FST-state
+        # of the first history of each history-length; the states of the
+        # histories follow in order.
+        return np.cumsum([0] + [len(hists) for hists in self.hists])
+
+    def FindHists(self, m, hists):
+        # Returns the index of each of 'hists' (an array of shape (k, m)) in
+        # self.hists[m], or -1 if it is not a history.
+        if m == 0:
+            return np.zeros(len(hists), dtype=np.int64)
+        keys, query_keys = RowKeys(self.hists[m], hists)
+        return Lookup(keys, query_keys)
+
+    def GetProbs(self, total_counts):
+        # Returns a list, indexed by history-length, of arrays with the
+        # probability of each count (including the backoff probability of the
+        # lower-order states).
+        probs = []
+        for n in range(self.ngram_order):
+            total_count = total_counts[n][self.hist_index[n]]
+            prob = self.counts[n] / total_count
+            if n > 0:
+                is_backoff = self.words[n] == self.backoff_symbol
+                backoff_count = np.zeros(len(self.hists[n]))
+                backoff_count[self.hist_index[n][is_backoff]] = \
+                    self.counts[n][is_backoff]
+                backoff_prob = backoff_count[self.hist_index[n]] / total_count
+                # look up the (history, word) pairs in the backoff states
+                backoff_hist_index = self.FindHists(
+                    n - 1, self.hists[n][:, 1:])[self.hist_index[n]]
+                entry_keys, query_keys = RowKeys(
+                    np.stack([self.hist_index[n - 1], self.words[n - 1]], axis=1),
+                    np.stack([backoff_hist_index, self.words[n]], axis=1))
+                prob_in_backoff = probs[n - 1][Lookup(entry_keys, query_keys)]
+                prob = np.where(is_backoff, prob,
+                                prob + backoff_prob * prob_in_backoff)
+            probs.append(prob)
+        return probs
+
+    def GetNextStates(self, n, state_offsets):
+        # Returns the FST-state that each count of history-length n leads to:
+        # for real words the longest history of hist + (word,) that exists,
+        # and for the backoff symbol the backoff state; -1 for the EOS symbol.
+        hists = self.GetEntryHists(n)
+        words = self.words[n]
+        next_states = np.full(len(words), -1, dtype=np.int64)
+
+        is_backoff = words == self.backoff_symbol
+        if n > 0:
+            next_states[is_backoff] = state_offsets[n - 1] + self.FindHists(
+                n - 1, hists[is_backoff, 1:])
+
+        next_hists = np.concatenate([hists, words[:, None]], axis=1)
+        todo = np.flatnonzero(words > 0)
+        for m in reversed(list(range(min(n + 1, self.ngram_order - 1) + 1))):
+            found = self.FindHists(m, next_hists[todo, n + 1 - m:])
+            next_states[todo[found >= 0]] = state_offsets[m] + found[found >= 0]
+            todo = todo[found < 0]
+        return next_states
 
     # This function prints the estimated language model as an FST.
     def PrintAsFst(self, word_disambig_symbol):
+        for line in self.GetFstLines(word_disambig_symbol):
+            print(line)
+
+    # This function returns the lines of the estimated language model as a
+    # text-form FST.
+    def GetFstLines(self, word_disambig_symbol):
         # n is the history-length (== order + 1).  We iterate over the
         # history-length in the order 1, 0, 2, 3, and then iterate over the
         # histories of each order in sorted order.  Putting order 1 first
         # and sorting on the histories
         # ensures that the bigram state with <s> as the left context comes first.
         # (note: self.bos_symbol is the most negative symbol)
-
-        # History will map from history (as a tuple) to integer FST-state.
-        hist_to_state = self.GetHistToStateMap()
-        total_count_map = self.GetTotalCountMap()
-
+        state_offsets = self.GetStateOffsets()
+        total_counts = self.GetTotalCounts()
+        if any(np.any(total_count == 0) for total_count in total_counts):
+            sys.exit("make_one_biased_lm.py: LM-state with zero total count "
+                     "(empty input?)")
+        probs = self.GetProbs(total_counts)
+
+        lines = []
         for n in [ 1, 0 ] + list(range(2, self.ngram_order)):
-            this_order_counts = self.counts[n]
-            # For order 1, make sure the keys are sorted.
-            keys = this_order_counts.keys() if n != 1 else sorted(this_order_counts.keys())
-            for hist in keys:
-                word_to_count = this_order_counts[hist]
-                this_fst_state = hist_to_state[hist]
-
-                for word in word_to_count.keys():
-                    # work out this_cost.  Costs in OpenFst are negative logs.
-                    this_cost = -math.log(self.GetProb(hist, word, total_count_map))
-
-                    if word > 0: # a real word.
-                        next_hist = hist + (word,)  # appending tuples
-                        while not next_hist in hist_to_state:
-                            next_hist = next_hist[1:]
-                        next_fst_state = hist_to_state[next_hist]
-                        print(this_fst_state, next_fst_state, word, word,
-                              this_cost)
-                    elif word == self.eos_symbol:
-                        # print final-prob for this state.
-                        print(this_fst_state, this_cost)
-                    else:
-                        assert word == self.backoff_symbol
-                        backoff_fst_state = hist_to_state[hist[1:len(hist)]]
-                        print(this_fst_state, backoff_fst_state,
-                              word_disambig_symbol, 0, this_cost)
-
-
-ngram_counts = NgramCounts(args.ngram_order)
-ngram_counts.AddRawCountsFromStandardInput()
-
-if args.verbose >= 3:
-    ngram_counts.Print("Raw counts:")
-ngram_counts.CompletelyDiscountLowCountStates(args.min_lm_state_count)
-if args.verbose >= 3:
-    ngram_counts.Print("Counts after discounting low-count states:")
-ngram_counts.ApplyBackoff(args.discounting_constant)
-if args.verbose >= 3:
-    ngram_counts.Print("Counts after applying Kneser-Ney discounting:")
-if args.top_words != None:
-    ngram_counts.AddTopWords(args.top_words)
+            this_order_states = state_offsets[n] + self.hist_index[n]
+            if n == 1:
+                # For order 1, make sure the histories are sorted.
+                hist_order = np.argsort(self.hists[1][:, 0], kind='stable')
+                rank = np.empty(len(hist_order), dtype=np.int64)
+                rank[hist_order] = np.arange(len(hist_order))
+                order = np.argsort(rank[self.hist_index[1]], kind='stable')
+            else:
+                order = np.arange(len(self.words[n]))
+
+            next_states = self.GetNextStates(n, state_offsets)
+            for this_fst_state, next_fst_state, word, prob in zip(
+                    this_order_states[order].tolist(),
+                    next_states[order].tolist(),
+                    self.words[n][order].tolist(),
+                    probs[n][order].tolist()):
+                # work out this_cost.  Costs in OpenFst are negative logs.
+                this_cost = -math.log(prob)
+
+                if word > 0: # a real word.
+                    lines.append('{0} {1} {2} {2} {3}'.format(
+                        this_fst_state, next_fst_state, word, this_cost))
+                elif word == self.eos_symbol:
+                    # print final-prob for this state.
+                    lines.append('{0} {1}'.format(this_fst_state, this_cost))
+                else:
+                    assert word == self.backoff_symbol
+                    lines.append('{0} {1} {2} 0 {3}'.format(
+                        this_fst_state, next_fst_state, word_disambig_symbol,
+                        this_cost))
+        return lines
+
+
+# Reads the file of top words (see --top-words) and returns a list of
+# (word, prob) pairs.
+def ReadTopWords(top_words_file):
+    top_words = []
+    try:
+        f = open(top_words_file, mode='r', encoding='utf-8')
+    except:
+        sys.exit("make_one_biased_lm.py: error opening top-words file: "
+                 "--top-words=" + top_words_file)
+    while True:
+        line = f.readline()
+        if line == '':
+            break
+        try:
+            [ word_index, prob ] = line.split()
+            word_index = int(word_index)
+            prob = float(prob)
+            assert word_index > 0 and prob > 0.0
+            top_words.append((word_index, prob))
+        except Exception as e:
+            sys.exit("make_one_biased_lm.py: could not make sense of the "
+                     "line '{0}' in op-words file: {1} ".format(line, str(e)))
+    f.close()
+    return top_words
+
+
+# Estimates the counts of the language model from the counts in
+# 'ngram_counts'; 'top_words' is None or the result of ReadTopWords().
+def EstimateLm(ngram_counts, args, top_words):
+    if args.verbose >= 3:
+        ngram_counts.Print("Raw counts:")
+    ngram_counts.CompletelyDiscountLowCountStates(args.min_lm_state_count)
+    if args.verbose >= 3:
+        ngram_counts.Print("Counts after discounting low-count states:")
+    ngram_counts.ApplyBackoff(args.discounting_constant)
     if args.verbose >= 3:
-        ngram_counts.Print("Counts after applying top-n-words")
-ngram_counts.PrintAsFst(args.word_disambig_symbol)
+        ngram_counts.Print("Counts after applying Kneser-Ney discounting:")
+    if top_words != None:
+        ngram_counts.AddTopWords(top_words)
+        if args.verbose >= 3:
+            ngram_counts.Print("Counts after applying top-n-words")
+
+
+# Reads an archive of integerized text from 'f' and yields (key, lines)
+# for each run of consecutive lines with the same key.
+def ReadTextArchive(f):
+    key = None
+    lines = []
+    for line in f:
+        a = line.split(None, 1)
+        if len(a) == 0:
+            sys.exit("make_one_biased_lm.py: empty input line")
+        if a[0] != key and len(lines) > 0:
+            yield key, lines
+            lines = []
+        key = a[0]
+        lines.append(a[1] if len(a) > 1 else '')
+    if len(lines) > 0:
+        yield key, lines
+
+
+_batch_args = None
+_batch_top_words = None
+
+def InitBatchWorker(args, top_words):
+    global _batch_args, _batch_top_words
+    _batch_args = args
+    _batch_top_words = top_words
+
+# Builds the language model of one (key, lines) pair of the archive, and
+# returns the key and the lines of the FST.
+def MakeBiasedLm(key_and_lines):
+    key, lines = key_and_lines
+    args = _batch_args
+    ngram_counts = NgramCounts(args.ngram_order)
+    ngram_counts.AddRawCountsFromLines(lines)
+    if args.verbose > 0:
+        print("make_one_biased_lm.py: processed {0} lines of input for {1}".format(
+                len(lines), key), file = sys.stderr)
+    EstimateLm(ngram_counts, args, _batch_top_words)
+    return key, ngram_counts.GetFstLines(args.word_disambig_symbol)
+
+
+def RunBatch(args, top_words):
+    InitBatchWorker(args, top_words)
+    records = ReadTextArchive(sys.stdin)
+    if args.num_jobs > 1:
+        pool = multiprocessing.Pool(args.num_jobs, initializer=InitBatchWorker,
+                                    initargs=(args, top_words))
+        results = pool.imap(MakeBiasedLm, records, chunksize=4)
+    else:
+        pool = None
+        results = map(MakeBiasedLm, records)
+    num_lms = 0
+    for key, fst_lines in results:
+        # The FSTs of the archive are terminated by a blank line.
+        print(key)
+        for line in fst_lines:
+            print(line)
+        print("")
+        num_lms += 1
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if num_lms == 0 or args.verbose > 0:
+        print("make_one_biased_lm.py: wrote {0} language models".format(
+                num_lms), file = sys.stderr)
+
+
+def Main():
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer,encoding="utf8")
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer,encoding="utf8")
+    sys.stdin = io.TextIOWrapper(sys.stdin.buffer,encoding="utf8")
+
+    args = parser.parse_args()
+
+    if args.verbose >= 1:
+        print(' '.join(sys.argv), file = sys.stderr)
+
+    top_words = None
+    if args.top_words != None:
+        top_words = ReadTopWords(args.top_words)
+
+    if args.batch == "true":
+        RunBatch(args, top_words)
+        return
+
+    ngram_counts = NgramCounts(args.ngram_order)
+    ngram_counts.AddRawCountsFromStandardInput(args.verbose)
+    EstimateLm(ngram_counts, args, top_words)
+    ngram_counts.PrintAsFst(args.word_disambig_symbol)
+
+
+if __name__ == "__main__":
+    Main()
 
 
 # test comand:
 # (echo 6 7 8 4; echo 7 8 9; echo 7 8) | ./make_one_biased_lm.py --word-disambig-symbol=1000 --min-lm-state-count=2 --verbose=3 --top-words=<(echo 1 0.5; echo 2 0.25)
+# (echo utt1 6 7 8 4; echo utt1 7 8 9; echo utt2 7 8) | ./make_one_biased_lm.py --batch=true --word-disambig-symbol=1000 --min-lm-state-count=2 --top-words=<(echo 1 0.5; echo 2 0.25)
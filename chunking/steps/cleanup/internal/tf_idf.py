@@ -3,6 +3,15 @@
 
 """This module contains structures to accumulate, store and use stats
 for Term-frequency and Inverse-document-frequency values.
+
+IDFStats and TFIDF objects (and archives of TFIDF objects) can be written
+as text or in a binary format, and the readers detect the format.
+The binary format of an object is
+    the magic "\\0BTFIDF", a kind byte (I for IDFStats, T for TFIDF),
+    the words, the documents, the term offsets and the word-ids of the
+    terms, followed by the values, see _write_binary_object().
+A binary archive is a sequence of "<key> <binary-object>", like Kaldi's
+binary archives.
 """
 
 from __future__ import print_function
@@ -10,13 +19,104 @@ from __future__ import division
 import logging
 import math
 import re
+import struct
 import sys
+import tempfile
+import unittest
+
+import numpy as np
 
 sys.path.insert(0, 'steps')
 
 logger = logging.getLogger('__name__')
 logger.addHandler(logging.NullHandler())
 
+BINARY_MAGIC = b"\0BTFIDF"
+_IDF_KIND = b"I"
+_TFIDF_KIND = b"T"
+
+
+def _binary_stream(file_handle):
+    """Returns the binary stream underlying a text file handle."""
+    return getattr(file_handle, 'buffer', file_handle)
+
+
+def is_binary(file_handle):
+    """Returns True if the file, which must not have been read from yet,
+    starts with a binary object or a binary archive entry. Nothing is
+    consumed from the file."""
+    stream = _binary_stream(file_handle)
+    if not hasattr(stream, 'peek'):
+        return False
+    head = stream.peek(256)[:256]
+    if head[:1] == b"\0":
+        return True
+    key_end = head.find(b" ")
+    return key_end > 0 and head[key_end + 1:key_end + 2] == b"\0"
+
+
+def _write_array(stream, values, dtype):
+    array = np.asarray(values, dtype=dtype)
+    stream.write(struct.pack('<Q', len(array)))
+    stream.write(array.tobytes())
+
+
+def _read_array(stream, dtype):
+    length, = struct.unpack('<Q', stream.read(8))
+    dtype = np.dtype(dtype)
+    return np.frombuffer(stream.read(length * dtype.itemsize), dtype=dtype)
+
+
+def _write_strings(stream, strings):
+    data = "\n".join(strings).encode('utf-8')
+    stream.write(struct.pack('<QQ', len(strings), len(data)))
+    stream.write(data)
+
+
+def _read_strings(stream):
+    num_strings, length = struct.unpack('<QQ', stream.read(16))
+    if num_strings == 0:
+        return []
+    return stream.read(length).decode('utf-8').split("\n")
+
+
+def _write_binary_object(file_handle, kind, terms, docs, arrays):
+    """Writes a binary object with the terms (tuples of words) as
+    word-ids into a vocabulary of words, the document-ids and the
+    given (values, dtype) arrays."""
+    vocab = {}
+    term_words = [vocab.setdefault(word, len(vocab))
+                  for term in terms for word in term]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.uint32)
+    term_offsets[1:] = np.cumsum([len(term) for term in terms])
+
+    if file_handle is not _binary_stream(file_handle):
+        file_handle.flush()
+    stream = _binary_stream(file_handle)
+    stream.write(BINARY_MAGIC + kind)
+    _write_strings(stream, list(vocab))
+    _write_strings(stream, docs)
+    _write_array(stream, term_offsets, '<u4')
+    _write_array(stream, term_words, '<u4')
+    for values, dtype in arrays:
+        _write_array(stream, values, dtype)
+
+
+def _read_binary_object(stream, kind, dtypes):
+    """Reads a binary object written by _write_binary_object(). Returns the
+    terms, the document-ids and the arrays of the given dtypes."""
+    magic = stream.read(len(BINARY_MAGIC) + 1)
+    if magic != BINARY_MAGIC + kind:
+        raise TypeError("Invalid binary object; expected {0}, got {1}".format(
+            BINARY_MAGIC + kind, magic))
+    words = _read_strings(stream)
+    docs = _read_strings(stream)
+    term_offsets = _read_array(stream, '<u4').tolist()
+    term_words = [words[i] for i in _read_array(stream, '<u4').tolist()]
+    terms = [tuple(term_words[start:end])
+             for start, end in zip(term_offsets[:-1], term_offsets[1:])]
+    return terms, docs, [_read_array(stream, dtype) for dtype in dtypes]
+
 
 class IDFStats(object):
     """Stores stats for computing inverse-document-frequencies.
@@ -61,11 +161,20 @@ class IDFStats(object):
         if len(term) == 1:
             self.num_docs += 1
 
-    def write(self, file_handle):
+    def write(self, file_handle, binary=False):
         """Writes the IDF stats to file using the format:
         <term-1> <term-2> ... <term-N> <num-docs>
         for n-gram (<term-1>, ... <term-N>)
+        or in the binary format.
         """
+        if binary:
+            items = [(term, num)
+                     for term, num in self.num_docs_for_term.items()
+                     if num != 0]
+            _write_binary_object(
+                file_handle, _IDF_KIND, [term for term, _ in items], [],
+                [([num for _, num in items], '<f8')])
+            return
         for term, num in self.num_docs_for_term.items():
             if num == 0:
                 continue
@@ -74,7 +183,15 @@ class IDFStats(object):
                    file=file_handle)
 
     def read(self, file_handle):
-        """Loads IDF stats from file. """
+        """Loads IDF stats from file (text or binary). """
+        if is_binary(file_handle):
+            terms, _, (nums,) = _read_binary_object(
+                _binary_stream(file_handle), _IDF_KIND, ['<f8'])
+            for term, num in zip(terms, nums.tolist()):
+                self.num_docs_for_term[term] = num
+                if len(term) == 1:
+                    self.num_docs += 1
+            return
         for line in file_handle:
             parts = line.strip().split()
             term = tuple(parts[0:-1])
@@ -222,59 +339,63 @@ class TFIDF(object):
         Returns a dictionary
             { (query_document_id, source_document_id): similarity_score }
         """
-        num_terms_per_doc = {}
-        similarity_scores = {}
-
-        for tup, value in self.tf_idf.items():
-            term, doc = tup
-            num_terms_per_doc[doc] = num_terms_per_doc.get(doc, 0) + 1
-
-            if query_id is not None and doc != query_id:
-                raise RuntimeError("TF-IDF contains document {0}, which is "
-                                   "not the required query {1}. \n"
-                                   "Something wrong in how this TF-IDF object "
-                                   "was created or a bug in the "
-                                   "calling script.".format(
-                                       doc, query_id))
-
-            if source_docs is not None:
-                for src_doc in source_docs:
-                    try:
-                        src_value = source_tfidf.get_value(term, src_doc)
-                    except KeyError:
-                        logger.debug(
-                            "Could not find ({term}, {src}) in "
-                            "source_tfidf. "
-                            "Choosing a tf-idf value of 0.".format(
-                                term=term, src=src_doc))
-                        src_value = 0
-
-                    similarity_scores[(doc, src_doc)] = (
-                        similarity_scores.get((doc, src_doc), 0)
-                        + src_value * value)
-            else:
-                for src_tup, src_value in source_tfidf.tf_idf.items():
-                    similarity_scores[(doc, src_doc)] = (
-                        similarity_scores.get((doc, src_doc), 0)
-                        + src_value * value)
+        queries = SparseTFIDF.from_tfidf(self, source_tfidf.get_sparse().vocab)
+        if query_id is not None:
+            for doc in queries.docs:
+                if doc != query_id:
+                    raise RuntimeError("TF-IDF contains document {0}, which is "
+                                       "not the required query {1}. \n"
+                                       "Something wrong in how this TF-IDF object "
+                                       "was created or a bug in the "
+                                       "calling script.".format(
+                                           doc, query_id))
+        if source_docs is None:
+            source_docs = source_tfidf.get_sparse().docs
+        scores = source_tfidf.get_sparse().similarity_scores(
+            queries, source_docs=source_docs,
+            do_length_normalization=do_length_normalization)
 
-        if do_length_normalization:
-            for doc_pair, value in similarity_scores.items():
-                doc, src_doc = doc_pair
-                similarity_scores[(doc, src_doc)] = value / num_terms_per_doc[doc]
+        similarity_scores = {}
+        for i, doc in enumerate(queries.docs):
+            for j, src_doc in enumerate(source_docs):
+                similarity_scores[(doc, src_doc)] = float(scores[i, j])
 
         if logger.isEnabledFor(logging.DEBUG):
-            for doc, count in num_terms_per_doc.items():
+            for doc, count in zip(queries.docs, queries.num_terms):
                 logger.debug(
                     'Seen {0} terms in query document {1}'.format(count, doc))
 
         return similarity_scores
 
-    def read(self, tf_idf_file):
-        """Loads TFIDF object from file."""
+    def get_sparse(self):
+        """Returns the TF-IDF values as a SparseTFIDF object, which is
+        created on the first call."""
+        if getattr(self, '_sparse', None) is None:
+            self._sparse = SparseTFIDF.from_tfidf(self)
+        return self._sparse
+
+    def read(self, tf_idf_file, binary=None):
+        """Loads TFIDF object from file. If binary is None, the format is
+        detected."""
 
         if len(self.tf_idf) != 0:
             raise RuntimeError("TD-IDF object is not empty.")
+        self._sparse = None
+        if binary is None:
+            binary = is_binary(tf_idf_file)
+        if binary:
+            terms, docs, (entry_terms, entry_docs, values) = (
+                _read_binary_object(_binary_stream(tf_idf_file), _TFIDF_KIND,
+                                    ['<u4', '<u4', '<f8']))
+            self.tf_idf = {(terms[t], docs[d]): value
+                           for t, d, value in zip(entry_terms.tolist(),
+                                                  entry_docs.tolist(),
+                                                  values.tolist())}
+            if len(self.tf_idf) == 0:
+                raise RuntimeError(
+                    "Read no TF-IDF values from file {0}".format(
+                        tf_idf_file.name))
+            return
         seen_footer = False
         line = tf_idf_file.readline()
         parts = line.strip().split()
@@ -324,9 +445,23 @@ class TFIDF(object):
             raise RuntimeError(
                 "Read no TF-IDF values from file {0}".format(tf_idf_file.name))
 
-    def write(self, tf_idf_file):
+    def write(self, tf_idf_file, binary=False):
         """Writes TFIDF object to file."""
 
+        if binary:
+            terms = {}
+            docs = {}
+            entry_terms = []
+            entry_docs = []
+            for term, doc in self.tf_idf:
+                entry_terms.append(terms.setdefault(term, len(terms)))
+                entry_docs.append(docs.setdefault(doc, len(docs)))
+            _write_binary_object(
+                tf_idf_file, _TFIDF_KIND, list(terms), list(docs),
+                [(entry_terms, '<u4'), (entry_docs, '<u4'),
+                 (list(self.tf_idf.values()), '<f8')])
+            return
+
         print ("<TFIDF>", file=tf_idf_file)
         for tup, value in self.tf_idf.items():
             term, doc = tup
@@ -337,10 +472,140 @@ class TFIDF(object):
         print ("</TFIDF>", file=tf_idf_file)
 
 
+class SparseTFIDF(object):
+    """TF-IDF values of a set of documents as a sparse matrix in CSR format,
+    with one row per document and one column per term.
+
+    Parameters:
+        vocab - A dictionary { term: term-id } of the columns
+        docs - The document-ids of the rows
+        num_terms - Number of terms of each document, including the terms
+                    that are not in the vocabulary
+        indptr, indices, data - The CSR matrix; the values of document i are
+                                data[indptr[i]:indptr[i+1]] for the
+                                term-ids indices[indptr[i]:indptr[i+1]]
+    """
+
+    def __init__(self, vocab, docs, num_terms, indptr, indices, data):
+        self.vocab = vocab
+        self.docs = docs
+        self.doc_index = {doc: i for i, doc in enumerate(docs)}
+        self.num_terms = num_terms
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self._by_term = None
+
+    @classmethod
+    def from_tfidf(cls, tf_idf, vocab=None):
+        """Creates the matrix from a TFIDF object. If vocab is given, terms that
+        are not in it are left out; otherwise a vocabulary of all terms is
+        created. The values of a document keep their order in the TFIDF
+        object, so that scores are summed in the same order as in the
+        original term-by-term implementation."""
+        return cls.from_items(tf_idf.tf_idf.items(), vocab)
+
+    @classmethod
+    def from_items(cls, items, vocab=None):
+        """Same as from_tfidf(), for ((term, doc), value) items, e.g.
+        from several TFIDF objects."""
+        extend_vocab = vocab is None
+        if extend_vocab:
+            vocab = {}
+        rows = {}
+        num_terms = {}
+        for (term, doc), value in items:
+            num_terms[doc] = num_terms.get(doc, 0) + 1
+            row = rows.setdefault(doc, ([], []))
+            if extend_vocab:
+                term_id = vocab.setdefault(term, len(vocab))
+            else:
+                term_id = vocab.get(term)
+                if term_id is None:
+                    continue
+            row[0].append(term_id)
+            row[1].append(value)
+        docs = list(rows)
+        indptr = np.zeros(len(docs) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(rows[doc][0]) for doc in docs])
+        indices = np.array([term_id for doc in docs for term_id in rows[doc][0]],
+                           dtype=np.int64)
+        data = np.array([value for doc in docs for value in rows[doc][1]],
+                        dtype=np.float64)
+        return cls(vocab, docs, np.array([num_terms[doc] for doc in docs]),
+                   indptr, indices, data)
+
+    def _get_by_term(self):
+        """Returns the matrix in CSC format, i.e. the rows and values of
+        each term."""
+        if self._by_term is None:
+            rows = np.repeat(np.arange(len(self.docs)), np.diff(self.indptr))
+            order = np.argsort(self.indices, kind='stable')
+            term_ptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+            term_ptr[1:] = np.cumsum(
+                np.bincount(self.indices, minlength=len(self.vocab)))
+            self._by_term = (term_ptr, rows[order], self.data[order])
+        return self._by_term
+
+    def similarity_scores(self, queries, source_docs=None,
+                          do_length_normalization=False):
+        """Computes the TF-IDF similarity scores of all query documents with
+        the documents in this object, as one sparse matrix product.
+
+        Arguments:
+            queries - A SparseTFIDF object created with the vocab of this
+                      object
+            source_docs - If provided, the scores are computed only for
+                          these documents (in this order); documents
+                          that are not in this object get scores of 0.
+            do_length_normalization - If True, the scores are divided by
+                                      the number of terms of the query.
+
+        Returns a numpy array of shape (num_queries, num_source_docs).
+        """
+        if source_docs is None:
+            source_docs = self.docs
+        columns = np.array([self.doc_index.get(doc, -1) for doc in source_docs],
+                           dtype=np.int64)
+        if not np.any(columns >= 0):
+            # None of the source documents is in this object, which may have
+            # no documents at all
+            return np.zeros((len(queries.docs), len(source_docs)))
+        term_ptr, term_rows, term_data = self._get_by_term()
+
+        # For each (query, term) entry, all (source document, term) entries
+        # with the same term
+        starts = term_ptr[queries.indices]
+        counts = term_ptr[queries.indices + 1] - starts
+        entry = np.repeat(np.arange(len(queries.indices)), counts)
+        positions = (np.repeat(starts - np.cumsum(counts) + counts, counts)
+                     + np.arange(len(entry)))
+        query_rows = np.repeat(np.arange(len(queries.docs)),
+                               np.diff(queries.indptr))[entry]
+        # np.bincount adds up the products in the order of the query terms
+        scores = np.bincount(
+            query_rows * len(self.docs) + term_rows[positions],
+            weights=queries.data[entry] * term_data[positions],
+            minlength=len(queries.docs) * len(self.docs))
+        scores = scores.reshape(len(queries.docs), len(self.docs))
+
+        scores = np.where(columns >= 0, scores[:, columns], 0.0)
+        if do_length_normalization:
+            scores = scores / queries.num_terms[:, np.newaxis]
+        return scores
+
+
+def top_k(scores, k):
+    """Returns the indexes of the k largest scores in decreasing order of
+    score; equal scores are ordered by index."""
+    order = np.lexsort((np.arange(len(scores)), -np.asarray(scores)))
+    return order[:k]
+
+
 def write_tfidf_from_stats(
         tf_stats, idf_stats, tf_idf_file, tf_weighting_scheme="raw",
         idf_weighting_scheme="log", tf_normalization_factor=0.5,
-        expected_document_id=None):
+        expected_document_id=None, binary=False):
     """Writes TF-IDF values to file args.tf_idf_file.
     The format used is
     <ngram-order> <term> <document> <tfidf>.
@@ -356,6 +621,7 @@ def write_tfidf_from_stats(
         tf_normalization_factor - See doc_string in TFStats class
         document_id - If provided, checks that the TFStats object contains
                       stats only for this document_id.
+        binary - If True, writes a binary TFIDF object instead.
     """
     if len(tf_stats.raw_counts) == 0:
         raise RuntimeError("Supplied tf-stats object is empty.")
@@ -363,7 +629,10 @@ def write_tfidf_from_stats(
     if idf_stats.num_docs == 0:
         raise RuntimeError("Supplied idf-stats object is empty.")
 
-    print ("<TFIDF>", file=tf_idf_file)
+    if binary:
+        tf_idf = TFIDF()
+    else:
+        print ("<TFIDF>", file=tf_idf_file)
     for tup in tf_stats.raw_counts:
         term, doc = tup
 
@@ -382,23 +651,45 @@ def write_tfidf_from_stats(
         idf_value = idf_stats.get_inverse_document_frequency(
             term, weighting_scheme=idf_weighting_scheme)
 
+        if binary:
+            tf_idf.tf_idf[(term, doc)] = tf_value * idf_value
+            continue
         print("{order} {term} {doc} {tfidf}".format(
             order=len(term), term=" ".join(term),
             doc=doc, tfidf=tf_value * idf_value),
               file=tf_idf_file)
-    print ("</TFIDF>", file=tf_idf_file)
+    if binary:
+        tf_idf.write(tf_idf_file, binary=True)
+    else:
+        print ("</TFIDF>", file=tf_idf_file)
+
+
+def write_tfidf_ark_key(tf_idf_file, key, binary=False):
+    """Writes the key of an archive entry, which is followed by a TFIDF
+    object."""
+    if binary:
+        tf_idf_file.flush()
+        _binary_stream(tf_idf_file).write(key.encode('utf-8') + b" ")
+    else:
+        print (key, file=tf_idf_file, end=' ')
 
 
 def read_key(fd):
   """ [str] = read_key(fd)
    Read the utterance-key from the opened ark/stream descriptor 'fd'.
   """
-  str = ''
+  chars = []
   while 1:
     char = fd.read(1)
-    if char == '' : break
-    if char == ' ' : break
-    str += char
+    if char == '' or char == b'' : break
+    if char == ' ' or char == b' ' : break
+    chars.append(char)
+  # binary streams return bytes; the key is decoded as a whole, as it was
+  # written as UTF-8 by write_tfidf_ark_key()
+  if chars and isinstance(chars[0], bytes):
+    str = b''.join(chars).decode('utf-8')
+  else:
+    str = ''.join(chars)
   str = str.strip()
   if str == '': return None # end of file,
   return str
@@ -411,14 +702,69 @@ def read_tfidf_ark(file_handle):
     ...
     """
     try:
-        key = read_key(file_handle)
+        binary = is_binary(file_handle)
+        # Binary archives are read from the underlying binary stream.
+        stream = _binary_stream(file_handle) if binary else file_handle
+        key = read_key(stream)
         while key:
             tf_idf = TFIDF()
             try:
-                tf_idf.read(file_handle)
+                tf_idf.read(stream, binary=binary)
             except RuntimeError:
                 raise
             yield key, tf_idf
-            key = read_key(file_handle)
+            key = read_key(stream)
     finally:
         file_handle.close()
+
+
+class SelfTest(unittest.TestCase):
+
+    def test_similarity_scores(self):
+        source = SparseTFIDF.from_items([(("a", "d1"), 1.0), (("b", "d1"), 2.0),
+                                         (("b", "d2"), 3.0)])
+        queries = SparseTFIDF.from_items([(("b", "q1"), 0.5), (("c", "q1"), 1.0)],
+                                         source.vocab)
+        np.testing.assert_array_equal(
+            [[1.5, 0.0, 1.0]],
+            source.similarity_scores(queries, ["d2", "d3", "d1"]))
+        np.testing.assert_array_equal(
+            [[0.5, 0.75]],
+            source.similarity_scores(queries, do_length_normalization=True))
+
+    def test_similarity_scores_without_source_docs(self):
+        queries_items = [(("a", "q1"), 1.0), (("a", "q2"), 2.0)]
+        source = SparseTFIDF.from_items([])
+        queries = SparseTFIDF.from_items(queries_items, source.vocab)
+        np.testing.assert_array_equal(
+            np.zeros((2, 2)), source.similarity_scores(queries, ["d1", "d2"]))
+        self.assertEqual((2, 0), source.similarity_scores(queries).shape)
+
+        source = SparseTFIDF.from_items([(("a", "d1"), 1.0)])
+        queries = SparseTFIDF.from_items(queries_items, source.vocab)
+        np.testing.assert_array_equal(
+            np.zeros((2, 1)),
+            source.similarity_scores(queries, ["d2"],
+                                     do_length_normalization=True))
+
+    def test_ark_round_trip(self):
+        tf_idfs = []
+        for doc in ["zürich-1", "wien-2"]:
+            tf_idf = TFIDF()
+            tf_idf.tf_idf[(("grüß", "gott"), doc)] = 0.25
+            tf_idf.tf_idf[(("wien",), doc)] = 1.5
+            tf_idfs.append((doc, tf_idf))
+        for binary in [False, True]:
+            with tempfile.TemporaryFile('w+', encoding='utf-8') as f:
+                for doc, tf_idf in tf_idfs:
+                    write_tfidf_ark_key(f, doc, binary=binary)
+                    tf_idf.write(f, binary=binary)
+                f.seek(0)
+                read_tf_idfs = [(key, tf_idf.tf_idf)
+                                for key, tf_idf in read_tfidf_ark(f)]
+            self.assertEqual([(doc, tf_idf.tf_idf) for doc, tf_idf in tf_idfs],
+                             read_tf_idfs, "binary={0}".format(binary))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,6 +41,19 @@ except:
     sys.exit("make_biased_lms.py: error opening {0} to write utterance map".format(
             args.utterance_map))
 
+# All groups are processed by one make_one_biased_lm.py process in batch mode,
+# which reads the lines of each group, prefixed by the group utterance-id, and
+# writes the text-form archive of FSTs to the standard output.
+command = "steps/cleanup/internal/make_one_biased_lm.py --batch=true " + args.lm_opts
+try:
+    lm_process = subprocess.Popen(command, shell = True, stdin = subprocess.PIPE,
+                                  stdout = sys.stdout, stderr = sys.stderr)
+except Exception:
+    sys.stderr.write(
+        "make_biased_lms.py: error calling subprocess, command was: " +
+        command)
+    raise
+
 # This processes one group of input lines; 'group_of_lines' is
 # an array of lines of input integerized text, e.g.
 # [ 'utt1 67 89 432', 'utt2 89 48 62' ]
@@ -51,16 +64,10 @@ def ProcessGroupOfLines(group_of_lines):
     except:
         sys.exit("make_biased_lms.py: empty input line")
 
+    # the group utterance-id forms the name in the text-form archive.
     group_utterance_id = '{0}-group-of-{1}'.format(first_utterance_id, num_lines)
-    # print the group utterance-id to the stdout; it forms the name in
-    # the text-form archive.
-    print(group_utterance_id)
-    sys.stdout.flush()
 
     try:
-        command = "steps/cleanup/internal/make_one_biased_lm.py " + args.lm_opts
-        p = subprocess.Popen(command, shell = True, stdin = subprocess.PIPE,
-                             stdout = sys.stdout, stderr = sys.stderr)
         for line in group_of_lines:
             a = line.split()
             if len(a) == 0:
@@ -68,19 +75,14 @@ def ProcessGroupOfLines(group_of_lines):
             utterance_id = a[0]
             # print <utt> <utt-group> to utterance-map file
             print(utterance_id, group_utterance_id, file = utterance_map_file)
-            rest_of_line = ' '.join(a[1:]) + '\n' # get rid of utterance id.
-            p.stdin.write(rest_of_line.encode('utf-8'))
-        p.stdin.close()
-        assert p.wait() == 0
+            # replace the utterance id by the group utterance-id.
+            rest_of_line = ' '.join([group_utterance_id] + a[1:]) + '\n'
+            lm_process.stdin.write(rest_of_line.encode('utf-8'))
     except Exception:
         sys.stderr.write(
             "make_biased_lms.py: error calling subprocess, command was: " +
             command)
         raise
-    # Print a blank line; this terminates the FST in the Kaldi fst-archive
-    # format.
-    print("")
-    sys.stdout.flush()
 
 
 
@@ -100,6 +102,11 @@ while True:
     if line == '':
         break
 
+lm_process.stdin.close()
+if lm_process.wait() != 0:
+    sys.exit("make_biased_lms.py: error calling subprocess, command was: " +
+             command)
+utterance_map_file.close()
 
 # test comand [to be run from ../..]
 #
@@ -77,6 +77,13 @@ def generate_chain_egs(dir, data, lat_dir, egs_dir,
     See options in that script.
     """
 
+    # get_egs.sh runs a job per job of the lattices, at most --max-jobs-run
+    # (by default 15) at the same time
+    num_slots = common_lib.get_num_slots(
+        "{0} {1}".format(egs_opts if egs_opts is not None else '',
+                         run_opts.egs_command),
+        num_jobs=common_lib.get_number_of_jobs(lat_dir), max_jobs_run=15)
+
     common_lib.execute_command(
         """steps/nnet3/chain/get_egs.sh {egs_opts} \
                 --cmd "{command}" \
@@ -115,7 +122,8 @@ def generate_chain_egs(dir, data, lat_dir, egs_dir,
                     stage=stage, frames_per_iter=frames_per_iter,
                     frames_per_eg_str=frames_per_eg_str, srand=srand,
                     data=data, lat_dir=lat_dir, dir=dir, egs_dir=egs_dir,
-                    egs_opts=egs_opts if egs_opts is not None else ''))
+                    egs_opts=egs_opts if egs_opts is not None else ''),
+        num_slots=num_slots)
 
 
 def train_new_models(dir, iter, srand, num_jobs,
@@ -32,6 +32,11 @@ def generate_egs(data, alidir, egs_dir,
     the model final.mdl and alignments.
     """
 
+    # get_egs.sh runs --nj jobs (by default 6) at the same time
+    num_slots = common_lib.get_num_slots(
+        "{0} {1}".format(egs_opts if egs_opts is not None else '',
+                         run_opts.egs_command), num_jobs=6)
+
     common_lib.execute_command(
         """steps/nnet3/get_egs.sh {egs_opts} \
                 --cmd "{command}" \
@@ -58,7 +63,8 @@ def generate_egs(data, alidir, egs_dir,
                    stage=stage, samples_per_iter=samples_per_iter,
                    frames_per_eg_str=frames_per_eg_str, srand=srand, data=data,
                    alidir=alidir, egs_dir=egs_dir,
-                   egs_opts=egs_opts if egs_opts is not None else ''))
+                   egs_opts=egs_opts if egs_opts is not None else ''),
+        num_slots=num_slots)
 
 
 def prepare_initial_acoustic_model(dir, alidir, run_opts,
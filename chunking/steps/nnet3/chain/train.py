@@ -265,6 +265,8 @@ def process_args(args):
                             if args.egs_command is not None else
                             args.command)
 
+    common_train_lib.setup_job_scheduler(args)
+
     return [args, run_opts]
 
 
@@ -11,6 +11,7 @@ from __future__ import print_function
 
 import os
 import argparse
+import multiprocessing
 from collections import defaultdict
 
 import torch
@@ -146,7 +147,9 @@ def compute_sentence_score(model, criterion, ntokens, data, target,
         the last hidden state from the best hypothesis for an utterance.
     """
 
-    with torch.no_grad():
+    # torch.inference_mode() is faster than torch.no_grad(), but it only
+    # exists in PyTorch 1.9 or higher.
+    with getattr(torch, 'inference_mode', torch.no_grad)():
         if model_type == 'Transformer':
             output = model(data)
         else:
@@ -185,6 +188,9 @@ def compute_scores(args, sents, model, criterion, ntokens, vocab, model_type='LS
 
     # Turn on evaluation mode which disables dropout.
     model.eval()
+    if model_type == 'Transformer' and args.batch_size > 0:
+        return compute_scores_in_buckets(args, sents, model, criterion,
+                                         ntokens, vocab)
     sents_and_scores = defaultdict()
     for idx, key in enumerate(sents.keys()):
         batch_size = len(sents[key])
@@ -218,6 +224,107 @@ def compute_scores(args, sents, model, criterion, ntokens, vocab, model_type='LS
     return sents_and_scores
 
 
+def get_buckets(sents, batch_size):
+    r"""Group the hypotheses of all utterances into batches of hypotheses
+        of similar lengths.
+
+    Args:
+        sents:      Hypotheses for all utterances represented by a map from
+                    a string (utterance-id) to a list of strings.
+        batch_size: Maximum number of hypotheses in a batch.
+
+    Returns:
+        A list of batches, each of which is a list of (utterance-id, index)
+        pairs that identify hypotheses.
+    """
+
+    hyps = [(len(hyp.split()), key, idx) for key in sents.keys()
+            for idx, hyp in enumerate(sents[key])]
+    hyps.sort(key=lambda x: x[0])
+    return [[(key, idx) for _, key, idx in hyps[i:i + batch_size]]
+            for i in range(0, len(hyps), batch_size)]
+
+
+# The state of the worker processes of compute_scores_in_buckets().
+worker_state = {}
+
+
+def init_worker(args, sents, model, criterion, ntokens, vocab):
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    else:
+        # The worker processes share the cores.
+        torch.set_num_threads(1)
+    worker_state.update(args=args, sents=sents, model=model,
+                        criterion=criterion, ntokens=ntokens, vocab=vocab)
+
+
+def compute_bucket_scores(bucket):
+    r"""Compute the scores of the hypotheses of a batch from get_buckets()
+        with a Transformer model (the model and the other arguments are
+        taken from worker_state).
+
+    Returns:
+        A list of the scores (negative log-likelihood) of words of each
+        hypothesis in the batch.
+    """
+
+    s = worker_state
+    hyps = [s['sents'][key][idx] for key, idx in bucket]
+    data, targets, seq_lens = get_input_and_target(s['args'], hyps, s['vocab'])
+    scores = compute_sentence_score(s['model'], s['criterion'], s['ntokens'],
+                                    data, targets, 'Transformer')
+    return [scores[idx][:seq_lens[idx]] for idx in range(len(hyps))]
+
+
+def compute_scores_in_buckets(args, sents, model, criterion, ntokens, vocab):
+    r"""Compute Transformer language model scores of hypotheses for all
+        utterances, in batches of up to args.batch_size hypotheses of similar
+        lengths taken from any utterances (which is possible because there is
+        no hidden state carried over from one utterance to the next).
+        With args.num_workers > 1 the batches are computed by that many
+        processes.
+
+    Args:
+        sents:      Hypotheses for all utterances represented by a map from
+                    a string (utterance-id) to a list of strings.
+        model:      A Transformer language model.
+        criterion:  Training criterion of the neural language model, e.g.
+                    cross entropy.
+        ntokens:    Vocabulary size.
+
+    Returns:
+        The hypotheses and corresponding neural language model scores for all
+        utterances, like compute_scores().
+    """
+
+    buckets = get_buckets(sents, args.batch_size)
+    init_args = (args, sents, model, criterion, ntokens, vocab)
+    if args.num_workers > 1:
+        pool = multiprocessing.Pool(args.num_workers, initializer=init_worker,
+                                    initargs=init_args)
+        bucket_scores = pool.imap(compute_bucket_scores, buckets)
+    else:
+        pool = None
+        worker_state.update(args=args, sents=sents, model=model,
+                            criterion=criterion, ntokens=ntokens, vocab=vocab)
+        bucket_scores = map(compute_bucket_scores, buckets)
+
+    scores = {}
+    for bucket, scores_of_bucket in zip(buckets, bucket_scores):
+        for hyp_id, hyp_scores in zip(bucket, scores_of_bucket):
+            scores[hyp_id] = hyp_scores
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    sents_and_scores = defaultdict()
+    for key in sents.keys():
+        sents_and_scores[key] = [(hyp, scores[(key, idx)])
+                                 for idx, hyp in enumerate(sents[key])]
+    return sents_and_scores
+
+
 def write_scores(sents_and_scores, path):
     r"""Write out neural language model scores for all hypotheses in the
         following format:
@@ -270,11 +377,28 @@ def main():
                         help='Out of vocabulary word.')
     parser.add_argument('--sent-boundary', type=str, default='<s>',
                         help='Sentence boundary symbol.')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help='For Transformer models, the maximum number of '
+                        'hypotheses, of similar lengths but from any '
+                        'utterances, that are scored in one batch. If 0, '
+                        'the hypotheses of each utterance form a batch. '
+                        'Recurrent models always use the latter, because the '
+                        'hidden state is carried over between utterances.')
+    parser.add_argument('--num-workers', type=int, default=1,
+                        help='Number of processes that score the batches '
+                        'with --batch-size > 0.')
+    parser.add_argument('--num-threads', type=int, default=0,
+                        help='Number of threads used by PyTorch (per process '
+                        'with --num-workers > 1). If 0, the PyTorch default '
+                        'is used, or 1 per process with --num-workers > 1.')
     args = parser.parse_args()
     assert os.path.exists(args.infile), "Path for input word sequences does not exist."
     assert os.path.exists(args.vocabulary), "Vocabulary path does not exist."
     assert os.path.exists(args.model_path), "Model path does not exist."
 
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+
     print("Load vocabulary.")
     vocab = read_vocab(args.vocabulary)
     ntokens = len(vocab)
@@ -6,7 +6,7 @@
 
 """
 This script converts frame-level speech activity detection marks (in kaldi
-integer vector text archive format) into kaldi segments and utt2spk.
+integer vector archive format, binary or text) into kaldi segments and utt2spk.
 The input integer vectors are expected to contain '1' for silence frames
 and '2' for speech frames.
 """
@@ -14,6 +14,7 @@ and '2' for speech frames.
 from __future__ import print_function
 import argparse
 import logging
+import numpy as np
 import sys
 
 sys.path.insert(0, 'steps')
@@ -35,7 +36,7 @@ def get_args():
     parser = argparse.ArgumentParser(
         description="""
 This script converts frame-level speech activity detection marks (in kaldi
-integer vector text archive format) into kaldi segments and utt2spk.
+integer vector archive format, binary or text) into kaldi segments and utt2spk.
 The input integer vectors are expected to contain 1 for silence frames
 and 2 for speech frames.
 """,
@@ -69,7 +70,7 @@ and 2 for speech frames.
 
     parser.add_argument("in_sad", type=str,
                         help="Input file containing alignments in "
-                             "text archive format")
+                             "binary or text archive format")
 
     parser.add_argument("out_segments", type=str,
                         help="Output kaldi segments file")
@@ -151,42 +152,45 @@ def process_label(text_label):
     return prev_label
 
 
+def _accumulate(initial, values):
+    """Returns the sum of 'initial' and the elements of 'values' added one
+    at a time in order, which (unlike numpy.sum()) gives the same result as
+    accumulating them in a python loop."""
+    return float(np.add.accumulate(np.append(initial, values))[-1])
+
+
 class Segmentation(object):
     """Stores segmentation for an utterances"""
 
     def __init__(self):
+        # A (num-segments x 2) array of segment start and end times.
         self.segments = None
         self.stats = SegmenterStats()
 
     def initialize_segments(self, alignment, frame_shift=0.01):
         """Initializes segments from input alignment.
         The alignment is frame-level speech-activity detection marks,
-        each of which must be 1 or 2."""
-        self.segments = []
-
+        each of which must be 1 or 2.  It is converted to segments by
+        run-length encoding the whole vector at once."""
+        alignment = np.asarray(alignment, dtype=np.int32)
         assert len(alignment) > 0
 
-        prev_label = None
-        prev_length = 0
-        for i, text_label in enumerate(alignment):
-            if prev_label is not None and int(text_label) != prev_label:
-                if prev_label == 2:
-                    self.segments.append(
-                        [float(i - prev_length) * frame_shift,
-                         float(i) * frame_shift, prev_label])
-                    self.stats.initial_duration += (prev_length * frame_shift)
-                prev_label = process_label(text_label)
-                prev_length = 0
-            elif prev_label is None:
-                prev_label = process_label(text_label)
-
-            prev_length += 1
-
-        if prev_length > 0 and prev_label == 2:
-            self.segments.append(
-                [float(len(alignment) - prev_length) * frame_shift,
-                 float(len(alignment)) * frame_shift, prev_label])
-            self.stats.initial_duration += (prev_length * frame_shift)
+        bad_labels = (alignment != 1) & (alignment != 2)
+        if np.any(bad_labels):
+            process_label(alignment[np.argmax(bad_labels)])
+
+        # Indexes of the frames where a new run of labels begins.
+        run_starts = np.concatenate(
+            ([0], np.flatnonzero(alignment[1:] != alignment[:-1]) + 1))
+        run_ends = np.append(run_starts[1:], len(alignment))
+        speech_runs = alignment[run_starts] == 2
+
+        self.segments = np.stack(
+            (run_starts[speech_runs].astype(np.float64) * frame_shift,
+             run_ends[speech_runs].astype(np.float64) * frame_shift), axis=1)
+        self.stats.initial_duration = _accumulate(
+            self.stats.initial_duration,
+            (run_ends - run_starts)[speech_runs] * frame_shift)
 
         self.stats.num_segments_initial = len(self.segments)
         self.stats.num_segments_final = len(self.segments)
@@ -197,16 +201,12 @@ class Segmentation(object):
         if min_dur <= 0:
             return
 
-        segments_kept = []
-        for segment in self.segments:
-            assert segment[2] == 2, segment
-            dur = segment[1] - segment[0]
-            if dur < min_dur:
-                self.stats.filter_short_duration += dur
-                self.stats.num_short_segments_filtered += 1
-            else:
-                segments_kept.append(segment)
-        self.segments = segments_kept
+        durs = self.segments[:, 1] - self.segments[:, 0]
+        is_short = durs < min_dur
+        self.stats.filter_short_duration = _accumulate(
+            self.stats.filter_short_duration, durs[is_short])
+        self.stats.num_short_segments_filtered += int(np.sum(is_short))
+        self.segments = self.segments[~is_short]
         self.stats.num_segments_final = len(self.segments)
         self.stats.final_duration -= self.stats.filter_short_duration
 
@@ -216,58 +216,88 @@ class Segmentation(object):
         or the duration of the utterance 'max_duration'."""
         if max_duration == None:
             max_duration = float("inf")
-        for i, segment in enumerate(self.segments):
-            assert segment[2] == 2, segment
-            segment[0] -= segment_padding  # try adding padding on the left side
-            self.stats.padding_duration += segment_padding
-            if segment[0] < 0.0:
-                # Padding takes the segment start to before the beginning of the utterance.
-                # Reduce padding.
-                self.stats.padding_duration += segment[0]
-                segment[0] = 0.0
-            if i >= 1 and self.segments[i - 1][1] > segment[0]:
-                # Padding takes the segment start to before the end the previous segment.
-                # Reduce padding.
-                self.stats.padding_duration -= (
-                        self.segments[i - 1][1] - segment[0])
-                segment[0] = self.segments[i - 1][1]
-
-            segment[1] += segment_padding
-            self.stats.padding_duration += segment_padding
-            if segment[1] >= max_duration:
-                # Padding takes the segment end beyond the max duration of the utterance.
-                # Reduce padding.
-                self.stats.padding_duration -= (segment[1] - max_duration)
-                segment[1] = max_duration
-            if (i + 1 < len(self.segments)
-                    and segment[1] > self.segments[i + 1][0]):
-                # Padding takes the segment end beyond the start of the next segment.
-                # Reduce padding.
-                self.stats.padding_duration -= (
-                        segment[1] - self.segments[i + 1][0])
-                segment[1] = self.segments[i + 1][0]
+        num_segments = len(self.segments)
+        if num_segments == 0:
+            return
+        starts = self.segments[:, 0]
+        ends = self.segments[:, 1]
+        next_starts = np.append(starts[1:], np.inf)
+
+        # The padded end of a segment only depends on the unpadded start
+        # of the next segment, and the padded start of a segment on the
+        # padded end of the previous one; so pad the ends first.
+        padded_ends = ends + segment_padding
+        beyond_max = padded_ends >= max_duration
+        # Padding takes the segment end beyond the max duration of the
+        # utterance.
+        end_max_terms = np.where(beyond_max, padded_ends - max_duration, 0.0)
+        padded_ends = np.where(beyond_max, max_duration, padded_ends)
+        # Padding takes the segment end beyond the start of the next segment.
+        beyond_next = padded_ends > next_starts
+        end_next_terms = np.where(beyond_next, padded_ends - next_starts, 0.0)
+        padded_ends = np.where(beyond_next, next_starts, padded_ends)
+
+        padded_starts = starts - segment_padding
+        # Padding takes the segment start to before the beginning of the
+        # utterance.
+        before_zero = padded_starts < 0.0
+        start_zero_terms = np.where(before_zero, padded_starts, 0.0)
+        padded_starts = np.where(before_zero, 0.0, padded_starts)
+        # Padding takes the segment start to before the end of the previous
+        # segment.
+        prev_ends = np.insert(padded_ends[:-1], 0, -np.inf)
+        before_prev = prev_ends > padded_starts
+        start_prev_terms = np.where(before_prev, prev_ends - padded_starts, 0.0)
+        padded_starts = np.where(before_prev, prev_ends, padded_starts)
+
+        # The padding duration is accumulated in the same order as the
+        # segments are padded, so that the stats are not affected by
+        # rounding.
+        padding = np.full(num_segments, segment_padding)
+        terms = np.stack((padding, start_zero_terms, -start_prev_terms,
+                          padding, -end_max_terms, -end_next_terms), axis=1)
+        self.stats.padding_duration = _accumulate(
+            self.stats.padding_duration, terms.ravel())
+
+        self.segments = np.stack((padded_starts, padded_ends), axis=1)
         self.stats.final_duration += self.stats.padding_duration
 
     def merge_consecutive_segments(self, max_dur):
         """Merge consecutive segments (happens after padding), provided that
         the merged segment is no longer than 'max_dur'."""
-        if max_dur <= 0 or not self.segments:
+        if max_dur <= 0 or len(self.segments) == 0:
             return
 
-        merged_segments = [self.segments[0]]
-        for segment in self.segments[1:]:
-            assert segment[2] == 2, segment
-            if segment[0] == merged_segments[-1][1] and \
-                    segment[1] - merged_segments[-1][0] <= max_dur:
-                # The segment starts at the same time the last segment ends,
-                # and the merged segment is shorter than 'max_dur'.
-                # Extend the previous segment.
-                merged_segments[-1][1] = segment[1]
-                self.stats.num_merges += 1
-            else:
-                merged_segments.append(segment)
-
-        self.segments = merged_segments
+        starts = self.segments[:, 0]
+        ends = self.segments[:, 1]
+        num_segments = len(self.segments)
+        # Segment i + 1 starts at the same time as segment i ends;
+        # run_ends[i] is the last segment of the touching run containing i.
+        touching = starts[1:] == ends[:-1]
+        breaks = np.append(np.flatnonzero(~touching), num_segments - 1)
+        run_ends = breaks[np.searchsorted(breaks, np.arange(num_segments))]
+
+        if max_dur == float("inf"):
+            first_segments = np.insert(breaks[:-1] + 1, 0, 0)
+        else:
+            # Within a run, a merged segment extends until the next
+            # segment would make it longer than 'max_dur'.
+            first_segments = []
+            i = 0
+            while i < num_segments:
+                first_segments.append(i)
+                run_end = run_ends[i]
+                too_long = ends[i + 1:run_end + 1] - starts[i] > max_dur
+                if np.any(too_long):
+                    i += 1 + int(np.argmax(too_long))
+                else:
+                    i = run_end + 1
+            first_segments = np.array(first_segments, dtype=np.int64)
+
+        last_segments = np.append(first_segments[1:] - 1, num_segments - 1)
+        self.segments = np.stack(
+            (starts[first_segments], ends[last_segments]), axis=1)
+        self.stats.num_merges += num_segments - len(self.segments)
         self.stats.num_segments_final = len(self.segments)
 
     def write(self, key, file_handle):
@@ -298,18 +328,11 @@ def run(args):
     global_stats = SegmenterStats()
     with common_lib.smart_open(args.in_sad) as in_sad_fh, \
             common_lib.smart_open(args.out_segments, 'w') as out_segments_fh:
-        for line in in_sad_fh:
-            parts = line.strip().split()
-            utt_id = parts[0]
-
-            if len(parts) < 2:
-                raise RuntimeError("Unable to parse line '{0}' in {1}"
-                                   "".format(line.strip(),
-                                             in_sad_fh))
-
+        for utt_id, alignment in common_lib.read_vec_int_ark_numpy(
+                in_sad_fh):
             segmentation = Segmentation()
             segmentation.initialize_segments(
-                parts[1:], args.frame_shift)
+                alignment, args.frame_shift)
             segmentation.filter_short_segments(args.min_segment_dur)
             segmentation.pad_speech_segments(args.segment_padding,
                                              None if args.utt2dur is None
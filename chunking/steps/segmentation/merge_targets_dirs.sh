@@ -85,7 +85,7 @@ done
 fdir=`perl -e '($dir,$pwd)= @ARGV; if($dir!~m:^/:) { $dir = "$pwd/$dir"; } print $dir; ' $dir ${PWD}`
 
 $cmd JOB=1:$nj $dir/log/merge_targets.JOB.log \
-  paste-feats "${targets_rspecifiers[@]}" ark,t:- \| \
+  paste-feats "${targets_rspecifiers[@]}" ark:- \| \
   steps/segmentation/internal/merge_targets.py --weights="$weights" \
     --remove-mismatch-frames=$remove_mismatch_frames - - \| \
   copy-feats ark,t:- ark,scp:$fdir/targets.JOB.ark,$fdir/targets.JOB.scp || exit 1
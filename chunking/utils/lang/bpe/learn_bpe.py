@@ -13,8 +13,8 @@ Proceedings of the 54th Annual Meeting of the Association for Computational Ling
 """
 
 import sys
-import re
-import copy
+import time
+import heapq
 import argparse
 from collections import defaultdict, Counter
 
@@ -64,122 +64,101 @@ def get_vocabulary(fobj, is_dict=False):
                     vocab[word] += 1
     return vocab
 
-def update_pair_statistics(pair, changed, stats, indices):
-    """Minimally update the indices and frequency of symbol pairs
+class PairKey(object):
+    """Key of a symbol pair in the heap of pairs (see pop_most_frequent_pair()):
+    pairs with the same frequency are ordered so that the largest pair of
+    strings comes first, like in max(stats, key=lambda x: (stats[x], x))"""
 
-    if we merge a pair of symbols, only pairs that overlap with occurrences
-    of this pair are affected, and need to be updated.
-    """
-    stats[pair] = 0
-    indices[pair] = defaultdict(int)
-    first, second = pair
-    new_pair = first+second
-    for j, word, old_word, freq in changed:
+    __slots__ = ('strings', 'ids')
 
-        # find all instances of pair, and update frequency/indices around it
-        i = 0
-        while True:
-            # find first symbol
-            try:
-                i = old_word.index(first, i)
-            except ValueError:
-                break
-            # if first symbol is followed by second symbol, we've found an occurrence of pair (old_word[i:i+2])
-            if i < len(old_word)-1 and old_word[i+1] == second:
-                # assuming a symbol sequence "A B C", if "B C" is merged, reduce the frequency of "A B"
-                if i:
-                    prev = old_word[i-1:i+1]
-                    stats[prev] -= freq
-                    indices[prev][j] -= 1
-                if i < len(old_word)-2:
-                    # assuming a symbol sequence "A B C B", if "B C" is merged, reduce the frequency of "C B".
-                    # however, skip this if the sequence is A B C B C, because the frequency of "C B" will be reduced by the previous code block
-                    if old_word[i+2] != first or i >= len(old_word)-3 or old_word[i+3] != second:
-                        nex = old_word[i+1:i+3]
-                        stats[nex] -= freq
-                        indices[nex][j] -= 1
-                i += 2
-            else:
-                i += 1
+    def __init__(self, strings, ids):
+        self.strings = strings
+        self.ids = ids
 
-        i = 0
-        while True:
-            try:
-                # find new pair
-                i = word.index(new_pair, i)
-            except ValueError:
-                break
-            # assuming a symbol sequence "A BC D", if "B C" is merged, increase the frequency of "A BC"
-            if i:
-                prev = word[i-1:i+1]
-                stats[prev] += freq
-                indices[prev][j] += 1
-            # assuming a symbol sequence "A BC B", if "B C" is merged, increase the frequency of "BC B"
-            # however, if the sequence is A BC BC, skip this step because the count of "BC BC" will be incremented by the previous code block
-            if i < len(word)-1 and word[i+1] != new_pair:
-                nex = word[i:i+2]
-                stats[nex] += freq
-                indices[nex][j] += 1
-            i += 1
-
-
-def get_pair_statistics(vocab):
-    """Count frequency of all symbol pairs, and create index"""
+    def __lt__(self, other):
+        return self.strings > other.strings
+
+
+def get_pair_statistics(words, freqs):
+    """Count frequency of all symbol pairs, and create index from pairs to the
+    (indexes of the) words that contain them"""
 
     # data structure of pair frequencies
     stats = defaultdict(int)
 
     #index from pairs to words
-    indices = defaultdict(lambda: defaultdict(int))
+    index = defaultdict(set)
 
-    for i, (word, freq) in enumerate(vocab):
-        prev_char = word[0]
-        for char in word[1:]:
-            stats[prev_char, char] += freq
-            indices[prev_char, char][i] += 1
-            prev_char = char
+    for j, word in enumerate(words):
+        freq = freqs[j]
+        for pair in zip(word, word[1:]):
+            stats[pair] += freq
+            index[pair].add(j)
 
-    return stats, indices
+    return stats, index
 
 
-def replace_pair(pair, vocab, indices):
-    """Replace all occurrences of a symbol pair ('A', 'B') with a new symbol 'AB'"""
-    first, second = pair
-    pair_str = ''.join(pair)
-    pair_str = pair_str.replace('\\','\\\\')
-    changes = []
-    pattern = re.compile(r'(?<!\S)' + re.escape(first + ' ' + second) + r'(?!\S)')
-    if sys.version_info < (3, 0):
-        iterator = indices[pair].iteritems()
-    else:
-        iterator = indices[pair].items()
-    for j, freq in iterator:
-        if freq < 1:
-            continue
-        word, freq = vocab[j]
-        new_word = ' '.join(word)
-        new_word = pattern.sub(pair_str, new_word)
-        new_word = tuple(new_word.split(' '))
-
-        vocab[j] = (new_word, freq)
-        changes.append((j, new_word, word, freq))
-
-    return changes
-
-def prune_stats(stats, big_stats, threshold):
-    """Prune statistics dict for efficiency of max()
-
-    The frequency of a symbol pair never increases, so pruning is generally safe
-    (until we the most frequent pair is less frequent than a pair we previously pruned)
-    big_stats keeps full statistics for when we need to access pruned items
+def merge_pair(pair, new_symbol, words, freqs, stats, index):
+    """Replace all occurrences of the symbol pair pair = (A, B) by the symbol
+    new_symbol = AB, and update the frequencies and the index of the pairs
+
+    Only the words that contain the pair are visited.  Returns the set of
+    pairs whose frequency increased; the pairs whose frequency drops to zero
+    are removed from the statistics and the index.
     """
-    for item,freq in list(stats.items()):
-        if freq < threshold:
-            del stats[item]
-            if freq < 0:
-                big_stats[item] += freq
+    first, second = pair
+    increased = set()
+    for j in index.pop(pair):
+        word = words[j]
+        freq = freqs[j]
+        new_word = []
+        i = 0
+        while i < len(word):
+            if word[i] == first and i < len(word)-1 and word[i+1] == second:
+                new_word.append(new_symbol)
+                i += 2
             else:
-                big_stats[item] = freq
+                new_word.append(word[i])
+                i += 1
+        words[j] = new_word
+
+        deltas = defaultdict(int)
+        for other_pair in zip(word, word[1:]):
+            deltas[other_pair] -= 1
+        new_pairs = set(zip(new_word, new_word[1:]))
+        for other_pair in zip(new_word, new_word[1:]):
+            deltas[other_pair] += 1
+        for other_pair, delta in deltas.items():
+            if delta > 0:
+                stats[other_pair] += freq * delta
+                increased.add(other_pair)
+                index[other_pair].add(j)
+            elif delta < 0:
+                stats[other_pair] += freq * delta
+                if stats[other_pair] == 0:
+                    del stats[other_pair]
+                    index.pop(other_pair, None)
+                elif not other_pair in new_pairs and other_pair != pair:
+                    index[other_pair].discard(j)
+
+    return increased
+
+
+def pop_most_frequent_pair(heap, stats):
+    """Remove the most frequent pair from the heap and return its key (or
+    None if there are no pairs left).  The frequencies in the heap are upper
+    bounds: a new entry is pushed when the frequency of a pair increases,
+    but when it decreases the entry is only updated once it reaches the
+    top of the heap."""
+
+    while heap:
+        neg_freq, key = heapq.heappop(heap)
+        freq = stats.get(key.ids, 0)
+        if freq == -neg_freq:
+            return key
+        elif 0 < freq < -neg_freq:
+            heapq.heappush(heap, (-freq, key))
+    return None
 
 
 def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False):
@@ -194,35 +173,50 @@ def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=F
     vocab = dict([(tuple(x[:-1])+(x[-1]+'</w>',) ,y) for (x,y) in vocab.items()])
     sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
 
-    stats, indices = get_pair_statistics(sorted_vocab)
-    big_stats = copy.deepcopy(stats)
-    # threshold is inspired by Zipfian assumption, but should only affect speed
-    threshold = max(stats.values()) / 10
+    # the words are stored as lists of integer symbol ids.  Merges that
+    # produce the same string (e.g. 'ab c' and 'a bc') produce the same symbol.
+    symbols = []
+    symbol_to_id = {}
+    def get_symbol_id(symbol):
+        if not symbol in symbol_to_id:
+            symbol_to_id[symbol] = len(symbols)
+            symbols.append(symbol)
+        return symbol_to_id[symbol]
+
+    words = [[get_symbol_id(symbol) for symbol in word] for word, freq in sorted_vocab]
+    freqs = [freq for word, freq in sorted_vocab]
+    del vocab, sorted_vocab
+
+    stats, index = get_pair_statistics(words, freqs)
+
+    # heap of (-frequency, key) for the pairs, so the most frequent pair is
+    # at the top.
+    def heap_entry(pair):
+        return (-stats[pair], PairKey((symbols[pair[0]], symbols[pair[1]]), pair))
+    heap = [heap_entry(pair) for pair in stats]
+    heapq.heapify(heap)
+
+    start_time = time.time()
     for i in range(num_symbols):
-        if stats:
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
-
-        # we probably missed the best pair because of pruning; go back to full statistics
-        if not stats or (i and stats[most_frequent] < threshold):
-            prune_stats(stats, big_stats, threshold)
-            stats = copy.deepcopy(big_stats)
-            most_frequent = max(stats, key=lambda x: (stats[x], x))
-            # threshold is inspired by Zipfian assumption, but should only affect speed
-            threshold = stats[most_frequent] * i/(i+10000.0)
-            prune_stats(stats, big_stats, threshold)
-
-        if stats[most_frequent] < min_frequency:
+        key = pop_most_frequent_pair(heap, stats)
+        if key is None or stats[key.ids] < min_frequency:
             sys.stderr.write('no pair has frequency >= {0}. Stopping\n'.format(min_frequency))
             break
+        most_frequent = key.strings
+        freq = stats[key.ids]
 
         if verbose:
-            sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], stats[most_frequent]))
+            sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], freq))
         outfile.write('{0} {1}\n'.format(*most_frequent))
-        changes = replace_pair(most_frequent, sorted_vocab, indices)
-        update_pair_statistics(most_frequent, changes, stats, indices)
-        stats[most_frequent] = 0
-        if not i % 100:
-            prune_stats(stats, big_stats, threshold)
+        increased = merge_pair(key.ids, get_symbol_id(most_frequent[0] + most_frequent[1]),
+                               words, freqs, stats, index)
+        for pair in increased:
+            if pair in stats:
+                heapq.heappush(heap, heap_entry(pair))
+
+        if (i + 1) % 1000 == 0:
+            sys.stderr.write('learn_bpe.py: learned {0} merges in {1:.1f} seconds, the last one '
+                             'with frequency {2}\n'.format(i + 1, time.time() - start_time, freq))
 
 
 if __name__ == '__main__':
@@ -11,6 +11,9 @@
 # Begin configuration section
 separator="@@"
 glossaries=
+nj=1          # number of processes used by apply_bpe.py
+cache_file=   # if set, file in which apply_bpe.py keeps the segmentations of
+              # the words, to reuse them in later runs with the same codes.
 # End configuration section
 
 . utils/parse_options.sh
@@ -22,6 +25,8 @@ if [ $# -ne 3 ]; then
   echo "e.g.: utils/prepare_subword_text.sh data/train/text data/local/pair_code.txt data/train/text_subword"
   echo "    --seperator <separator>         # default: @@"
   echo "    --glossaries <reserved-words>   # glossaries are words reserved"
+  echo "    --nj <nj>                       # number of parallel jobs, default: 1"
+  echo "    --cache-file <file>             # file with cached word segmentations"
   exit 1;
 fi
 
@@ -35,8 +40,10 @@ grep -q $separator $word_text && echo "$0: Error, word text file contains separa
 
 glossaries_opt=
 [ -z $glossaires ] && glossaries_opt="--glossaries $glossaries"
+bpe_opts="--jobs $nj"
+[ ! -z "$cache_file" ] && bpe_opts="$bpe_opts --cache-file $cache_file"
 cut -d ' ' -f2- $word_text | \
-  python3 utils/lang/bpe/apply_bpe.py -c $pair_code --separator $separator $glossaires_opt > ${word_text}.sub
+  python3 utils/lang/bpe/apply_bpe.py -c $pair_code --separator $separator $glossaires_opt $bpe_opts > ${word_text}.sub
   if [ $word_text == $subword_text ]; then
     mv $word_text ${word_text}.old
     cut -d ' ' -f1 ${word_text}.old | paste -d ' ' - ${word_text}.sub > $subword_text
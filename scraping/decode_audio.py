@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Decodes the recordings of a Kaldi data directory once into a cache of 16 kHz PCM WAV files.
+#
+# wav.scp entries of the form `<recording-id> ffmpeg -i <source> <options> - |` (as written by
+# parse_wienvideos.py) make every consumer of the data directory decode the m4a/mp4 files again.
+# This script runs each of these ffmpeg commands once, in parallel, with the output written to
+# <cache_dir>/<key[:2]>/<key>.wav instead of the pipe, and rewrites wav.scp to point at the cached
+# files. The key is the SHA-1 of the content of the source file and the ffmpeg options, so the
+# same recording is decoded only once and a changed source or changed options give a new file.
+#
+# The content hashes of the sources are stored with their size and modification time in
+# manifest.json in the cache directory, together with the original command and the cached file of
+# each recording of each data directory. Sources are only hashed again if their size or
+# modification time changed, and wav.scp entries that already point at cached files are checked
+# against the source of their own recording again on reruns. Outdated files are not removed, since
+# other data directories may still point at them.
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import json
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+import threading
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class DecodeError(Exception):
+    pass
+
+
+class DecodeCache:
+    """Decoded recordings in `cache_dir`, with the content hashes of their sources and the original
+    commands of the recordings in manifest.json."""
+
+    def __init__(self, cache_dir, ffmpeg="ffmpeg"):
+        self.cache_dir = Path(cache_dir).absolute()
+        self.ffmpeg = ffmpeg
+        self.path = self.cache_dir.joinpath("manifest.json")
+        self.lock = threading.Lock()
+        # Recordings with the same source and options are decoded by one thread
+        self.wav_locks = {}
+        # 'recordings' maps data directory -> recording-id -> {'command': ..., 'wav': ...}; several
+        # recordings may share one cached file, so the commands are kept per recording
+        self.entries = {'sources': {}, 'recordings': {}}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as manifest_file:
+                manifest = json.load(manifest_file)
+            for name in self.entries:
+                self.entries[name].update(manifest.get(name, {}))
+
+    def _save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def source_hash(self, source):
+        """SHA-1 of the content of `source`, hashed again only if its size or modification time changed."""
+        stat = os.stat(source)
+        with self.lock:
+            entry = self.entries['sources'].get(source)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha1']
+        sha1 = hashlib.sha1()
+        with open(source, 'rb') as source_file:
+            for block in iter(lambda: source_file.read(HASH_BLOCK_SIZE), b''):
+                sha1.update(block)
+        with self.lock:
+            self.entries['sources'][source] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                               'sha1': sha1.hexdigest()}
+        return sha1.hexdigest()
+
+    def wav_path(self, source, options):
+        """Path of the cached file of `source` decoded with the ffmpeg `options`."""
+        key = hashlib.sha1(self.source_hash(source).encode('ascii'))
+        key.update(json.dumps(options).encode('utf-8'))
+        key = key.hexdigest()
+        return self.cache_dir.joinpath(key[:2], key + ".wav")
+
+    def command_of(self, data_dir, recording_id, wav):
+        """The original wav.scp command of a recording whose entry `wav` was rewritten to its cached
+        file, or None if `wav` is not the cached file of this recording."""
+        with self.lock:
+            entry = self.entries['recordings'].get(data_dir, {}).get(recording_id)
+        if entry is not None and entry['wav'] == wav:
+            return entry['command']
+        return None
+
+    def decode(self, data_dir, recording_id, command):
+        """Returns the cached file for the wav.scp `command` of a recording, which is decoded first if it
+        is not cached."""
+        source, options = parse_ffmpeg_command(command)
+        wav_path = self.wav_path(source, options)
+        with self.lock:
+            wav_lock = self.wav_locks.setdefault(wav_path, threading.Lock())
+        with wav_lock:
+            self._decode(source, options, wav_path)
+        with self.lock:
+            self.entries['recordings'].setdefault(data_dir, {})[recording_id] = {'command': command,
+                                                                                'wav': str(wav_path)}
+        return wav_path
+
+    def _decode(self, source, options, wav_path):
+        if not wav_path.exists():
+            wav_path.parent.mkdir(parents=True, exist_ok=True)
+            # Decoded into <key>.tmp.wav and renamed when complete, so that interrupted runs are redone
+            tmp_path = wav_path.with_name(wav_path.stem + ".tmp.wav")
+            result = subprocess.run([self.ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", source]
+                                    + options + [str(tmp_path)],
+                                    stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                tmp_path.unlink(missing_ok=True)
+                raise DecodeError(f"ffmpeg failed on {source}: {result.stderr.decode(errors='replace').strip()}")
+            os.replace(tmp_path, wav_path)
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+
+def parse_ffmpeg_command(command):
+    """Splits a wav.scp entry `ffmpeg -i <source> <options> - |` into the absolute source path and the
+    options, or raises ValueError if it is not such a command."""
+    if not command.rstrip().endswith("|"):
+        raise ValueError(f"Not a piped command: {command}")
+    tokens = shlex.split(command.rstrip()[:-1])
+    if len(tokens) < 4 or Path(tokens[0]).name != "ffmpeg" or tokens[1] != "-i" or tokens[-1] != "-":
+        raise ValueError(f"Not an ffmpeg command of the form 'ffmpeg -i <source> ... - |': {command}")
+    return str(Path(tokens[2]).absolute()), tokens[3:-1]
+
+
+def cache_wav_scp(data_dir, cache_dir, jobs=1, ffmpeg="ffmpeg"):
+    """Decodes the ffmpeg commands in <data_dir>/wav.scp into `cache_dir` and rewrites wav.scp to
+    point at the cached files. Other entries are kept as they are."""
+    scp_path = Path(data_dir).joinpath("wav.scp")
+    data_dir = str(Path(data_dir).absolute())
+    cache = DecodeCache(cache_dir, ffmpeg)
+    entries = []
+    with open(scp_path, 'r', encoding='utf-8') as scp_file:
+        for line in scp_file:
+            recording_id, wav = line.rstrip("\n").split(maxsplit=1)
+            entries.append([recording_id, wav])
+
+    commands = {}
+    for index, (recording_id, wav) in enumerate(entries):
+        # Entries rewritten by an earlier run are checked against the source of their recording again
+        command = cache.command_of(data_dir, recording_id, wav) or wav
+        try:
+            parse_ffmpeg_command(command)
+        except ValueError:
+            continue
+        commands[index] = command
+
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(cache.decode, data_dir, entries[index][0], command): index
+                       for index, command in commands.items()}
+            for future in as_completed(futures):
+                index = futures[future]
+                # Raises the exception of a failed recording
+                entries[index][1] = str(future.result())
+        print(f"Cached {len(commands)} recordings of {scp_path}", file=sys.stderr)
+    finally:
+        # Keeps the hashes and the decoded files of the completed recordings even if one failed
+        cache.save()
+
+    tmp_path = scp_path.with_name(scp_path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as scp_file:
+        for recording_id, wav in entries:
+            scp_file.write(f"{recording_id} {wav}\n")
+    os.replace(tmp_path, scp_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decodes the ffmpeg commands in wav.scp of a Kaldi data "
+                                                 "directory into a cache of WAV files and rewrites wav.scp")
+    parser.add_argument("data_dir", type=str)
+    parser.add_argument("cache_dir", type=str)
+    parser.add_argument("--jobs", type=int, default=1, help="Number of recordings decoded in parallel")
+    parser.add_argument("--ffmpeg", type=str, default="ffmpeg", help="The ffmpeg executable")
+    args = parser.parse_args()
+    cache_wav_scp(args.data_dir, args.cache_dir, args.jobs, args.ffmpeg)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+
+# Download engine for the parliament crawlers (crawl_nationalrat.py, crawl_bundesrat.py).
+#
+# Requests run on a thread pool. Each thread keeps one HTTP keep-alive connection per host,
+# requests to the same host are spaced by a minimum interval, and failed requests are retried
+# with exponential backoff. Files are written to <file>.part and renamed when complete;
+# resumable downloads (the recordings) continue an existing .part file with a Range request.
+# Completed files and sessions are recorded in manifest.json in the output directory, so that
+# reruns skip them.
+#
+# The base URLs of the crawlers can be changed, so that they can be run against a local
+# stand-in server.
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import http.client
+import json
+import os
+from pathlib import Path
+import re
+import ssl
+import threading
+import time
+import urllib.parse
+
+BASE_URL = "https://www.parlament.gv.at"
+API_URL = "https://api.ausp.cloud.insysgo.com"
+UA_STRING = r"Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:83.0) Gecko/20100101 Firefox/83.0"
+MAX_REDIRECTS = 5
+
+
+class DownloadError(Exception):
+    pass
+
+
+class _TransientError(Exception):
+    """Errors worth retrying: server errors, rate limiting and truncated responses."""
+    pass
+
+
+class Manifest:
+    """Completed files (relative to the output directory) and sessions, stored as JSON."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.entries = {'files': {}, 'sessions': {}}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as manifest_file:
+                self.entries.update(json.load(manifest_file))
+
+    def is_done(self, section, key):
+        with self.lock:
+            return key in self.entries[section]
+
+    def mark_done(self, section, key, info):
+        with self.lock:
+            self.entries[section][key] = info
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as manifest_file:
+                json.dump(self.entries, manifest_file, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class RateLimiter:
+    """Spaces the requests to each host by at least `interval` seconds."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, host):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Downloader:
+    def __init__(self, output_dir, user_agent=UA_STRING, jobs=4, interval=1.0, retries=5, backoff=2.0,
+                 timeout=60, chunk_size=16 * 1024):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(exist_ok=True, parents=True)
+        self.manifest = Manifest(self.output_dir / "manifest.json")
+        self.user_agent = user_agent
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.rate_limiter = RateLimiter(interval)
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.ssl_context = ssl.create_default_context()
+        self.local = threading.local()
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def key(self, path):
+        return Path(path).relative_to(self.output_dir).as_posix()
+
+    def is_done(self, path):
+        return self.manifest.is_done('files', self.key(path)) and Path(path).exists()
+
+    def _connection(self, scheme, netloc):
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        connection = connections.get((scheme, netloc))
+        if connection is None:
+            if scheme == 'https':
+                connection = http.client.HTTPSConnection(netloc, timeout=self.timeout, context=self.ssl_context)
+            elif scheme == 'http':
+                connection = http.client.HTTPConnection(netloc, timeout=self.timeout)
+            else:
+                raise DownloadError(f"Unsupported URL scheme '{scheme}'")
+            connections[(scheme, netloc)] = connection
+        return connection
+
+    def _close_connections(self):
+        for connection in getattr(self.local, 'connections', {}).values():
+            connection.close()
+        self.local.connections = {}
+
+    def _headers(self, referer):
+        headers = {'User-Agent': self.user_agent}
+        if referer is not None:
+            headers['Referer'] = referer
+        return headers
+
+    def _request(self, url, headers):
+        """Sends a GET request on the keep-alive connection of this thread, following redirects.
+        The caller has to read the whole response before the connection can be reused."""
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            self.rate_limiter.wait(parts.netloc)
+            connection = self._connection(parts.scheme, parts.netloc)
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            location = response.getheader('Location')
+            if response.status in (301, 302, 303, 307, 308) and location is not None:
+                response.read()
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return response
+        raise DownloadError(f"Unable to request URL '{url}': too many redirects.")
+
+    def _check_status(self, response, url):
+        if response.status < 400:
+            return
+        response.read()
+        message = f"HTTP Error {response.status}: {response.reason}"
+        if response.status == 429 or response.status >= 500:
+            raise _TransientError(message)
+        raise DownloadError(f"Unable to request URL '{url}': {message}.")
+
+    def _retry(self, url, attempt):
+        for retry in range(self.retries + 1):
+            try:
+                return attempt()
+            except (OSError, http.client.HTTPException, _TransientError) as e:
+                if not isinstance(e, _TransientError):
+                    # The connection may be in an undefined state
+                    self._close_connections()
+                if retry == self.retries:
+                    raise DownloadError(f"Unable to request URL '{url}': {e}.") from e
+                delay = self.backoff * 2 ** retry
+                print(f"Unable to request URL '{url}': {e}. Retrying in {delay:.0f}s...")
+                time.sleep(delay)
+
+    def fetch(self, url, referer=None):
+        """Returns the content of `url`."""
+        def attempt():
+            response = self._request(url, self._headers(referer))
+            self._check_status(response, url)
+            return response.read()
+        return self._retry(url, attempt)
+
+    def download(self, url, path, referer=None, resume=False):
+        """Downloads `url` to `path` (in the output directory), unless the manifest has it already.
+        With `resume`, an interrupted download is continued where it stopped."""
+        path = Path(path)
+        key = self.key(path)
+        if self.is_done(path):
+            return
+        part_path = path.with_name(path.name + ".part")
+        if path.exists():
+            if not resume:
+                # Complete file from a crawl without manifest
+                self.manifest.mark_done('files', key, {'url': url, 'bytes': path.stat().st_size})
+                return
+            # Possibly truncated by a crawl without manifest; the Range request below tells
+            os.replace(path, part_path)
+
+        def attempt():
+            offset = part_path.stat().st_size if resume and part_path.exists() else 0
+            headers = self._headers(referer)
+            if offset > 0:
+                headers['Range'] = f"bytes={offset}-"
+            response = self._request(url, headers)
+            if response.status == 416 and offset > 0:
+                # Nothing left to download
+                response.read()
+                return offset
+            self._check_status(response, url)
+            if response.status != 206:
+                offset = 0
+            content_length = response.getheader('Content-Length')
+            with open(part_path, 'ab' if offset > 0 else 'wb') as part_file:
+                while True:
+                    chunk = response.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    part_file.write(chunk)
+            size = part_path.stat().st_size
+            if content_length is not None and size != offset + int(content_length):
+                self._close_connections()
+                raise _TransientError(f"incomplete download ({size - offset} of {content_length} bytes)")
+            return size
+
+        print(f"    requesting URL '{url}'" + (" (resuming)" if resume and part_path.exists() else ""))
+        size = self._retry(url, attempt)
+        os.replace(part_path, path)
+        self.manifest.mark_done('files', key, {'url': url, 'bytes': size})
+        print(f"    downloaded '{key}' ({size} bytes)")
+
+
+def find_recording_url(downloader, html, url_session, base_url=BASE_URL, api_url=API_URL):
+    """Follows the player link of a session page to the media API. Returns the URL of the recording
+    and the player URL (as referer), or (None, None) if the session has no recording."""
+    # Get player page to obtain session ID of recording
+    match = re.search(r'href="(/MEDIA/play.shtml\?[^\'" >]+)"', html)
+    if not match:
+        return None, None
+    url_player = base_url + match.group(1)
+    print(f"    requesting player URL '{url_player}'")
+    html_player = downloader.fetch(url_player, referer=url_session).decode('utf-8')
+    #a_uuid="cd6658d4-64ea-4479-b93c-24bb09a27616"
+    match = re.search(r'a_uuid="([^\'" >]+)"', html_player)
+    if not match:
+        return None, None
+    session_uuid = match.group(1)
+    try:
+        url_api = f"{api_url}/media/clean/{session_uuid}.mp4"
+        print(f"    requesting API URL '{url_api}'")
+        json_api = json.loads(downloader.fetch(url_api, referer=url_player).decode('utf-8'))
+    except DownloadError as e:
+        print(f"{e} Retrying...")
+        url_api = f"{api_url}/media/dirty/{session_uuid}.mp4"
+        print(f"    requesting API URL '{url_api}'")
+        json_api = json.loads(downloader.fetch(url_api, referer=url_player).decode('utf-8'))
+    return json_api.get('URL', None), url_player
+
+
+def crawl(downloader, session_ids, crawl_session, force=False):
+    """Crawls the sessions concurrently. crawl_session(session_id) fetches the pages of a session and
+    returns its downloads as (url, path, referer, resume) tuples, and whether the session is
+    complete once they are done. Complete sessions are skipped in later runs, unless `force`."""
+    sessions = {}
+    for session_id in session_ids:
+        if not force and downloader.manifest.is_done('sessions', session_id):
+            print(f"Skipping session {session_id}, it is complete")
+            continue
+        sessions[downloader.submit(crawl_session, session_id)] = session_id
+    pending = {}
+    for future in as_completed(sessions):
+        session_id = sessions[future]
+        try:
+            downloads, complete = future.result()
+        except DownloadError as e:
+            print(e)
+            continue
+        pending[session_id] = ([downloader.submit(downloader.download, *download) for download in downloads],
+                               complete)
+    for session_id in sorted(pending):
+        futures, complete = pending[session_id]
+        for future in futures:
+            try:
+                future.result()
+            except DownloadError as e:
+                print(e)
+                complete = False
+        if complete:
+            downloader.manifest.mark_done('sessions', session_id, {'files': len(futures)})
+    downloader.shutdown()
@@ -0,0 +1,643 @@
+# Text normalization shared by the parsers for the transcripts of the Austrian parliament
+# (parse_parlament.py) and the subtitles of the videos of the City of Vienna (parse_wienvideos.py).
+#
+# The rules are compiled once at import time. Abbreviations are replaced with one alternation
+# regex, rules that only apply to a few texts are skipped with a substring check, and character
+# replacements are collected into tables. The tables are applied with str.replace, which is a lot
+# faster than str.translate on non-ASCII text. Rules are only merged where the merged form gives
+# the same result as applying them one after another.
+
+import re
+import sys
+from verbalizer import verbalize, ORDINAL, YEAR
+
+ALPHABETISMS = [
+    'COVID',
+    'NEOS',
+    'TOP',
+    'ARBÖ',
+    'APA',
+    'ZIB',
+    'TÜV',
+    'ARGE',   # Arbeitsgemeinschaft
+    'JETZT',  # Political party, now defunct
+    'UNO',
+    'GIS',
+    'WLAN',  # Eigentlich: W LAN
+    'HAK',
+    'DAX',
+    'BIP',
+    'EIRAG',
+    'EULAK',
+    'OPEC',
+    'AMA',
+    'UNESCO',
+    'EIWOG',
+    'NÖN',
+    'PROGE',
+    'AUA',
+    'DIN',  # DIN A4
+    'NATO'
+]
+
+# The subtitles of the videos of the City of Vienna contain a lot more words in upper case
+WIENVIDEOS_ALPHABETISMS = ALPHABETISMS + [
+    'EURO',
+    'FARE',
+    'SORA',
+    'LED',
+    'CLUB',
+    'WIEN',
+    'ART',
+    'FEM',
+    'HOTEL',
+    'HOERBIGER',
+    'LIFE',
+    'LIFE+',
+    'RELAX',
+    'MAG',
+    'IIASA',
+    'IST',
+    'DAS',
+    'AUDIO',
+    'MUSA',
+    'NEU',
+    'IBIS',
+    'VIDEO',
+    'CON',
+    'ULF',
+    'MUT',
+    'AIDS',
+    'IVECO',
+    'ALEELA',
+    'ALEEL',
+    'SOKO',
+    'MENA',
+    'DIESE',
+    'NGOS',
+    'EUROKEY',
+    'TEST',
+    'ON',
+    'OFF',
+    'PISA',
+    'DER',
+    'MAG',
+    'ELF',
+    'MANNER',
+    'SIMS',
+    'ZOOM',
+    'ELEMU',
+    'DO', 'RE', 'MI', 'FA', 'SOL', 'LA', 'TI'
+]
+
+expand_words = {
+    'km': 'k m',
+    'kg': 'k g',
+    'kw': 'k w',
+    'ca': 'circa',
+    'va': 'vor allem',
+    'nb': 'n b',
+    'st': 'sankt',
+    'm2': 'quadratmeter'
+}
+
+# Define digit mapping
+romanNumeralMap = (('M', 1000),
+                   ('CM', 900),
+                   ('D', 500),
+                   ('CD', 400),
+                   ('C', 100),
+                   ('XC', 90),
+                   ('L', 50),
+                   ('XL', 40),
+                   ('X', 10),
+                   ('IX', 9),
+                   ('V', 5),
+                   ('IV', 4),
+                   ('I', 1))
+
+# Define pattern to detect valid Roman numerals
+romanNumeralPattern = re.compile("""
+    ^                   # beginning of string
+    M{0,4}              # thousands - 0 to 4 M's
+    (CM|CD|D?C{0,3})    # hundreds - 900 (CM), 400 (CD), 0-300 (0 to 3 C's),
+                        #            or 500-800 (D, followed by 0 to 3 C's)
+    (XC|XL|L?X{0,3})    # tens - 90 (XC), 40 (XL), 0-30 (0 to 3 X's),
+                        #        or 50-80 (L, followed by 0 to 3 X's)
+    (IX|IV|V?I{0,3})    # ones - 9 (IX), 4 (IV), 0-3 (0 to 3 I's),
+                        #        or 5-8 (V, followed by 0 to 3 I's)
+    $                   # end of string
+    """, re.VERBOSE)
+
+
+def fromRoman(s):
+    """convert Roman numeral to integer"""
+    # special case
+    if s == 'N':
+        return 0
+    if not romanNumeralPattern.search(s):
+        return None
+    result = 0
+    index = 0
+    for numeral, integer in romanNumeralMap:
+        while s[index:index + len(numeral)] == numeral:
+            result += integer
+            index += len(numeral)
+    return result
+
+
+def timestamp_to_seconds(time_code: str) -> float:
+    hours = float(time_code[0:2])
+    minutes = float(time_code[3:5])
+    seconds = float(time_code[6:8])
+    return (hours*60*60)+(minutes*60)+seconds
+
+
+class Replacements:
+    """Replaces several strings in a single pass, using one alternation regex.
+
+    At every position the first string that matches wins. This is the same as replacing the
+    strings one after another as long as they cannot overlap and no replacement creates a match
+    for a later string.
+    """
+
+    def __init__(self, replacements):
+        self.replacements = dict(replacements)
+        # No groups, so that the regex engine can still skip ahead to the first characters
+        self.regex = re.compile('|'.join(re.escape(old) for old in self.replacements))
+
+    def _replace(self, match):
+        return self.replacements[match.group(0)]
+
+    def __call__(self, text):
+        return self.regex.sub(self._replace, text)
+
+
+# Paragraphs, sections and amounts, most specific rule first. These depend on each other, so they
+# are applied one after another, but only if the text contains the string that all matches start
+# with. Most paragraphs contain none of them.
+_LAW_REFERENCES = [
+    ("§", re.compile(r"§+\s(\d+)(\w?)\s(\d+)(\w?)\s(\d+)(\w?)"), r"Paragraf \1 \2 \3 \4 \5 \6"),
+    ("§", re.compile(r"§+\s(\d+)(\w?)\s(\d+)(\w?)"), r"Paragraf \1 \2 \3 \4"),
+    ("§", re.compile(r"§+\s(\d+)(\w?)"), r"Paragraf \1 \2"),
+    ("Abs", re.compile(r"Abs.\s(\d+)(\w?)\s(\d+)(\w?)\s(\d+)(\w?)"), r"Absatz \1 \2 \3 \4 \5 \6"),
+    ("Abs", re.compile(r"Abs.\s(\d+)(\w?)\s(\d+)(\w?)"), r"Absatz \1 \2 \3 \4"),
+    ("Abs", re.compile(r"Abs.\s(\d+)(\w?)\sund\s(\d+)(\w?)"), r"Absatz \1 \2 und \3 \4"),
+    ("Abs", re.compile(r"Abs.\s(\d+)(\w?)"), r"Absatz \1 \2"),
+    ("Euro", re.compile(r"(\d+)\s(\d+)\sEuro"), r"\1\2 Euro"),
+    ("Euro", re.compile(r"\s1\sEuro"), r" ein Euro"),
+]
+
+
+def _replace_law_references(text):
+    for marker, regex, replacement in _LAW_REFERENCES:
+        if marker in text:
+            text = regex.sub(replacement, text)
+    return text
+
+
+# Abbreviations. "Dipl.-Ing." is a regex whose wildcards may match the first letter of an
+# abbreviation replaced before, or a "%" or "/" replaced after it.
+_WIENVIDEOS_ABBREVIATIONS = Replacements([
+    ("§", "Paragraf"),
+    ("Dr.", "Doktor"),
+    ("Mag.", "Magister"),
+    ("TVthek", "T. V. thek"),
+    ("z.B.", "zum beispiel"),
+    ("d.h.", "das heißt"),
+])
+_WIENVIDEOS_SYMBOLS = Replacements([
+    ("Ing.", "Ingenieur"),
+    ("%", " Prozent"),
+    ("/", " "),
+])
+_PARLAMENT_ABBREVIATIONS = Replacements([
+    ("§", "Paragraf"),
+    ("Dr.", "Doktor"),
+    ("Mag.", "Magister"),
+    ("TVthek", "T. V. thek"),
+])
+_PARLAMENT_SYMBOLS = Replacements([
+    ("Ing.", "Ingenieur"),
+    ("%", " Prozent"),
+    ("/", " / "),
+])
+_DIPLOMINGENIEUR = re.compile(r"Dipl.-Ing.")
+
+# Dashes become spaces, punctuation that is not pronounced is removed
+_PARLAMENT_PUNCTUATION = [
+    ("–", " "),
+    ("-", " "),
+    (":", ""),
+    (";", ""),
+    ("!", ""),
+    ("\xad", ""),  # Soft hyphen
+    ("?", ""),
+    ("“", ""),
+    ("„", ""),
+]
+_WIENVIDEOS_PUNCTUATION = [
+    ("–", " "),
+    ("-", " "),
+    ("@", " "),
+    (":", ""),
+    (";", ""),
+    ("!", ""),
+    ("\xad", ""),  # Soft hyphen
+    ("?", ""),
+    ("“", ""),
+    ("„", ""),
+    ("[", ""),
+    ("]", ""),
+]
+
+# The pre-processing of the subtitles separates numbers from the surrounding words
+_DIGIT = re.compile(r"\d")
+_THOUSANDS_SEPARATOR = re.compile(r"(\s?\d+)\.(\d\d\d\s?)")
+_ORDINAL_DOT = re.compile(r"(\d+)\.(\w+)")
+_NUMBER_BEFORE_WORD = re.compile(r"\s?(\d+)([^\d]+)\s?")
+_WORD_BEFORE_NUMBER = re.compile(r"\s?([^\d]+)(\d+)\s?")
+
+# Backslashes mark spelled letters, e.g. "O\ R\ F\", they are removed with the dots
+_AFTER_NUMBERS_DELETIONS = [(".", ""), ("\\", ""), (",", ""), ("/", ""), ("\"", "")]
+_PARENTHESES_NOISE = re.compile(r"\([^()]*\).")
+_PARENTHESES_NOISE_AT_END = re.compile(r"\([^()]*\)")
+_ASTERISK_NOISE = re.compile(r"\*[^*]*\*")
+_COMMENT_NOISE = re.compile(r"^# .*")
+_MULTI_SPACES = re.compile(r"(\s)\s+")
+
+_PARLAMENT_CHARACTERS = [
+    ("‘", ""),
+    ("‚", ""),
+    ("à", "a"),
+    ("é", "e"),
+    ("ı", "i"),
+    ("‑", " "),
+    (")", ""),
+]
+_WIENVIDEOS_CHARACTERS = [
+    ("‘", ""),
+    ("‚", ""),
+    ("à", "a"),
+    ("é", "e"),
+    ("ı", "i"),
+    ("‑", " "),
+    (")", ""),
+    ("(", ""),
+    ("+", " plus"),
+    ("ç", "c"),
+    ("&", " und "),
+]
+# These may overlap each other, so the order matters
+_WIENVIDEOS_WORDS = [
+    ("'s", " 's"),
+    ("8erln", "achterln"),
+    ("90ern", "neunzigern"),
+    ("29er", "neun und zwanziger"),
+    ("48er", "acht und vierziger"),
+    ("’s", " 's"),
+    ("tschhhh", "[spoken-noise]"),
+    ("mmmmmhhh", "mh"),
+    (" i i i ", " drei "),
+    (" i i ", " zwei "),
+]
+_WIENVIDEOS_FINAL_CHARACTERS = [
+    ("=", ""),
+    ("_", " "),
+]
+
+
+def _replace_all(text, replacements):
+    for old, new in replacements:
+        text = text.replace(old, new)
+    return text
+
+
+def _is_year(num):
+    return num > 1920 and num < 2100
+
+
+def _roman_to_words(word):
+    num = 0
+    index = 0
+    for numeral, integer in romanNumeralMap:
+        while word[index:index + len(numeral)] == numeral:
+            num += integer
+            index += len(numeral)
+    return verbalize(num)
+
+
+def _spell_out(word, text):
+    for letter in word:
+        if letter.isdigit():
+            try:
+                # Check if it's a year at the end of a sentence
+                num = int(letter)
+                if _is_year(num):
+                    text.append(verbalize(num, YEAR))
+                else:
+                    text.append(verbalize(num))
+            except ValueError:
+                print(f"ValueError: '{letter}'")
+        else:
+            text.append(letter+"\\ ")
+
+
+def _ordinal_or_year(word, text):
+    try:
+        # Check if it's a year at the end of a sentence
+        num = int(word[:-1])
+        if _is_year(num):
+            text.append(verbalize(num, YEAR))
+        else:
+            text.append(verbalize(num, ORDINAL))
+    except ValueError:
+        print(f"ValueError: '{word}'")
+
+
+def _clock_time(seg, text):
+    text.append(verbalize(int(seg[0])))
+    text.append("Uhr")
+    text.append(verbalize(int(seg[1])))
+
+
+def _cardinal(word, word_idx, words, text):
+    try:
+        num = int(word)
+        # Sometimes, 10000 is written as "10&nbsp;000", which is turned into "10 0000"
+        # so we have to check if the next word is all digits
+        if len(words) > word_idx+1 and words[word_idx+1].isdigit():
+            num = num*1000 + int(words[word_idx+1])
+            # If we have 10 000 000:
+            if len(words) > word_idx+2 and words[word_idx+2].isdigit():
+                num = num*1000 + int(words[word_idx+2])
+                del words[word_idx+2]
+            del words[word_idx+1]
+            text.append(verbalize(num))
+        elif _is_year(num):
+            # Likely a year
+            text.append(verbalize(num, YEAR))
+        else:
+            text.append(verbalize(num))
+    except ValueError:
+        print(f"ValueError: '{word_idx}' '{word}' '{words[word_idx+1]}'")
+
+
+def _decimal(word, text, context):
+    seg = word.split(',')
+    if len(seg) > 1:
+        if seg[1] == "00":
+            # Euro amount, ignore second part, it's not pronounced
+            text.append(verbalize(int(seg[0])))
+        elif len(seg[0]) > 0 and len(seg[1]) > 0:
+            text.append(verbalize(int(seg[0])))
+            text.append("Komma")
+            for letter in seg[1]:
+                if letter.isdigit():
+                    text.append(verbalize(int(letter)))
+        elif word[-1] == ',':
+            text.append(verbalize(int(seg[0])))
+        else:
+            print(f"{context} {word}", file=sys.stderr)
+
+
+def _date(seg, text):
+    if len(seg) > 2:
+        text.append(verbalize(int(seg[0]), ORDINAL))
+        text.append(verbalize(int(seg[1]), ORDINAL))
+        if len(seg[2]) > 0:
+            text.append(verbalize(int(seg[2]), YEAR))
+
+
+def _verbalize_parlament(words, context):
+    text = []
+    for word_idx, word in enumerate(words):
+        if word.isalpha():
+            # Plain words can only match the last two cases below
+            pass
+        # Is it a number of some kind?
+        elif word.replace('.','',1).isdigit():
+            if word[-1] == ".":
+                _ordinal_or_year(word, text)
+            else:
+                seg = word.split('.')
+                if len(seg) > 1:
+                    if len(seg[0]) > 2 and len(seg[1]) > 2:
+                        # z.B. "500.000"
+                        text.append(verbalize(int("".join(seg))))
+                    elif len(words) > word_idx+1 and words[word_idx+1] == "Uhr":
+                        # z.B. "19.15 Uhr"
+                        _clock_time(seg, text)
+                        del words[word_idx+1]
+                    else:
+                        # z.b. Web 2.0
+                        text.append(verbalize(int(seg[0])))
+                        text.append("Punkt")
+                        text.append(verbalize(int(seg[1])))
+                else:
+                    _cardinal(word, word_idx, words, text)
+            continue
+        elif word.replace(',','',1).isdigit():
+            _decimal(word, text, context)
+            continue
+        elif word.replace('.','').isdigit():
+            # Possibly a date?
+            try:
+                _date(word.split('.'), text)
+            except ValueError:
+                print(f"ValueError: '{word}' '{words[word_idx+1]}'")
+            continue
+        if word.upper() == word:
+            if romanNumeralPattern.search(word):
+                text.append(_roman_to_words(word))
+            # Possibly an abbreviation?
+            elif not word.upper() in ALPHABETISMS:
+                _spell_out(word, text)
+            else:
+                text.append(word)
+        else:
+            text.append(word)
+    return text
+
+
+def _verbalize_wienvideos(words, context):
+    text = []
+    for word_idx, word in enumerate(words):
+        word = word.strip(r"'’\"")
+        if len(word) == 0:
+            continue
+        if word.isalpha():
+            # Plain words can only match the last two cases below
+            pass
+        # Is it a number of some kind?
+        elif word.strip('.').replace('.','', 1).isdigit():
+            if word[-1] == ".":
+                _ordinal_or_year(word, text)
+            else:
+                seg = word.split('.')
+                if len(seg) > 1:
+                    if len(seg[0]) >= 1 and len(seg[1]) > 2:
+                        # z.B. "500.000"
+                        text.append(verbalize(int("".join(seg))))
+                    elif len(words) > word_idx+1 and words[word_idx+1] == "Uhr":
+                        # z.B. "19.15 Uhr"
+                        _clock_time(seg, text)
+                        del words[word_idx+1]
+                    elif len(seg[0]) > 0 and len(seg[1]) == 2:
+                        _clock_time(seg, text)
+                    elif len(seg[0]) > 0:
+                        print(f"Punkt: {word}")
+                        # z.b. Web 2.0
+                        text.append(verbalize(int(seg[0])))
+                        text.append("Punkt")
+                        text.append(verbalize(int(seg[1])))
+                else:
+                    _cardinal(word, word_idx, words, text)
+            continue
+        elif word.replace(',','',1).isdigit():
+            _decimal(word, text, context)
+            continue
+        elif word.replace('.','').isdigit():
+            # Possibly a date?
+            try:
+                _date(word.split('.'), text)
+            except ValueError:
+                if word_idx+1 < len(words):
+                    print(f"ValueError: '{word}' '{words[word_idx+1]}'")
+                else:
+                    print(f"ValueError: '{word}' is last word")
+            continue
+        elif word.replace('.','').replace('er','').isdigit():
+            # 48er, 44er etc.
+            word = word.replace('.','')
+            num = int(word.replace('er', ''))
+            if _is_year(num):
+                text.append(f"{verbalize(int(word[0:2]))} {verbalize(int(word[2:4]))}er")
+            else:
+                text.append(f"{verbalize(num)}er")
+            continue
+        elif word.replace('.','').replace('ern','').isdigit():
+            # 48ern, 44ern etc.
+            word = word.replace('.','')
+            num = int(word.replace('ern', ''))
+            if _is_year(num):
+                text.append(f"{verbalize(int(word[0:2]))} {verbalize(int(word[2:4]))}ern")
+            else:
+                text.append(f"{verbalize(num)}ern")
+            continue
+        elif word.split('.')[0].lower() == "www" and len(word.split('.')) >= 3:
+            end_idx = -1
+            if len(word.split('.')[end_idx]) == 0:
+                end_idx -= 1
+            parts = word.split('.')[1:end_idx]
+            text.append("w w w")
+            for part in parts:
+                text.append("punkt")
+                text.append(part)
+            text.append("punkt")
+            tld = str(word.split('.')[end_idx])
+            if tld == 'com' or tld == 'org' or tld == 'net':
+                text.append(tld)
+            else:
+                text.append(' '.join([letter for letter in tld]))
+            continue
+        elif len(word.replace('.', '')) > 0 and word.replace('.', '')[-1] == '€':
+            print(word)
+            word = word.replace('.', '').replace(',','')[:-1]
+            if len(word) > 0:
+                text.append(verbalize(int(word)))
+                text.append('euro')
+            continue
+        if word.upper() == word:
+            if romanNumeralPattern.search(word):
+                text.append(_roman_to_words(word))
+            # Possibly an abbreviation?
+            elif not word.upper() in WIENVIDEOS_ALPHABETISMS and len(word) < 7:
+                _spell_out(word, text)
+            else:
+                text.append(word.lower())
+        else:
+            if word in expand_words:
+                word = expand_words[word]
+            text.append(word)
+    return text
+
+
+def normalize_parlament(text, context=''):
+    """Normalizes a paragraph of a stenographic protocol of the Austrian parliament."""
+    # Conversion BEFORE number replacement
+    text = text.replace("\n", " ")
+    text = text.replace("[...]", " ")
+    text = _replace_law_references(text)
+    text = _PARLAMENT_ABBREVIATIONS(text)
+    text = _DIPLOMINGENIEUR.sub("Diplomingenieur", text)
+    text = _PARLAMENT_SYMBOLS(text)
+    text = text.replace(", ", " , ")
+    text = _replace_all(text, _PARLAMENT_PUNCTUATION)
+
+    # Number replacement
+    text = ' '.join(_verbalize_parlament(text.split(), context))
+
+    # Conversion AFTER number replacement
+    text = _replace_all(text, _AFTER_NUMBERS_DELETIONS)
+    if "(" in text:
+        text = _PARENTHESES_NOISE.sub(" [spoken-noise] ", text)
+        text = _PARENTHESES_NOISE_AT_END.sub(" [spoken-noise] ", text)
+    text = _replace_all(text, _PARLAMENT_CHARACTERS)
+    text = _MULTI_SPACES.sub(r"\1", text)  # Multi spaces
+    return text.strip().lower()
+
+
+def normalize_wienvideos(text, context=''):
+    """Normalizes a subtitle of a video of the City of Vienna."""
+    # Conversion BEFORE number replacement
+    text = text.replace("\n", " ")
+    text = text.replace("...", " . ")
+    text = text.replace("..", " . ")
+    if _DIGIT.search(text):
+        text = _THOUSANDS_SEPARATOR.sub(r"\1\2", text)
+        text = _ORDINAL_DOT.sub(r"\1. \2", text)
+        text = _NUMBER_BEFORE_WORD.sub(r" \1 \2 ", text)
+        text = _WORD_BEFORE_NUMBER.sub(r" \1 \2 ", text)
+    text = text.replace("…", "")
+    text = _replace_law_references(text)
+    text = _WIENVIDEOS_ABBREVIATIONS(text)
+    text = _DIPLOMINGENIEUR.sub("Diplomingenieur", text)
+    text = _WIENVIDEOS_SYMBOLS(text)
+    text = text.replace(",--", "")
+    text = text.replace(", ", " , ")
+    if text.endswith(","):
+        text = text[:-1]
+    text = _replace_all(text, _WIENVIDEOS_PUNCTUATION)
+
+    # Number replacement
+    text = ' '.join(_verbalize_wienvideos(text.split(), context))
+
+    # Conversion AFTER number replacement
+    text = _replace_all(text, _AFTER_NUMBERS_DELETIONS)
+    if "(" in text:
+        text = _PARENTHESES_NOISE.sub(" [spoken-noise] ", text)
+    if "*" in text:
+        text = _ASTERISK_NOISE.sub(" [noise] ", text)
+    text = _COMMENT_NOISE.sub("[noise]", text)
+    text = _replace_all(text, _WIENVIDEOS_CHARACTERS)
+    text = _replace_all(text, _WIENVIDEOS_WORDS)
+    text = _replace_all(text, _WIENVIDEOS_FINAL_CHARACTERS)
+    text = _MULTI_SPACES.sub(r"\1", text)  # Multi spaces
+    return text.strip().lower()
+
+
+NORMALIZERS = {
+    'parlament': normalize_parlament,
+    'wienvideos': normalize_wienvideos,
+}
+
+
+def normalize(text, corpus='parlament', context=''):
+    """Normalizes a transcript for ASR training: numbers, abbreviations and symbols are written
+    out as words, punctuation is removed, and the result is lower case.
+
+    `corpus` selects the rule set ('parlament' or 'wienvideos'), `context` (e.g. a timestamp)
+    is printed with warnings about tokens that could not be converted.
+    """
+    return NORMALIZERS[corpus](text, context)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Verbalization of numbers (German) for the text normalization in normalization.py.
+#
+# The same few thousand numbers (years, ordinals, clock times, single digits) occur millions of
+# times in the transcripts, so the results of num2words are cached in memory. Optionally, a table
+# with precomputed results can be loaded; it is memory-mapped, so loading it costs nothing, and it
+# makes the results independent of the installed version of num2words.
+#
+# Table format (all integers are unsigned 32 bit, little endian):
+#   magic b"N2WTABLE", version, number of sections, length of the num2words version string,
+#   the num2words version string (UTF-8), then for each section:
+#   mode, first number, count, position of the offsets, position of the data.
+#   Each section has count+1 offsets into its data; the UTF-8 words for number first+i are
+#   data[offsets[i]:offsets[i+1]].
+#
+# To build a table:
+#   python3 verbalizer.py /data/num2words_de.bin
+
+import argparse
+from array import array
+from functools import lru_cache
+from importlib import metadata
+import mmap
+import struct
+import sys
+from num2words import num2words
+
+CARDINAL = 'cardinal'
+ORDINAL = 'ordinal'
+YEAR = 'year'
+MODES = [CARDINAL, ORDINAL, YEAR]
+
+TABLE_MAGIC = b"N2WTABLE"
+TABLE_VERSION = 1
+
+_table = None
+
+
+class NumberTable:
+    """Memory-mapped table of precomputed verbalizations, see the format description above."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as table_file:
+            self.data = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(TABLE_MAGIC)] != TABLE_MAGIC:
+            raise ValueError(f"'{path}' is not a num2words table")
+        pos = len(TABLE_MAGIC)
+        version, num_sections, version_length = struct.unpack_from('<III', self.data, pos)
+        if version != TABLE_VERSION:
+            raise ValueError(f"'{path}' has table version {version}, expected {TABLE_VERSION}")
+        pos += 12
+        self.num2words_version = self.data[pos:pos + version_length].decode('utf-8')
+        pos += version_length
+        self.sections = {}
+        for _ in range(num_sections):
+            mode, first, count, offsets_pos, data_pos = struct.unpack_from('<IIIII', self.data, pos)
+            pos += 20
+            offsets = memoryview(self.data)[offsets_pos:offsets_pos + 4 * (count + 1)]
+            if sys.byteorder == 'little':
+                offsets = offsets.cast('I')
+            else:
+                offsets = array('I', offsets)
+                offsets.byteswap()
+            self.sections[MODES[mode]] = (first, count, offsets, data_pos)
+
+    def get(self, num, mode):
+        """Returns the words for `num`, or None if the number is not in the table."""
+        section = self.sections.get(mode)
+        if section is None:
+            return None
+        first, count, offsets, data_pos = section
+        idx = num - first
+        if idx < 0 or idx >= count:
+            return None
+        return self.data[data_pos + offsets[idx]:data_pos + offsets[idx + 1]].decode('utf-8')
+
+
+def load_table(path):
+    """Uses the precomputed table at `path` for all following calls of verbalize()."""
+    global _table
+    _table = NumberTable(path)
+    return _table
+
+
+@lru_cache(maxsize=1 << 16)
+def _num2words(num, mode):
+    if mode == ORDINAL:
+        return num2words(num, ordinal=True, lang="de")
+    if mode == YEAR:
+        return num2words(num, to="year", lang="de")
+    return num2words(num, lang="de")
+
+
+def verbalize(num, mode=CARDINAL):
+    """Returns the German words for the integer `num`, as cardinal, ordinal or year."""
+    if _table is not None:
+        words = _table.get(num, mode)
+        if words is not None:
+            return words
+    return _num2words(num, mode)
+
+
+def build_table(path, max_number=10**6, first_year=1920, last_year=2100):
+    """Writes a table with cardinals and ordinals for 0..max_number and the years
+    first_year..last_year."""
+    sections = [
+        (CARDINAL, 0, max_number + 1),
+        (ORDINAL, 0, max_number + 1),
+        (YEAR, first_year, last_year - first_year + 1),
+    ]
+    version = metadata.version('num2words').encode('utf-8')
+    header_length = len(TABLE_MAGIC) + 12 + len(version) + 20 * len(sections)
+    section_headers = []
+    blobs = []
+    pos = header_length
+    for mode, first, count in sections:
+        print(f"Verbalizing {count} numbers as {mode}")
+        offsets = array('I', [0])
+        data = bytearray()
+        for num in range(first, first + count):
+            data += _num2words.__wrapped__(num, mode).encode('utf-8')
+            offsets.append(len(data))
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        offsets = offsets.tobytes()
+        section_headers.append(struct.pack('<IIIII', MODES.index(mode), first, count, pos, pos + len(offsets)))
+        blobs += [offsets, data]
+        pos += len(offsets) + len(data)
+    with open(path, 'wb') as table_file:
+        table_file.write(TABLE_MAGIC)
+        table_file.write(struct.pack('<III', TABLE_VERSION, len(sections), len(version)))
+        table_file.write(version)
+        for section_header in section_headers:
+            table_file.write(section_header)
+        for blob in blobs:
+            table_file.write(blob)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds a table of precomputed German number words.")
+    parser.add_argument("table", type=str)
+    parser.add_argument("--max-number", type=int, default=10**6)
+    parser.add_argument("--first-year", type=int, default=1920)
+    parser.add_argument("--last-year", type=int, default=2100)
+    args = parser.parse_args()
+    build_table(args.table, args.max_number, args.first_year, args.last_year)